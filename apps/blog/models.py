@@ -96,6 +96,9 @@ class BlogPost(models.Model):
         verbose_name = 'مقاله وبلاگ'
         verbose_name_plural = 'مقالات وبلاگ'
         ordering = ['-published_at', '-created_at']
+        indexes = [
+            models.Index(fields=['status', 'published_at', 'id']),
+        ]
     
     def __str__(self):
         return self.title
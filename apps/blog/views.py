@@ -3,10 +3,12 @@ from django.views.generic import ListView, DetailView
 from django.http import JsonResponse
 from django.views.decorators.http import require_GET
 from django.db.models import Q
+from apps.core.counters import record_view
+from apps.core.pagination import KeysetPaginationMixin
 from .models import BlogPost, BlogCategory, BlogTag
 
 
-class BlogListView(ListView):
+class BlogListView(KeysetPaginationMixin, ListView):
     """لیست مقالات وبلاگ"""
     model = BlogPost
     template_name = 'blog/post_list.html'
@@ -60,9 +62,8 @@ class BlogDetailView(DetailView):
     
     def get_object(self):
         obj = super().get_object()
-        # افزایش تعداد بازدید
-        obj.view_count += 1
-        obj.save(update_fields=['view_count'])
+        # ثبت بازدید در شمارنده بافرشده
+        record_view(self.request, obj)
         return obj
     
     def get_context_data(self, **kwargs):
@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class CartConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.cart'
-    verbose_name = 'سبد خرید'
\ No newline at end of file
+    verbose_name = 'سبد خرید'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
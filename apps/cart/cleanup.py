@@ -0,0 +1,155 @@
+"""
+پاکسازی سبدهای رها شده و sessionهای منقضی
+
+همه مراحل در دسته‌های کوچک بر اساس بازه کلید اصلی اجرا می‌شوند و هر دسته
+تراکنش کوتاه خودش را دارد تا در کنار ترافیک زنده قفل طولانی ایجاد نشود.
+پیش از حذف هر سبد، موجودی رزرو شده آن بازگردانده می‌شود (حذف آبشاری
+رزروها موجودی را آزاد نمی‌کند).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import F, Max, Min, Q
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import inventory
+from .models import Cart, StockReservation
+
+CLEANUP_BATCH_SIZE = 1000
+DEFAULT_STALE_CART_DAYS = 30
+DEFAULT_ABANDONED_CART_HOURS = 24
+DATABASE_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+def _with_last_activity(queryset):
+    # updated_at سبد با تغییر آیتم‌ها به‌روز نمی‌شود
+    return queryset.annotate(
+        last_activity=Greatest('updated_at', Coalesce(Max('items__updated_at'), 'updated_at'))
+    )
+
+
+def _delete_carts(cart_ids):
+    """آزاد کردن موجودی رزرو شده و حذف سبدها در یک تراکنش کوتاه"""
+    with transaction.atomic():
+        released = inventory.release_reservations(
+            StockReservation.objects.filter(cart_id__in=cart_ids)
+        )
+        deleted = Cart.objects.filter(pk__in=cart_ids).delete()[1].get(Cart._meta.label, 0)
+    return released, deleted
+
+
+def _pk_windows(batch_size):
+    """بازه‌های متوالی کلید اصلی سبدها"""
+    bounds = Cart.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    low = bounds['low']
+    while low <= bounds['high']:
+        yield low, low + batch_size
+        low += batch_size
+
+
+def delete_stale_carts(batch_size=CLEANUP_BATCH_SIZE):
+    """
+    حذف سبدهای بدون فعالیت
+    
+    سبدهای جلسه‌ای (مهمان) پس از انقضای session و سبدهای کاربران پس از
+    CART_STALE_DAYS روز بدون فعالیت حذف می‌شوند.
+    """
+    now = timezone.now()
+    user_cutoff = now - timedelta(days=getattr(settings, 'CART_STALE_DAYS', DEFAULT_STALE_CART_DAYS))
+    session_cutoff = now - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+    stats = {'carts': 0, 'reservations': 0}
+    
+    for low, high in _pk_windows(batch_size):
+        cart_ids = list(
+            _with_last_activity(Cart.objects.filter(pk__gte=low, pk__lt=high))
+            .filter(
+                Q(user__isnull=False, last_activity__lt=user_cutoff)
+                | Q(user__isnull=True, last_activity__lt=session_cutoff)
+                | Q(user__isnull=True, session__isnull=True)
+            )
+            .values_list('pk', flat=True)
+        )
+        if cart_ids:
+            released, deleted = _delete_carts(cart_ids)
+            stats['carts'] += deleted
+            stats['reservations'] += released
+    return stats
+
+
+def delete_expired_sessions(batch_size=CLEANUP_BATCH_SIZE):
+    """
+    حذف دسته‌ای sessionهای منقضی
+    
+    برخلاف clearsessions که همه را با یک DELETE حذف می‌کند، sessionها به
+    ترتیب کلید در دسته‌های کوچک حذف می‌شوند و سبدهای وابسته پیش از آن
+    آزاد و حذف می‌شوند.
+    """
+    stats = {'sessions': 0, 'carts': 0, 'reservations': 0}
+    if settings.SESSION_ENGINE not in DATABASE_SESSION_ENGINES:
+        return stats
+    
+    now = timezone.now()
+    last_key = ''
+    while True:
+        session_keys = list(
+            Session.objects.filter(expire_date__lt=now, session_key__gt=last_key)
+            .order_by('session_key')
+            .values_list('session_key', flat=True)[:batch_size]
+        )
+        if not session_keys:
+            break
+        last_key = session_keys[-1]
+        
+        cart_ids = list(Cart.objects.filter(session_id__in=session_keys).values_list('pk', flat=True))
+        if cart_ids:
+            released, deleted = _delete_carts(cart_ids)
+            stats['carts'] += deleted
+            stats['reservations'] += released
+        
+        deleted, _ = Session.objects.filter(session_key__in=session_keys, expire_date__lt=now).delete()
+        stats['sessions'] += deleted
+    return stats
+
+
+def collect_abandoned_carts(batch_size=CLEANUP_BATCH_SIZE):
+    """
+    یافتن سبدهای رها شده کاربران برای ارسال یادآوری
+    
+    سبدهای دارای آیتم که بیش از CART_ABANDONED_HOURS ساعت بدون فعالیت
+    مانده‌اند و پس از آخرین فعالیتشان یادآوری دریافت نکرده‌اند علامت‌گذاری
+    می‌شوند. خروجی لیست (شماره تلفن، نام) کاربران است.
+    """
+    now = timezone.now()
+    hours = getattr(settings, 'CART_ABANDONED_HOURS', DEFAULT_ABANDONED_CART_HOURS)
+    abandoned_cutoff = now - timedelta(hours=hours)
+    stale_cutoff = now - timedelta(days=getattr(settings, 'CART_STALE_DAYS', DEFAULT_STALE_CART_DAYS))
+    recipients = []
+    
+    for low, high in _pk_windows(batch_size):
+        with transaction.atomic():
+            carts = list(
+                _with_last_activity(Cart.objects.filter(
+                    pk__gte=low,
+                    pk__lt=high,
+                    user__isnull=False,
+                    user__is_active=True,
+                    user__profile__sms_notifications=True,
+                    items__isnull=False,
+                ))
+                .filter(last_activity__lt=abandoned_cutoff, last_activity__gte=stale_cutoff)
+                .filter(Q(reminder_sent_at__isnull=True) | Q(reminder_sent_at__lt=F('last_activity')))
+                .select_related('user')
+            )
+            if not carts:
+                continue
+            Cart.objects.filter(pk__in=[cart.pk for cart in carts]).update(reminder_sent_at=now)
+        recipients.extend((str(cart.user.phone), cart.user.first_name) for cart in carts)
+    return recipients
@@ -1,15 +1,8 @@
-from .models import Cart
+from .summary import LazyCart
 
 
 def cart(request):
-    """اضافه کردن سبد خرید به context"""
-    cart = None
-    
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    elif request.session.session_key:
-        cart, created = Cart.objects.get_or_create(session_id=request.session.session_key)
-    
+    """اضافه کردن سبد خرید (تنبل) به context"""
     return {
-        'cart': cart,
-    }
\ No newline at end of file
+        'cart': LazyCart(request),
+    }
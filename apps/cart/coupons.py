@@ -0,0 +1,111 @@
+"""
+کوپن‌های تخفیف
+
+جستجوی کد کوپن از کش خوانده می‌شود (با ذخیره موقت کدهای ناموجود) و با
+ذخیره یا حذف کوپن باطل می‌شود. مصرف کوپن هنگام ثبت سفارش با یک UPDATE
+شرطی F() انجام می‌شود تا در فروش‌های هم‌زمان بیش از usage_limit مصرف
+نشود؛ سقف استفاده هر کاربر با قفل کوتاه روی ردیف کاربر و شمارش
+CouponUsage کنترل می‌شود.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Coupon, CouponUsage
+
+COUPON_CACHE_KEY = 'coupon:code:{}'
+COUPON_CACHE_TIMEOUT = 60 * 15
+MISSING_COUPON_TIMEOUT = 60
+MISSING = 'missing'
+NO_DISCOUNT_MESSAGE = 'مبلغ سبد پس از تخفیف‌های ویژه به حداقل خرید این کوپن نمی‌رسد'
+
+
+class CouponError(Exception):
+    """کوپن قابل استفاده نیست"""
+    pass
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+def coupon_cache_key(code):
+    return COUPON_CACHE_KEY.format(normalize_code(code))
+
+
+def get_coupon(code):
+    """کوپن با کد مشخص (از کش) یا None"""
+    code = normalize_code(code)
+    if not code:
+        return None
+    
+    key = coupon_cache_key(code)
+    coupon = cache.get(key)
+    if coupon is None:
+        coupon = Coupon.objects.filter(code=code).first()
+        cache.set(key, coupon or MISSING, COUPON_CACHE_TIMEOUT if coupon else MISSING_COUPON_TIMEOUT)
+    return None if coupon == MISSING else coupon
+
+
+def get_applied_coupon(request):
+    """کوپن اعمال شده در session (در صورت وجود)"""
+    applied = request.session.get('applied_coupon')
+    return get_coupon(applied['code']) if applied else None
+
+
+def invalidate_coupon(code):
+    cache.delete(coupon_cache_key(code))
+
+
+def redeem_coupon(coupon, user, order, discount_amount):
+    """
+    مصرف اتمیک کوپن برای یک سفارش
+    
+    باید داخل تراکنش ثبت سفارش فراخوانی شود؛ در صورت عدم امکان استفاده
+    CouponError صادر و کل تراکنش برگردانده می‌شود.
+    """
+    from apps.accounts.models import User
+    
+    with transaction.atomic():
+        if coupon.usage_limit_per_user:
+            # سفارش‌های هم‌زمان یک کاربر پشت سر هم بررسی می‌شوند
+            list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+            if coupon.usage_count_for(user) >= coupon.usage_limit_per_user:
+                raise CouponError('شما قبلاً از این کوپن استفاده کرده‌اید')
+        
+        now = timezone.now()
+        redeemed = Coupon.objects.filter(
+            Q(usage_limit__isnull=True) | Q(used_count__lt=F('usage_limit')),
+            pk=coupon.pk,
+            is_active=True,
+            valid_from__lte=now,
+            valid_until__gte=now,
+        ).update(used_count=F('used_count') + 1)
+        if not redeemed:
+            raise CouponError('ظرفیت استفاده از این کوپن به پایان رسیده است')
+        
+        CouponUsage.objects.create(
+            coupon=coupon,
+            user=user,
+            order=order,
+            discount_amount=discount_amount
+        )
+    
+    transaction.on_commit(lambda: invalidate_coupon(coupon.code))
+
+
+def release_coupon(order):
+    """بازگرداندن مصرف کوپن‌های یک سفارش (مثلاً پس از لغو)"""
+    with transaction.atomic():
+        usages = list(
+            CouponUsage.objects.select_for_update(of=('self',)).select_related('coupon').filter(order=order)
+        )
+        for usage in usages:
+            Coupon.objects.filter(pk=usage.coupon_id, used_count__gt=0).update(
+                used_count=F('used_count') - 1
+            )
+        CouponUsage.objects.filter(pk__in=[usage.pk for usage in usages]).delete()
+    
+    for usage in usages:
+        transaction.on_commit(lambda code=usage.coupon.code: invalidate_coupon(code))
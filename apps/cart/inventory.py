@@ -0,0 +1,334 @@
+"""
+رزرو موجودی سبد خرید
+
+موجودی فقط با به‌روزرسانی‌های شرطی F() تغییر می‌کند
+(``UPDATE ... SET stock_quantity = stock_quantity - n WHERE stock_quantity >= n``)
+تا در درخواست‌های هم‌زمان هیچ به‌روزرسانی از دست نرود و موجودی منفی نشود.
+تغییر موجودی همیشه آخرین دستور تراکنش است تا قفل سطر محصول پرتقاضا
+فقط برای مدت کوتاهی نگه داشته شود.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from apps.catalog.models import Product, ProductVariant
+from .models import StockReservation
+
+DEFAULT_RESERVATION_MINUTES = 30
+
+
+class InsufficientStock(Exception):
+    """موجودی کافی برای رزرو وجود ندارد"""
+    
+    def __init__(self, available, name=None):
+        self.available = available
+        self.name = name
+        subject = f'موجودی «{name}»' if name else 'موجودی'
+        super().__init__(f'{subject} کافی نیست. موجودی: {available}')
+
+
+def reservation_expiry():
+    minutes = getattr(settings, 'CART_RESERVATION_MINUTES', DEFAULT_RESERVATION_MINUTES)
+    return timezone.now() + timedelta(minutes=minutes)
+
+
+def _stock_target(product, variant):
+    if variant:
+        return ProductVariant.objects.filter(pk=variant.pk)
+    return Product.objects.filter(pk=product.pk)
+
+
+def take_stock(product, variant, quantity):
+    """کسر شرطی موجودی؛ در صورت کافی نبودن موجودی False برمی‌گرداند"""
+    if quantity <= 0:
+        return True
+    updated = _stock_target(product, variant).filter(
+        stock_quantity__gte=quantity
+    ).update(stock_quantity=F('stock_quantity') - quantity)
+    return bool(updated)
+
+
+def return_stock(product, variant, quantity):
+    """بازگرداندن موجودی"""
+    if quantity > 0:
+        _stock_target(product, variant).update(stock_quantity=F('stock_quantity') + quantity)
+
+
+def reserve(cart, product, variant, quantity):
+    """
+    تنظیم مقدار رزرو شده یک محصول در سبد روی quantity
+    
+    فقط اختلاف با رزرو فعلی از موجودی کسر یا به آن بازگردانده می‌شود.
+    در صورت کافی نبودن موجودی InsufficientStock صادر و تراکنش برگردانده می‌شود.
+    """
+    if not product.track_inventory:
+        return
+    
+    with transaction.atomic():
+        reservation = StockReservation.objects.select_for_update().filter(
+            cart=cart, product=product, variant=variant
+        ).first()
+        reserved = reservation.quantity if reservation else 0
+        delta = quantity - reserved
+        
+        if quantity <= 0:
+            if reservation:
+                reservation.delete()
+        elif reservation:
+            reservation.quantity = quantity
+            reservation.expires_at = reservation_expiry()
+            reservation.save(update_fields=['quantity', 'expires_at'])
+        else:
+            StockReservation.objects.create(
+                cart=cart,
+                product=product,
+                variant=variant,
+                quantity=quantity,
+                expires_at=reservation_expiry()
+            )
+        
+        # به‌روزرسانی سطر محصول در انتهای تراکنش
+        if delta > 0:
+            if not take_stock(product, variant, delta):
+                stock = _stock_target(product, variant).values_list('stock_quantity', flat=True).first()
+                raise InsufficientStock(reserved + (stock or 0))
+        else:
+            return_stock(product, variant, -delta)
+
+
+def release(cart, product, variant):
+    """آزاد کردن رزرو یک محصول از سبد"""
+    reserve(cart, product, variant, 0)
+
+
+def _stock_key(product, variant):
+    return ('variant', variant.pk) if variant else ('product', product.pk)
+
+
+def reserve_lines(cart, lines):
+    """
+    رزرو دسته‌ای موجودی چند آیتم (product, variant, quantity) با تعداد ثابتی کوئری
+    
+    سطرهای محصولات و تنوع‌ها به ترتیب کلید اصلی قفل می‌شوند، مقدار قابل رزرو
+    هر آیتم (حداکثر موجودی فعلی) محاسبه و با یک UPDATE ... CASE کسر می‌شود.
+    خروجی لیستی از مقدار رزرو شده هر آیتم به همان ترتیب ورودی است.
+    """
+    requested = Counter()
+    for product, variant, quantity in lines:
+        if product.track_inventory and quantity > 0:
+            requested[_stock_key(product, variant)] += quantity
+    
+    with transaction.atomic():
+        granted = {}
+        for model, kind in ((Product, 'product'), (ProductVariant, 'variant')):
+            ids = sorted(pk for key_kind, pk in requested if key_kind == kind)
+            if not ids:
+                continue
+            stock = dict(
+                model.objects.select_for_update().filter(pk__in=ids).order_by('pk')
+                .values_list('pk', 'stock_quantity')
+            )
+            quantities = {pk: min(requested[(kind, pk)], stock.get(pk, 0)) for pk in ids}
+            granted.update(((kind, pk), quantity) for pk, quantity in quantities.items())
+            
+            reserved = {pk: quantity for pk, quantity in quantities.items() if quantity}
+            if reserved:
+                whens = [When(pk=pk, then=Value(quantity)) for pk, quantity in reserved.items()]
+                model.objects.filter(pk__in=list(reserved)).update(
+                    stock_quantity=F('stock_quantity') - Case(*whens, default=Value(0), output_field=IntegerField())
+                )
+        
+        existing = {
+            (reservation.product_id, reservation.variant_id): reservation
+            for reservation in StockReservation.objects.select_for_update().filter(cart=cart)
+        }
+        expires_at = reservation_expiry()
+        changed, created = {}, []
+        results = []
+        for product, variant, quantity in lines:
+            if not product.track_inventory:
+                results.append(quantity)
+                continue
+            quantity = granted.get(_stock_key(product, variant), 0)
+            results.append(quantity)
+            if not quantity:
+                continue
+            
+            key = (product.pk, variant.pk if variant else None)
+            reservation = existing.get(key)
+            if reservation:
+                reservation.quantity += quantity
+                reservation.expires_at = expires_at
+                if reservation.pk:
+                    changed[reservation.pk] = reservation
+            else:
+                existing[key] = StockReservation(
+                    cart=cart, product=product, variant=variant, quantity=quantity, expires_at=expires_at
+                )
+                created.append(existing[key])
+        
+        StockReservation.objects.bulk_update(list(changed.values()), ['quantity', 'expires_at'])
+        StockReservation.objects.bulk_create(created)
+    return results
+
+
+def _case_update(model, field, amounts):
+    """تغییر یک ستون عددی چند سطر با یک UPDATE ... CASE"""
+    amounts = {pk: amount for pk, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    whens = [When(pk=pk, then=Value(amount)) for pk, amount in amounts.items()]
+    model.objects.filter(pk__in=list(amounts)).update(
+        **{field: F(field) + Case(*whens, default=Value(0), output_field=IntegerField())}
+    )
+
+
+def commit_checkout(cart, items):
+    """
+    ثبت قطعی موجودی آیتم‌های یک سفارش
+    
+    رزروهای سبد به فروش تبدیل می‌شوند (موجودی آن‌ها قبلاً کسر شده است) و
+    فقط اختلاف تعداد هر آیتم با مقدار رزرو شده از موجودی کسر یا به آن
+    بازگردانده می‌شود. سطرهای محصولات و سپس تنوع‌ها به ترتیب کلید اصلی قفل
+    می‌شوند (همان ترتیب reserve_lines) تا تسویه‌های هم‌زمان دچار بن‌بست نشوند.
+    باید در انتهای تراکنش ثبت سفارش فراخوانی شود تا قفل سطرهای پرتقاضا
+    کوتاه بماند؛ در صورت کافی نبودن موجودی InsufficientStock صادر می‌شود.
+    """
+    ordered, names, backorder = Counter(), {}, set()
+    sold = Counter()
+    for item in items:
+        sold[item.product_id] += item.quantity
+        if item.product.track_inventory:
+            key = _stock_key(item.product, item.variant)
+            ordered[key] += item.quantity
+            names[key] = str(item.variant or item.product)
+            if item.product.allow_backorder:
+                backorder.add(key)
+    
+    with transaction.atomic():
+        reservations = list(
+            StockReservation.objects.select_for_update().filter(cart=cart)
+            .values('pk', 'product_id', 'variant_id', 'quantity')
+        )
+        reserved = Counter()
+        for row in reservations:
+            key = ('variant', row['variant_id']) if row['variant_id'] else ('product', row['product_id'])
+            reserved[key] += row['quantity']
+        
+        for model, kind in ((Product, 'product'), (ProductVariant, 'variant')):
+            ids = {pk for key_kind, pk in list(ordered) + list(reserved) if key_kind == kind}
+            if kind == 'product':
+                # سطر محصولات فروخته شده برای افزایش sale_count هم در همین ترتیب قفل می‌شود
+                ids.update(sold)
+            ids = sorted(ids)
+            if not ids:
+                continue
+            stock = dict(
+                model.objects.select_for_update().filter(pk__in=ids).order_by('pk')
+                .values_list('pk', 'stock_quantity')
+            )
+            changes = {}
+            for pk in ids:
+                key = (kind, pk)
+                needed = ordered[key] - reserved[key]
+                available = stock.get(pk, 0)
+                if needed > available:
+                    if key not in backorder:
+                        raise InsufficientStock(reserved[key] + available, names.get(key))
+                    needed = available
+                changes[pk] = -needed
+            _case_update(model, 'stock_quantity', changes)
+        
+        StockReservation.objects.filter(pk__in=[row['pk'] for row in reservations]).delete()
+        _case_update(Product, 'sale_count', sold)
+
+
+def touch_reservations(cart):
+    """تمدید زمان انقضای رزروهای سبد فعال"""
+    StockReservation.objects.filter(cart=cart).update(expires_at=reservation_expiry())
+
+
+def merge_reservations(source, target):
+    """
+    انتقال رزروهای یک سبد به سبد دیگر (مثلاً هنگام ورود کاربر)
+    
+    مجموع موجودی رزرو شده تغییر نمی‌کند، بنابراین سطرهای محصولات قفل نمی‌شوند.
+    """
+    with transaction.atomic():
+        existing = {
+            (reservation.product_id, reservation.variant_id): reservation
+            for reservation in StockReservation.objects.select_for_update().filter(cart=target)
+        }
+        expires_at = reservation_expiry()
+        merged, moved = [], []
+        
+        for reservation in StockReservation.objects.select_for_update().filter(cart=source):
+            current = existing.get((reservation.product_id, reservation.variant_id))
+            if current:
+                current.quantity += reservation.quantity
+                current.expires_at = expires_at
+                merged.append(current)
+            else:
+                reservation.cart = target
+                reservation.expires_at = expires_at
+                moved.append(reservation)
+        
+        StockReservation.objects.bulk_update(merged, ['quantity', 'expires_at'])
+        StockReservation.objects.bulk_update(moved, ['cart', 'expires_at'])
+        StockReservation.objects.filter(cart=source).delete()
+
+
+def restore_reserved_stock(rows):
+    """
+    بازگرداندن موجودی مجموعه‌ای از رزروها
+    
+    مقادیر هر محصول/تنوع جمع زده می‌شوند و به‌روزرسانی‌ها به ترتیب کلید
+    اصلی انجام می‌شوند تا فرایندهای هم‌زمان دچار بن‌بست نشوند.
+    """
+    products, variants = Counter(), Counter()
+    for row in rows:
+        if row['variant_id']:
+            variants[row['variant_id']] += row['quantity']
+        else:
+            products[row['product_id']] += row['quantity']
+    
+    for model, quantities in ((Product, products), (ProductVariant, variants)):
+        for pk in sorted(quantities):
+            model.objects.filter(pk=pk).update(stock_quantity=F('stock_quantity') + quantities[pk])
+
+
+def release_reservations(queryset, batch_size=500):
+    """
+    آزاد کردن دسته‌ای رزروهای یک کوئری‌ست
+    
+    رزروهای قفل شده توسط تراکنش‌های دیگر (مثلاً پرداخت در حال انجام) رد
+    می‌شوند و در اجرای بعدی بررسی خواهند شد.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                queryset.select_for_update(skip_locked=True)
+                .order_by('pk')
+                .values('pk', 'product_id', 'variant_id', 'quantity')[:batch_size]
+            )
+            if not rows:
+                break
+            StockReservation.objects.filter(pk__in=[row['pk'] for row in rows]).delete()
+            restore_reserved_stock(rows)
+        released += len(rows)
+        if len(rows) < batch_size:
+            break
+    return released
+
+
+def release_expired_reservations(batch_size=500):
+    """آزاد کردن رزروهای منقضی شده"""
+    return release_reservations(
+        StockReservation.objects.filter(expires_at__lte=timezone.now()),
+        batch_size=batch_size
+    )
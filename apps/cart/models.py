@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.contrib.sessions.models import Session
+from django.utils.functional import cached_property
 from apps.catalog.models import Product, ProductVariant
 
 
@@ -21,6 +22,11 @@ class Cart(models.Model):
         blank=True,
         verbose_name='کاربر'
     )
+    reminder_sent_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='زمان ارسال یادآوری'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -34,20 +40,30 @@ class Cart(models.Model):
             return f'سبد خرید {self.user.full_name}'
         return f'سبد خرید جلسه {self.session.session_key}'
     
+    @cached_property
+    def summary(self):
+        """تعداد و مجموع قیمت آیتم‌ها با یک کوئری تجمعی (یک بار برای هر نمونه)"""
+        from .summary import compute_cart_summary
+        return compute_cart_summary(self.pk)
+    
+    def reset_summary(self):
+        """پاک کردن خلاصه محاسبه شده پس از تغییر آیتم‌ها"""
+        self.__dict__.pop('summary', None)
+    
     @property
     def total_items(self):
         """تعداد کل آیتم‌ها"""
-        return sum(item.quantity for item in self.items.all())
+        return self.summary['total_items']
     
     @property
     def total_price(self):
         """مجموع قیمت"""
-        return sum(item.total_price for item in self.items.all())
+        return self.summary['total_price']
     
     @property
     def is_empty(self):
         """بررسی خالی بودن سبد"""
-        return not self.items.exists()
+        return not self.summary['total_items']
 
 
 class CartItem(models.Model):
@@ -105,15 +121,68 @@ class CartItem(models.Model):
             return f'{self.product.name} - {self.variant.name}'
         return self.product.name
     
+    @staticmethod
+    def unit_price(product, variant=None):
+        """قیمت واحد بر اساس تنوع یا محصول"""
+        if variant and variant.price:
+            return variant.price
+        return product.price
+    
     def save(self, *args, **kwargs):
         # تنظیم قیمت بر اساس تنوع یا محصول
-        if self.variant and self.variant.price:
-            self.price = self.variant.price
-        else:
-            self.price = self.product.price
+        self.price = self.unit_price(self.product, self.variant)
         super().save(*args, **kwargs)
 
 
+class StockReservation(models.Model):
+    """
+    رزرو موجودی برای آیتم‌های سبد خرید
+    
+    موجودی محصول (یا تنوع) هنگام افزودن به سبد کسر و در این جدول ثبت
+    می‌شود. رزروهای منقضی شده توسط تسک دوره‌ای به موجودی بازگردانده می‌شوند.
+    """
+    
+    cart = models.ForeignKey(
+        Cart,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='سبد خرید'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='محصول'
+    )
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='تنوع'
+    )
+    quantity = models.PositiveIntegerField(
+        verbose_name='تعداد رزرو شده'
+    )
+    expires_at = models.DateTimeField(
+        verbose_name='زمان انقضا'
+    )
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'رزرو موجودی'
+        verbose_name_plural = 'رزروهای موجودی'
+        unique_together = ['cart', 'product', 'variant']
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f'{self.product_id} x {self.quantity} ({self.cart_id})'
+
+
 class Coupon(models.Model):
     """کوپن‌های تخفیف"""
     
@@ -169,6 +238,11 @@ class Coupon(models.Model):
         default=0,
         verbose_name='تعداد استفاده شده'
     )
+    usage_limit_per_user = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='حد استفاده هر کاربر'
+    )
     is_active = models.BooleanField(
         default=True,
         verbose_name='فعال'
@@ -216,12 +290,17 @@ class Coupon(models.Model):
         if self.minimum_amount and cart_total < self.minimum_amount:
             return False, f'حداقل مبلغ خرید {self.minimum_amount} تومان است'
         
-        # بررسی استفاده قبلی کاربر (اختیاری)
-        # if CouponUsage.objects.filter(coupon=self, user=user).exists():
-        #     return False, 'شما قبلاً از این کوپن استفاده کرده‌اید'
+        # بررسی سقف استفاده هر کاربر
+        if self.usage_limit_per_user and user and user.is_authenticated:
+            if self.usage_count_for(user) >= self.usage_limit_per_user:
+                return False, 'شما قبلاً از این کوپن استفاده کرده‌اید'
         
         return True, 'کوپن قابل استفاده است'
     
+    def usage_count_for(self, user):
+        """تعداد استفاده کاربر از کوپن"""
+        return CouponUsage.objects.filter(coupon=self, user=user).count()
+    
     def calculate_discount(self, cart_total):
         """محاسبه تخفیف"""
         if self.coupon_type == 'percentage':
@@ -269,6 +348,9 @@ class CouponUsage(models.Model):
         verbose_name = 'استفاده از کوپن'
         verbose_name_plural = 'استفاده‌های کوپن'
         unique_together = ['coupon', 'order']
+        indexes = [
+            models.Index(fields=['coupon', 'user']),
+        ]
     
     def __str__(self):
         return f'{self.coupon.code} - {self.user.full_name}'
\ No newline at end of file
@@ -0,0 +1,53 @@
+import logging
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .coupons import invalidate_coupon
+from .models import Cart, CartItem, Coupon
+from .storage import transfer_guest_cart
+from .summary import clear_cart_summary, refresh_cart_summary
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def update_cart_summary(sender, instance, **kwargs):
+    """به‌روزرسانی خلاصه کش شده سبد پس از تغییر آیتم‌ها"""
+    cart_id = instance.cart_id
+    
+    def refresh():
+        cart = Cart.objects.filter(pk=cart_id).first()
+        if cart:
+            refresh_cart_summary(cart)
+    
+    transaction.on_commit(refresh)
+
+
+@receiver(post_delete, sender=Cart)
+def clear_deleted_cart_summary(sender, instance, **kwargs):
+    """حذف خلاصه کش شده سبد حذف شده"""
+    user_id, session_key = instance.user_id, instance.session_id
+    transaction.on_commit(lambda: clear_cart_summary(user_id=user_id, session_key=session_key))
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidate_coupon_cache(sender, instance, **kwargs):
+    """باطل کردن کش جستجوی کد کوپن"""
+    code = instance.code
+    transaction.on_commit(lambda: invalidate_coupon(code))
+
+
+@receiver(user_logged_in)
+def persist_guest_cart(sender, request, user, **kwargs):
+    """ذخیره سبد مهمان در سبد کاربر پس از ورود"""
+    if request is None:
+        return
+    try:
+        transfer_guest_cart(request, user)
+    except Exception as e:
+        # سبد مهمان حفظ می‌شود و انتقال در درخواست بعدی دوباره تلاش می‌شود
+        logger.error(f"Guest cart transfer error for user {user.pk}: {e}")
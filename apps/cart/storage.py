@@ -0,0 +1,504 @@
+"""
+ذخیره‌سازی سبد خرید
+
+سبد کاربران وارد شده در جداول Cart/CartItem نگهداری می‌شود. سبد کاربران
+مهمان به صورت پیش‌فرض یک hash در Redis با TTL است
+(``cart:guest:<token>`` با فیلدهای ``<product_id>-<variant_id>``) تا
+بازدیدکنندگان و ربات‌ها ردیفی در پایگاه داده ایجاد نکنند. سبد مهمان فقط
+هنگام ورود کاربر در سبد پایگاه داده او ذخیره می‌شود (تسویه حساب نیز
+نیازمند ورود است).
+
+شناسه سبد مهمان (توکن Redis یا شناسه سبد پایگاه داده) در داده‌های session
+نگهداری می‌شود تا با تغییر کلید session هنگام ورود از دست نرود. کلاس ذخیره‌سازی سبد مهمان با تنظیم
+CART_GUEST_STORAGE قابل تغییر است.
+"""
+import logging
+import secrets
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+
+from apps.catalog.models import Product, ProductVariant, primary_image_prefetch
+from . import inventory
+from .inventory import InsufficientStock
+from .models import Cart, CartItem
+from .summary import (
+    CART_SUMMARY_TIMEOUT, EMPTY_SUMMARY, compute_cart_summary, refresh_cart_summary,
+    summarize_items, summary_key
+)
+
+logger = logging.getLogger(__name__)
+
+CART_TOKEN_SESSION_KEY = 'cart_token'
+CART_ID_SESSION_KEY = 'cart_id'
+CART_TRANSFER_PENDING_SESSION_KEY = 'cart_transfer_pending'
+GUEST_CART_KEY = 'cart:guest:{}'
+DEFAULT_GUEST_STORAGE = 'apps.cart.storage.RedisCartStorage'
+
+
+def make_item_id(product_id, variant_id=None):
+    return f'{product_id}-{variant_id or 0}'
+
+
+def parse_item_id(item_id):
+    product_id, _, variant_id = str(item_id).partition('-')
+    return int(product_id), int(variant_id or 0) or None
+
+
+def merge_cart_lines(cart, lines):
+    """
+    ادغام آیتم‌های (product, variant, quantity) در یک سبد پایگاه داده
+    
+    آیتم‌های فعلی سبد یک بار خوانده و تداخل‌ها روی (product, variant) در
+    حافظه حل می‌شوند؛ نتیجه با یک bulk_update و یک bulk_create نوشته می‌شود،
+    بنابراین تعداد کوئری‌ها به تعداد آیتم‌ها بستگی ندارد.
+    """
+    now = timezone.now()
+    
+    with transaction.atomic():
+        items = {
+            (item.product_id, item.variant_id): item
+            for item in CartItem.objects.select_for_update().filter(cart=cart)
+        }
+        changed, created = {}, []
+        
+        for product, variant, quantity in lines:
+            key = (product.pk, variant.pk if variant else None)
+            item = items.get(key)
+            if item:
+                item.quantity += quantity
+                item.updated_at = now
+                if item.pk:
+                    changed[item.pk] = item
+            else:
+                # bulk_create متد save را فراخوانی نمی‌کند، پس قیمت صریحاً تنظیم می‌شود
+                items[key] = CartItem(
+                    cart=cart,
+                    product=product,
+                    variant=variant,
+                    quantity=quantity,
+                    price=CartItem.unit_price(product, variant)
+                )
+                created.append(items[key])
+        
+        CartItem.objects.bulk_update(list(changed.values()), ['quantity', 'updated_at'])
+        CartItem.objects.bulk_create(created)
+    
+    # عملیات دسته‌ای سیگنال‌ها را اجرا نمی‌کند
+    transaction.on_commit(lambda: refresh_cart_summary(cart))
+
+
+class CartStorage(ABC):
+    """کلاس پایه ذخیره‌سازی سبد خرید"""
+    
+    def __init__(self, request):
+        self.request = request
+    
+    @property
+    @abstractmethod
+    def summary_cache_key(self):
+        """کلید کش خلاصه سبد (None اگر سبدی وجود ندارد)"""
+        pass
+    
+    @abstractmethod
+    def get_items(self):
+        """آیتم‌های سبد به همراه محصول، تنوع و تصویر اصلی"""
+        pass
+    
+    @abstractmethod
+    def add(self, product, variant, quantity):
+        """افزودن محصول به سبد"""
+        pass
+    
+    @abstractmethod
+    def update(self, item_id, quantity):
+        """تغییر تعداد یک آیتم و بازگرداندن آن"""
+        pass
+    
+    @abstractmethod
+    def remove(self, item_id):
+        """حذف یک آیتم از سبد"""
+        pass
+    
+    @abstractmethod
+    def compute_summary(self):
+        """محاسبه خلاصه سبد بدون ایجاد سبد"""
+        pass
+    
+    def persist(self, user):
+        """ذخیره سبد در سبد پایگاه داده کاربر پس از ورود"""
+        pass
+    
+    @cached_property
+    def summary(self):
+        return self.compute_summary()
+    
+    def reset_summary(self):
+        self.__dict__.pop('summary', None)
+    
+    @property
+    def total_items(self):
+        return self.summary['total_items']
+    
+    @property
+    def total_price(self):
+        return self.summary['total_price']
+    
+    @property
+    def is_empty(self):
+        return not self.summary['total_items']
+
+
+class DatabaseCartStorage(CartStorage):
+    """سبد خرید در جداول Cart و CartItem"""
+    
+    def _lookup(self):
+        if self.request.user.is_authenticated:
+            return {'user': self.request.user}
+        if self.request.session.session_key:
+            return {'session_id': self.request.session.session_key}
+        return None
+    
+    @property
+    def summary_cache_key(self):
+        if self.request.user.is_authenticated:
+            return summary_key(user_id=self.request.user.pk)
+        return summary_key(session_key=self.request.session.session_key)
+    
+    @cached_property
+    def cart(self):
+        """سبد موجود (بدون ایجاد)"""
+        lookup = self._lookup()
+        return Cart.objects.filter(**lookup).first() if lookup else None
+    
+    def get_or_create_cart(self):
+        if self.cart is None:
+            if not self.request.user.is_authenticated and not self.request.session.session_key:
+                self.request.session.create()
+            self.__dict__['cart'], created = Cart.objects.get_or_create(**self._lookup())
+            if not self.request.user.is_authenticated:
+                # کلید session هنگام ورود تغییر می‌کند ولی داده‌های آن حفظ می‌شود
+                self.request.session[CART_ID_SESSION_KEY] = self.cart.pk
+        return self.cart
+    
+    def get_items(self):
+        # آیتم‌ها از طریق join با سبد خوانده می‌شوند تا سبد جداگانه بارگذاری نشود
+        lookup = self._lookup()
+        if lookup is None:
+            return []
+        return list(
+            CartItem.objects.filter(**{f'cart__{field}': value for field, value in lookup.items()})
+            .select_related('product__brand', 'variant')
+            .prefetch_related(primary_image_prefetch('product__images'))
+        )
+    
+    @staticmethod
+    def add_to_cart(cart, product, variant, quantity):
+        """افزودن محصول به یک سبد پایگاه داده همراه با رزرو موجودی"""
+        with transaction.atomic():
+            cart_item, created = CartItem.objects.select_for_update().get_or_create(
+                cart=cart,
+                product=product,
+                variant=variant,
+                defaults={'quantity': quantity}
+            )
+            
+            if not created:
+                cart_item.quantity += quantity
+                cart_item.save()
+            
+            # رزرو موجودی (کسر شرطی؛ در صورت کمبود کل تراکنش برگردانده می‌شود)
+            inventory.reserve(cart, product, variant, cart_item.quantity)
+        return cart_item
+    
+    def add(self, product, variant, quantity):
+        cart = self.get_or_create_cart()
+        cart_item = self.add_to_cart(cart, product, variant, quantity)
+        inventory.touch_reservations(cart)
+        self.reset_summary()
+        return cart_item
+    
+    def _get_item(self, item_id):
+        return get_object_or_404(
+            CartItem.objects.select_related('cart', 'product', 'variant'),
+            pk=item_id,
+            cart=self.cart
+        )
+    
+    def update(self, item_id, quantity):
+        cart_item = self._get_item(item_id)
+        
+        with transaction.atomic():
+            cart_item.quantity = quantity
+            cart_item.save()
+            inventory.reserve(cart_item.cart, cart_item.product, cart_item.variant, quantity)
+        
+        inventory.touch_reservations(cart_item.cart)
+        self.reset_summary()
+        return cart_item
+    
+    def remove(self, item_id):
+        cart_item = self._get_item(item_id)
+        
+        with transaction.atomic():
+            cart_item.delete()
+            # بازگرداندن موجودی رزرو شده
+            inventory.release(cart_item.cart, cart_item.product, cart_item.variant)
+        
+        self.reset_summary()
+    
+    def compute_summary(self):
+        return compute_cart_summary(self.cart.pk) if self.cart else EMPTY_SUMMARY
+    
+    def persist(self, user):
+        """ادغام سبد مهمان (شناسه ذخیره شده در session) در سبد کاربر"""
+        cart_id = self.request.session.get(CART_ID_SESSION_KEY)
+        if not cart_id:
+            return
+        
+        session_cart = Cart.objects.filter(pk=cart_id, user__isnull=True).first()
+        if not session_cart:
+            self.request.session.pop(CART_ID_SESSION_KEY, None)
+            return
+        
+        user_cart, created = Cart.objects.get_or_create(user=user)
+        
+        with transaction.atomic():
+            lines = [
+                (item.product, item.variant, item.quantity)
+                for item in session_cart.items.select_related('product', 'variant')
+            ]
+            merge_cart_lines(user_cart, lines)
+            # موجودی این آیتم‌ها قبلاً رزرو شده و فقط رزروها منتقل می‌شوند
+            inventory.merge_reservations(session_cart, user_cart)
+            session_cart.delete()
+        self.request.session.pop(CART_ID_SESSION_KEY, None)
+
+
+class GuestCartItem:
+    """آیتم سبد مهمان با همان ویژگی‌های CartItem که قالب‌ها و نماها استفاده می‌کنند"""
+    
+    def __init__(self, product, variant, quantity):
+        self.product = product
+        self.variant = variant
+        self.quantity = quantity
+        self.product_id = product.pk
+        self.variant_id = variant.pk if variant else None
+        self.id = make_item_id(self.product_id, self.variant_id)
+        self.price = CartItem.unit_price(product, variant)
+    
+    @property
+    def total_price(self):
+        return self.price * self.quantity
+    
+    @property
+    def display_name(self):
+        if self.variant:
+            return f'{self.product.name} - {self.variant.name}'
+        return self.product.name
+
+
+class RedisCartStorage(CartStorage):
+    """سبد خرید مهمان به صورت hash در Redis با TTL"""
+    
+    @cached_property
+    def redis(self):
+        return get_redis_connection('default')
+    
+    @property
+    def ttl(self):
+        # سبد مهمان بیش از session صاحبش قابل دسترسی نیست
+        return getattr(settings, 'CART_GUEST_TTL', settings.SESSION_COOKIE_AGE)
+    
+    @property
+    def token(self):
+        return self.request.session.get(CART_TOKEN_SESSION_KEY)
+    
+    def _ensure_token(self):
+        token = self.token
+        if not token:
+            token = secrets.token_urlsafe(16)
+            self.request.session[CART_TOKEN_SESSION_KEY] = token
+        return token
+    
+    @property
+    def key(self):
+        return GUEST_CART_KEY.format(self.token) if self.token else None
+    
+    @property
+    def summary_cache_key(self):
+        return summary_key(guest_token=self.token)
+    
+    def get_quantities(self):
+        if not self.key:
+            return {}
+        # فیلدهای صفر حاصل از برگرداندن افزایش ناموفق نادیده گرفته می‌شوند
+        return {
+            field.decode(): int(quantity)
+            for field, quantity in self.redis.hgetall(self.key).items()
+            if int(quantity) > 0
+        }
+    
+    def get_items(self):
+        lines = [
+            (parse_item_id(item_id), quantity)
+            for item_id, quantity in self.get_quantities().items()
+        ]
+        if not lines:
+            return []
+        
+        products = Product.objects.filter(status='active').select_related('brand').prefetch_related(
+            primary_image_prefetch()
+        ).in_bulk({product_id for (product_id, variant_id), quantity in lines})
+        variant_ids = {variant_id for (product_id, variant_id), quantity in lines if variant_id}
+        variants = ProductVariant.objects.filter(is_active=True).in_bulk(variant_ids) if variant_ids else {}
+        
+        items = []
+        for (product_id, variant_id), quantity in lines:
+            product = products.get(product_id)
+            variant = variants.get(variant_id) if variant_id else None
+            if product is None or (variant_id and variant is None):
+                continue
+            items.append(GuestCartItem(product, variant, quantity))
+        return items
+    
+    @staticmethod
+    def check_stock(product, variant, quantity):
+        """سبد مهمان موجودی رزرو نمی‌کند؛ رزرو هنگام ذخیره در پایگاه داده انجام می‌شود"""
+        if product.track_inventory:
+            available = variant.stock_quantity if variant else product.stock_quantity
+            if available < quantity:
+                raise InsufficientStock(available)
+    
+    def _write(self, item_id, quantity):
+        self._ensure_token()
+        pipe = self.redis.pipeline()
+        if quantity > 0:
+            pipe.hset(self.key, item_id, quantity)
+        else:
+            pipe.hdel(self.key, item_id)
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+        self._refresh_summary()
+    
+    def _refresh_summary(self):
+        self.reset_summary()
+        cache.set(self.summary_cache_key, self.summary, CART_SUMMARY_TIMEOUT)
+    
+    def add(self, product, variant, quantity):
+        """
+        افزودن اتمیک با HINCRBY تا افزودن‌های هم‌زمان یک مهمان از دست نروند
+        
+        موجودی با مقدار نهایی برگشتی بررسی می‌شود و در صورت کافی نبودن
+        افزایش همین درخواست برگردانده می‌شود.
+        """
+        item_id = make_item_id(product.pk, variant.pk if variant else None)
+        self._ensure_token()
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self.key, item_id, quantity)
+        pipe.expire(self.key, self.ttl)
+        total = pipe.execute()[0]
+        
+        try:
+            self.check_stock(product, variant, total)
+        except InsufficientStock:
+            self.redis.hincrby(self.key, item_id, -quantity)
+            raise
+        
+        self._refresh_summary()
+        return GuestCartItem(product, variant, total)
+    
+    def _resolve(self, item_id):
+        product_id, variant_id = parse_item_id(item_id)
+        product = get_object_or_404(Product, pk=product_id, status='active')
+        variant = None
+        if variant_id:
+            variant = get_object_or_404(ProductVariant, pk=variant_id, product=product, is_active=True)
+        return product, variant
+    
+    def update(self, item_id, quantity):
+        product, variant = self._resolve(item_id)
+        self.check_stock(product, variant, quantity)
+        self._write(make_item_id(product.pk, variant.pk if variant else None), quantity)
+        return GuestCartItem(product, variant, quantity)
+    
+    def remove(self, item_id):
+        product_id, variant_id = parse_item_id(item_id)
+        self._write(make_item_id(product_id, variant_id), 0)
+    
+    def compute_summary(self):
+        return summarize_items(self.get_items())
+    
+    def clear(self):
+        if self.key:
+            self.redis.delete(self.key)
+            cache.delete(self.summary_cache_key)
+            self.request.session.pop(CART_TOKEN_SESSION_KEY, None)
+        self.reset_summary()
+    
+    def persist(self, user):
+        """ذخیره سبد مهمان در سبد پایگاه داده کاربر و رزرو موجودی آن"""
+        items = self.get_items()
+        if items:
+            cart, created = Cart.objects.get_or_create(user=user)
+            lines = [(item.product, item.variant, item.quantity) for item in items]
+            
+            with transaction.atomic():
+                reserved = inventory.reserve_lines(cart, lines)
+                for item, quantity in zip(items, reserved):
+                    if quantity < item.quantity:
+                        logger.warning(
+                            f"Guest cart item {item.id} reduced from {item.quantity} to {quantity} "
+                            f"for user {user.pk}: insufficient stock"
+                        )
+                merge_cart_lines(cart, [
+                    (product, variant, quantity)
+                    for (product, variant, requested), quantity in zip(lines, reserved) if quantity
+                ])
+        self.clear()
+
+
+def get_guest_storage_class():
+    return import_string(getattr(settings, 'CART_GUEST_STORAGE', DEFAULT_GUEST_STORAGE))
+
+
+def get_cart_storage(request):
+    """ذخیره‌سازی سبد درخواست فعلی (پایگاه داده برای کاربران وارد شده)"""
+    if request.user.is_authenticated:
+        if request.session.get(CART_TRANSFER_PENDING_SESSION_KEY):
+            retry_guest_cart_transfer(request)
+        return DatabaseCartStorage(request)
+    return get_guest_storage_class()(request)
+
+
+def transfer_guest_cart(request, user):
+    """
+    انتقال سبد مهمان به سبد کاربر پس از ورود
+    
+    در صورت خطا شناسه سبد مهمان در session باقی می‌ماند و انتقال در
+    درخواست بعدی دوباره تلاش می‌شود (retry_guest_cart_transfer).
+    """
+    try:
+        get_guest_storage_class()(request).persist(user)
+    except Exception:
+        request.session[CART_TRANSFER_PENDING_SESSION_KEY] = True
+        raise
+    request.session.pop(CART_TRANSFER_PENDING_SESSION_KEY, None)
+
+
+def retry_guest_cart_transfer(request):
+    """تلاش دوباره برای انتقال ناموفق سبد مهمان (حداکثر یک بار در هر درخواست)"""
+    if getattr(request, '_cart_transfer_retried', False):
+        return
+    request._cart_transfer_retried = True
+    try:
+        transfer_guest_cart(request, request.user)
+    except Exception as e:
+        logger.error(f"Guest cart transfer retry error for user {request.user.pk}: {e}")
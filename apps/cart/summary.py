@@ -0,0 +1,139 @@
+"""
+خلاصه سبد خرید
+
+تعداد آیتم‌ها و مجموع قیمت سبد هر کاربر یا جلسه در کش (Redis) نگهداری
+می‌شود تا نشان سبد خرید در هدر هر صفحه بدون کوئری SQL نمایش داده شود.
+خلاصه پس از هر تغییر سبد (از طریق سیگنال‌ها) دوباره محاسبه می‌شود.
+مجموع‌ها همیشه با یک کوئری تجمعی SQL محاسبه می‌شوند، نه با پیمایش آیتم‌ها.
+"""
+import hashlib
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, Max, Sum
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+CART_SUMMARY_KEY = 'cart:summary:{}:{}'
+CART_SUMMARY_TIMEOUT = 60 * 60 * 24 * 7
+
+EMPTY_SUMMARY = {'total_items': 0, 'total_price': Decimal('0'), 'version': ''}
+
+
+def summary_key(user_id=None, session_key=None, guest_token=None):
+    if user_id:
+        return CART_SUMMARY_KEY.format('user', user_id)
+    if session_key:
+        return CART_SUMMARY_KEY.format('session', session_key)
+    if guest_token:
+        return CART_SUMMARY_KEY.format('guest', guest_token)
+    return None
+
+
+def compute_cart_summary(cart_id):
+    """
+    محاسبه خلاصه سبد با یک کوئری تجمعی
+    
+    version از همان کوئری ساخته می‌شود و با هر تغییر آیتم‌ها عوض می‌شود
+    (برای کش نتایج وابسته به محتوای سبد مثل قیمت‌گذاری).
+    """
+    from .models import CartItem
+    
+    totals = CartItem.objects.filter(cart_id=cart_id).aggregate(
+        lines=Count('id'),
+        last_update=Max('updated_at'),
+        total_items=Coalesce(Sum('quantity'), 0),
+        total_price=Coalesce(
+            Sum(F('price') * F('quantity')),
+            Decimal('0'),
+            output_field=DecimalField(max_digits=14, decimal_places=0)
+        ),
+    )
+    last_update = totals['last_update'].timestamp() if totals['last_update'] else 0
+    return {
+        'total_items': totals['total_items'],
+        'total_price': totals['total_price'],
+        'version': f"{totals['lines']}:{totals['total_items']}:{totals['total_price']}:{last_update}",
+    }
+
+
+def summarize_items(items):
+    """خلاصه سبد از آیتم‌های بارگذاری شده (بدون کوئری)"""
+    fingerprint = sorted(f'{item.id}:{item.quantity}:{item.price}' for item in items)
+    return {
+        'total_items': sum(item.quantity for item in items),
+        'total_price': sum((item.total_price for item in items), Decimal('0')),
+        'version': hashlib.md5('|'.join(fingerprint).encode()).hexdigest(),
+    }
+
+
+def refresh_cart_summary(cart):
+    """محاسبه مجدد و ذخیره خلاصه یک سبد در کش"""
+    key = summary_key(user_id=cart.user_id, session_key=cart.session_id)
+    if key is None:
+        return None
+    summary = compute_cart_summary(cart.pk)
+    cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def clear_cart_summary(user_id=None, session_key=None):
+    key = summary_key(user_id=user_id, session_key=session_key)
+    if key:
+        cache.delete(key)
+
+
+def get_cart_summary(request):
+    """خلاصه سبد درخواست فعلی (از کش، در صورت نبود از ذخیره‌سازی سبد)"""
+    from .storage import get_cart_storage
+    
+    storage = get_cart_storage(request)
+    key = storage.summary_cache_key
+    if key is None:
+        return EMPTY_SUMMARY
+    
+    summary = cache.get(key)
+    if summary is None:
+        summary = storage.compute_summary()
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+class LazyCart:
+    """
+    پراکسی تنبل سبد خرید برای قالب‌ها
+    
+    total_items و total_price از خلاصه کش شده خوانده می‌شوند و سایر
+    ویژگی‌ها (مثل get_items) فقط هنگام استفاده به ذخیره‌سازی سبد مراجعه
+    می‌کنند. هیچ سبدی در این مسیر ایجاد نمی‌شود.
+    """
+    
+    def __init__(self, request):
+        self._request = request
+    
+    @cached_property
+    def summary(self):
+        return get_cart_summary(self._request)
+    
+    @property
+    def total_items(self):
+        return self.summary['total_items']
+    
+    @property
+    def total_price(self):
+        return self.summary['total_price']
+    
+    @property
+    def is_empty(self):
+        return not self.summary['total_items']
+    
+    @cached_property
+    def _storage(self):
+        from .storage import get_cart_storage
+        
+        return get_cart_storage(self._request)
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._storage, name)
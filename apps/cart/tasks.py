@@ -0,0 +1,59 @@
+from celery import shared_task
+from .cleanup import collect_abandoned_carts, delete_expired_sessions, delete_stale_carts
+from .inventory import release_expired_reservations
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def release_expired_stock_reservations():
+    """بازگرداندن موجودی رزروهای منقضی شده سبدهای خرید"""
+    try:
+        released = release_expired_reservations()
+        if released:
+            logger.info(f"Released {released} expired stock reservations")
+        return {'success': True, 'released': released}
+        
+    except Exception as e:
+        logger.error(f"Stock reservation release error: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def cleanup_stale_carts():
+    """حذف دسته‌ای سبدهای رها شده و sessionهای منقضی همراه با آزادسازی موجودی"""
+    try:
+        carts = delete_stale_carts()
+        sessions = delete_expired_sessions()
+        stats = {
+            'stale_carts': carts['carts'],
+            'session_carts': sessions['carts'],
+            'sessions': sessions['sessions'],
+            'released_reservations': carts['reservations'] + sessions['reservations'],
+        }
+        logger.info(f"Cart cleanup: {stats}")
+        return {'success': True, **stats}
+        
+    except Exception as e:
+        logger.error(f"Cart cleanup error: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def queue_abandoned_cart_reminders():
+    """ارسال سبدهای رها شده به صف پیامک یادآوری"""
+    try:
+        from apps.sms.tasks import send_abandoned_cart_sms
+        
+        recipients = collect_abandoned_carts()
+        for phone, name in recipients:
+            send_abandoned_cart_sms.delay(phone, name)
+        
+        if recipients:
+            logger.info(f"Queued {len(recipients)} abandoned cart reminders")
+        return {'success': True, 'queued': len(recipients)}
+        
+    except Exception as e:
+        logger.error(f"Abandoned cart reminder error: {e}")
+        return {'success': False, 'error': str(e)}
@@ -6,8 +6,8 @@ app_name = 'cart'
 urlpatterns = [
     path('', views.CartView.as_view(), name='cart'),
     path('add/', views.add_to_cart, name='add_to_cart'),
-    path('update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
-    path('remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('update/<str:item_id>/', views.update_cart_item, name='update_cart_item'),
+    path('remove/<str:item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('coupon/apply/', views.apply_coupon, name='apply_coupon'),
     path('coupon/remove/', views.remove_coupon, name='remove_coupon'),
     path('transfer/', views.transfer_cart, name='transfer_cart'),
@@ -6,9 +6,15 @@ from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView
 from django.db import transaction
-from .models import Cart, CartItem, Coupon
 from apps.catalog.models import Product, ProductVariant
 from .forms import CouponForm
+from .coupons import NO_DISCOUNT_MESSAGE, get_applied_coupon, get_coupon
+from apps.marketing.pricing import get_rule_set, price_cart
+from .storage import get_cart_storage, transfer_guest_cart
+from .summary import summarize_items
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class CartView(TemplateView):
@@ -18,6 +24,15 @@ class CartView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['coupon_form'] = CouponForm()
+        
+        # آیتم‌ها یک بار بارگذاری و مجموع‌ها از همین آیتم‌ها محاسبه می‌شوند
+        cart = get_cart(self.request)
+        items = cart.get_items()
+        cart.summary = summarize_items(items)
+        
+        context['cart'] = cart
+        context['cart_items'] = items
+        context['pricing'] = get_rule_set().evaluate(items, get_applied_coupon(self.request))
         return context
 
 
@@ -32,6 +47,8 @@ def add_to_cart(request):
         
         if not product_id:
             return JsonResponse({'success': False, 'message': 'محصول یافت نشد.'})
+        if quantity < 1:
+            return JsonResponse({'success': False, 'message': 'تعداد نامعتبر است.'})
         
         product = get_object_or_404(Product, id=product_id, status='active')
         variant = None
@@ -39,39 +56,9 @@ def add_to_cart(request):
         if variant_id:
             variant = get_object_or_404(ProductVariant, id=variant_id, product=product, is_active=True)
         
-        # بررسی موجودی
-        if product.track_inventory:
-            available_stock = variant.stock_quantity if variant else product.stock_quantity
-            if available_stock < quantity:
-                return JsonResponse({
-                    'success': False,
-                    'message': f'موجودی کافی نیست. موجودی: {available_stock}'
-                })
-        
-        # دریافت یا ایجاد سبد خرید
+        # افزودن به سبد (با رزرو یا بررسی موجودی)
         cart = get_cart(request)
-        
-        # بررسی وجود آیتم در سبد
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            variant=variant,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            # افزایش تعداد
-            cart_item.quantity += quantity
-            cart_item.save()
-        
-        # به‌روزرسانی موجودی
-        if product.track_inventory:
-            if variant:
-                variant.stock_quantity -= quantity
-                variant.save()
-            else:
-                product.stock_quantity -= quantity
-                product.save()
+        cart.add(product, variant, quantity)
         
         return JsonResponse({
             'success': True,
@@ -89,41 +76,20 @@ def add_to_cart(request):
 def update_cart_item(request, item_id):
     """به‌روزرسانی آیتم سبد خرید"""
     try:
-        cart_item = get_object_or_404(CartItem, id=item_id)
         quantity = int(request.POST.get('quantity', 1))
         
         if quantity <= 0:
             return remove_from_cart(request, item_id)
         
-        # بررسی موجودی
-        if cart_item.product.track_inventory:
-            available_stock = cart_item.variant.stock_quantity if cart_item.variant else cart_item.product.stock_quantity
-            if available_stock < quantity:
-                return JsonResponse({
-                    'success': False,
-                    'message': f'موجودی کافی نیست. موجودی: {available_stock}'
-                })
-        
-        old_quantity = cart_item.quantity
-        cart_item.quantity = quantity
-        cart_item.save()
-        
-        # به‌روزرسانی موجودی
-        if cart_item.product.track_inventory:
-            quantity_diff = quantity - old_quantity
-            if cart_item.variant:
-                cart_item.variant.stock_quantity -= quantity_diff
-                cart_item.variant.save()
-            else:
-                cart_item.product.stock_quantity -= quantity_diff
-                cart_item.product.save()
+        cart = get_cart(request)
+        cart_item = cart.update(item_id, quantity)
         
         return JsonResponse({
             'success': True,
             'message': 'سبد خرید به‌روزرسانی شد.',
             'item_total': cart_item.total_price,
-            'cart_total': cart_item.cart.total_items,
-            'cart_price': cart_item.cart.total_price
+            'cart_total': cart.total_items,
+            'cart_price': cart.total_price
         })
         
     except Exception as e:
@@ -135,24 +101,14 @@ def update_cart_item(request, item_id):
 def remove_from_cart(request, item_id):
     """حذف آیتم از سبد خرید"""
     try:
-        cart_item = get_object_or_404(CartItem, id=item_id)
-        
-        # بازگرداندن موجودی
-        if cart_item.product.track_inventory:
-            if cart_item.variant:
-                cart_item.variant.stock_quantity += cart_item.quantity
-                cart_item.variant.save()
-            else:
-                cart_item.product.stock_quantity += cart_item.quantity
-                cart_item.product.save()
-        
-        cart_item.delete()
+        cart = get_cart(request)
+        cart.remove(item_id)
         
         return JsonResponse({
             'success': True,
             'message': 'محصول از سبد خرید حذف شد.',
-            'cart_total': cart_item.cart.total_items,
-            'cart_price': cart_item.cart.total_price
+            'cart_total': cart.total_items,
+            'cart_price': cart.total_price
         })
         
     except Exception as e:
@@ -173,16 +129,18 @@ def apply_coupon(request):
         if cart.is_empty:
             return JsonResponse({'success': False, 'message': 'سبد خرید خالی است.'})
         
-        try:
-            coupon = Coupon.objects.get(code=coupon_code)
-        except Coupon.DoesNotExist:
+        coupon = get_coupon(coupon_code)
+        if coupon is None:
             return JsonResponse({'success': False, 'message': 'کوپن یافت نشد.'})
         
         can_use, message = coupon.can_use(request.user, cart.total_price)
         if not can_use:
             return JsonResponse({'success': False, 'message': message})
         
-        discount = coupon.calculate_discount(cart.total_price)
+        pricing = price_cart(cart, coupon)
+        discount = pricing['coupon_discount']
+        if not discount:
+            return JsonResponse({'success': False, 'message': NO_DISCOUNT_MESSAGE})
         
         # ذخیره کوپن در session
         request.session['applied_coupon'] = {
@@ -195,7 +153,7 @@ def apply_coupon(request):
             'success': True,
             'message': 'کوپن با موفقیت اعمال شد.',
             'discount': discount,
-            'new_total': cart.total_price - discount
+            'new_total': pricing['total']
         })
         
     except Exception as e:
@@ -221,46 +179,16 @@ def remove_coupon(request):
 
 
 def get_cart(request):
-    """دریافت یا ایجاد سبد خرید"""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        if not request.session.session_key:
-            request.session.create()
-        cart, created = Cart.objects.get_or_create(session_id=request.session.session_key)
-    
-    return cart
+    """دریافت ذخیره‌سازی سبد خرید (پایگاه داده برای کاربران، Redis برای مهمان‌ها)"""
+    return get_cart_storage(request)
 
 
 @login_required
 def transfer_cart(request):
-    """انتقال سبد خرید از session به کاربر"""
-    if not request.session.session_key:
-        return
-    
+    """انتقال سبد خرید مهمان به کاربر"""
     try:
-        session_cart = Cart.objects.filter(session_id=request.session.session_key).first()
-        if not session_cart:
-            return
-        
-        user_cart, created = Cart.objects.get_or_create(user=request.user)
-        
-        # انتقال آیتم‌ها
-        for item in session_cart.items.all():
-            existing_item = user_cart.items.filter(
-                product=item.product,
-                variant=item.variant
-            ).first()
-            
-            if existing_item:
-                existing_item.quantity += item.quantity
-                existing_item.save()
-            else:
-                item.cart = user_cart
-                item.save()
-        
-        # حذف سبد session
-        session_cart.delete()
-        
+        transfer_guest_cart(request, request.user)
     except Exception as e:
-        pass  # خطا را نادیده بگیر
\ No newline at end of file
+        logger.error(f"Cart transfer error for user {request.user.pk}: {e}")
+        messages.error(request, 'انتقال سبد خرید با خطا مواجه شد.')
+    return redirect('cart:cart')
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from .models import (
     Category, Brand, Product, ProductImage, ProductAttribute,
-    ProductAttributeValue, ProductReview, ProductVariant, Wishlist
+    ProductAttributeValue, ProductReview, ProductVariant, RelatedProduct, Wishlist
 )
 
 
@@ -13,10 +13,7 @@ class CategoryAdmin(admin.ModelAdmin):
     list_editable = ['is_active', 'is_featured', 'order']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
-    
-    def product_count(self, obj):
-        return obj.products.count()
-    product_count.short_description = 'تعداد محصولات'
+    readonly_fields = ['product_count']
 
 
 @admin.register(Brand)
@@ -61,6 +58,10 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ['name', 'sku', 'description']
     prepopulated_fields = {'slug': ('name',)}
     inlines = [ProductImageInline, ProductAttributeValueInline, ProductVariantInline]
+    readonly_fields = [
+        'rating_sum', 'rating_count', 'rating_average',
+        'sale_price', 'sale_discount', 'min_variant_price', 'max_variant_price'
+    ]
     
     fieldsets = (
         ('اطلاعات اصلی', {
@@ -70,7 +71,10 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('category', 'brand')
         }),
         ('قیمت‌گذاری', {
-            'fields': ('price', 'compare_price', 'cost_price')
+            'fields': (
+                'price', 'compare_price', 'cost_price',
+                'sale_price', 'sale_discount', 'min_variant_price', 'max_variant_price'
+            )
         }),
         ('موجودی', {
             'fields': ('stock_quantity', 'low_stock_threshold', 'track_inventory', 'allow_backorder')
@@ -87,7 +91,7 @@ class ProductAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('آمار', {
-            'fields': ('view_count', 'sale_count'),
+            'fields': ('view_count', 'sale_count', 'rating_sum', 'rating_count', 'rating_average'),
             'classes': ('collapse',)
         }),
     )
@@ -145,4 +149,11 @@ class WishlistAdmin(admin.ModelAdmin):
     list_display = ['user', 'product', 'created_at']
     list_filter = ['created_at']
     search_fields = ['user__first_name', 'user__last_name', 'product__name']
-    readonly_fields = ['created_at']
\ No newline at end of file
+    readonly_fields = ['created_at']
+
+
+@admin.register(RelatedProduct)
+class RelatedProductAdmin(admin.ModelAdmin):
+    list_display = ['product', 'related', 'rank']
+    raw_id_fields = ['product', 'related']
+    search_fields = ['product__name', 'related__name']
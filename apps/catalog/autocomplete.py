@@ -0,0 +1,243 @@
+"""
+پیشنهاد خودکار جستجو
+
+ایندکس پیشوندی محصولات، برندها و دسته‌بندی‌های فعال در حافظه هر worker
+نگهداری می‌شود تا پاسخ هر کلید بدون کوئری پایگاه داده داده شود. تغییرات
+در یک changelog نسخه‌دار در کش (Redis) ثبت می‌شوند و هر worker حداکثر هر
+SYNC_INTERVAL ثانیه در پس‌زمینه فقط محصولات، برندها و دسته‌بندی‌های تغییر
+کرده را دوباره بارگذاری می‌کند.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+from django.db import connections
+
+from .search import normalize_text
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'catalog:autocomplete:version'
+CHANGE_KEY = 'catalog:autocomplete:change:{}'
+CHANGE_TIMEOUT = 60 * 60 * 24
+SYNC_INTERVAL = 5
+MAX_PENDING_CHANGES = 500
+MAX_SCAN = 1000
+MIN_QUERY_LENGTH = 2
+
+# فیلدهایی از محصول که در پیشنهادها نمایش داده می‌شوند
+AUTOCOMPLETE_FIELDS = {'name', 'slug', 'sku', 'status', 'brand', 'sale_count'}
+
+
+def publish_change(kind, pk):
+    """ثبت تغییر در changelog مشترک بین workerها"""
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 0, None)
+        version = cache.incr(VERSION_KEY)
+    cache.set(CHANGE_KEY.format(version), f'{kind}:{pk}', CHANGE_TIMEOUT)
+    autocomplete_index.mark_stale()
+
+
+def _terms(text):
+    """کلیدهای پیشوندی یک متن (از ابتدای هر کلمه تا انتها)"""
+    words = normalize_text(text).split()
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class PrefixIndex:
+    """ایندکس پیشوندی مبتنی بر آرایه مرتب"""
+    
+    def __init__(self):
+        self._keys = []
+        self._entries = {}
+        self._entry_terms = {}
+    
+    def add(self, entry_key, suggestion, text, score=0):
+        self.remove(entry_key)
+        terms = _terms(text)
+        self._entries[entry_key] = (score, suggestion)
+        self._entry_terms[entry_key] = terms
+        for term in terms:
+            insort(self._keys, (term, entry_key))
+    
+    def remove(self, entry_key):
+        for term in self._entry_terms.pop(entry_key, ()):
+            position = bisect_left(self._keys, (term, entry_key))
+            if position < len(self._keys) and self._keys[position] == (term, entry_key):
+                del self._keys[position]
+        self._entries.pop(entry_key, None)
+    
+    def search(self, prefix, limit):
+        """پیشنهادها به تفکیک نوع، مرتب شده بر اساس امتیاز"""
+        matches = {}
+        start = bisect_left(self._keys, (prefix,))
+        end = min(len(self._keys), start + MAX_SCAN)
+        for term, entry_key in self._keys[start:end]:
+            if not term.startswith(prefix):
+                break
+            matches[entry_key] = self._entries[entry_key]
+        
+        grouped = {'products': [], 'brands': [], 'categories': []}
+        for (kind, _pk), (score, suggestion) in sorted(
+            matches.items(), key=lambda item: -item[1][0]
+        ):
+            bucket = grouped[kind]
+            if len(bucket) < limit:
+                bucket.append(suggestion)
+        return grouped
+
+
+class AutocompleteIndex:
+    """
+    ایندکس پیشنهاد خودکار هر worker همراه با همگام‌سازی تغییرات
+    
+    همگام‌سازی (بارگذاری اولیه، اعمال changelog یا بازسازی کامل) در یک
+    thread پس‌زمینه انجام می‌شود و درخواست‌ها تا جایگزینی ایندکس جدید از
+    ایندکس فعلی پاسخ می‌گیرند؛ قفل فقط هنگام اعمال تغییرات گرفته می‌شود.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._index = PrefixIndex()
+        self._version = None
+        self._last_sync = 0
+    
+    def mark_stale(self):
+        self._last_sync = 0
+    
+    def search(self, query, limit=5):
+        prefix = normalize_text(query)
+        if len(prefix) < MIN_QUERY_LENGTH:
+            return {'products': [], 'brands': [], 'categories': []}
+        
+        self.sync()
+        with self._lock:
+            return self._index.search(prefix, limit)
+    
+    def sync(self):
+        """شروع همگام‌سازی در پس‌زمینه (حداکثر یکی در هر زمان)"""
+        if time.monotonic() - self._last_sync < SYNC_INTERVAL:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        self._last_sync = time.monotonic()
+        threading.Thread(target=self._sync_in_background, name='autocomplete-sync', daemon=True).start()
+    
+    def _sync_in_background(self):
+        try:
+            self._sync()
+        except Exception as e:
+            logger.error(f"Autocomplete sync error: {e}")
+        finally:
+            self._sync_lock.release()
+            connections.close_all()
+    
+    def _sync(self):
+        """اعمال تغییرات ثبت شده در changelog"""
+        version = cache.get(VERSION_KEY, 0)
+        pending = version - (self._version or 0)
+        
+        if self._version is None or pending < 0 or pending > MAX_PENDING_CHANGES:
+            self._rebuild(version)
+            return
+        if pending == 0:
+            return
+        
+        changes = cache.get_many([
+            CHANGE_KEY.format(number)
+            for number in range(self._version + 1, version + 1)
+        ])
+        if len(changes) < pending:
+            # بخشی از changelog منقضی شده است
+            self._rebuild(version)
+            return
+        
+        changed = {'product': set(), 'brand': set(), 'category': set()}
+        for change in changes.values():
+            kind, _, pk = str(change).partition(':')
+            if kind not in changed or not pk.isdigit():
+                # ورودی نامعتبر (مثلاً product:None) نادیده گرفته می‌شود
+                continue
+            changed[kind].add(int(pk))
+        
+        self._apply_changes(changed)
+        self._version = version
+    
+    def _rebuild(self, version):
+        from .models import Brand, Category
+        
+        index = PrefixIndex()
+        for brand in Brand.objects.filter(is_active=True).only('id', 'name', 'slug'):
+            self._add_brand(index, brand)
+        for category in Category.objects.filter(is_active=True).only('id', 'name', 'slug'):
+            self._add_category(index, category)
+        for product in self._products():
+            self._add_product(index, product)
+        
+        with self._lock:
+            self._index = index
+        self._version = version
+    
+    def _apply_changes(self, changed):
+        from .models import Brand, Category, Product
+        
+        product_ids = set(changed['product'])
+        if changed['brand']:
+            # نام برند در پیشنهاد محصولاتش نمایش داده می‌شود
+            product_ids.update(
+                Product.objects.filter(brand_id__in=changed['brand']).values_list('id', flat=True)
+            )
+        brands = list(Brand.objects.filter(pk__in=changed['brand'], is_active=True).only('id', 'name', 'slug'))
+        categories = list(
+            Category.objects.filter(pk__in=changed['category'], is_active=True).only('id', 'name', 'slug')
+        )
+        products = list(self._products().filter(pk__in=product_ids))
+        
+        with self._lock:
+            for pk in changed['brand']:
+                self._index.remove(('brands', pk))
+            for pk in changed['category']:
+                self._index.remove(('categories', pk))
+            for pk in product_ids:
+                self._index.remove(('products', pk))
+            for brand in brands:
+                self._add_brand(self._index, brand)
+            for category in categories:
+                self._add_category(self._index, category)
+            for product in products:
+                self._add_product(self._index, product)
+    
+    def _products(self):
+        from .models import Product
+        
+        return Product.objects.filter(status='active').select_related('brand').only(
+            'id', 'name', 'slug', 'sku', 'sale_count', 'brand__name'
+        ).with_primary_image()
+    
+    def _add_brand(self, index, brand):
+        index.add(('brands', brand.pk), {
+            'name': brand.name,
+            'url': brand.get_absolute_url(),
+        }, brand.name, score=10 ** 9)
+    
+    def _add_category(self, index, category):
+        index.add(('categories', category.pk), {
+            'name': category.name,
+            'url': category.get_absolute_url(),
+        }, category.name, score=10 ** 9)
+    
+    def _add_product(self, index, product):
+        index.add(('products', product.pk), {
+            'name': product.name,
+            'brand': product.brand.name,
+            'url': product.get_absolute_url(),
+            'image': product.primary_image_url,
+        }, f'{product.name} {product.sku}', score=product.sale_count)
+
+
+autocomplete_index = AutocompleteIndex()
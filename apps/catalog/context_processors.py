@@ -0,0 +1,10 @@
+from .navigation import get_navigation
+
+
+def navigation(request):
+    """اضافه کردن دسته‌بندی‌ها و برندهای منو به context"""
+    navigation = get_navigation()
+    return {
+        'nav_categories': navigation['categories'],
+        'nav_brands': navigation['brands'],
+    }
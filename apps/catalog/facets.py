@@ -0,0 +1,260 @@
+"""
+فیلترهای چندوجهی کاتالوگ
+
+برای هر مقدار فیلتر (برند، بازه قیمت، موجودی، دسته‌بندی و مقادیر ویژگی‌های
+قابل فیلتر) یک bitmap از شناسه محصولات فعال از پیش ساخته می‌شود. تعداد هر
+مقدار با AND کردن bitmapها و شمارش بیت‌ها محاسبه می‌شود، بدون کوئری COUNT.
+ایندکس در کش نسخه‌بندی می‌شود و با ذخیره محصول یا ویژگی‌ها باطل می‌شود.
+"""
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+
+from django.core.cache import cache
+from django.db.models import Q
+
+FACET_VERSION_KEY = 'catalog:facets:version'
+FACET_INDEX_KEY = 'catalog:facets:index:{}'
+FACET_TIMEOUT = 60 * 15
+
+# فیلدهایی از محصول که در ایندکس فیلترها استفاده می‌شوند
+FACET_FIELDS = {'status', 'brand', 'category', 'sale_price', 'stock_quantity', 'track_inventory'}
+
+PRICE_BUCKETS = [
+    ('0-1m', 'تا ۱ میلیون تومان', None, 1000000),
+    ('1m-5m', '۱ تا ۵ میلیون تومان', 1000000, 5000000),
+    ('5m-10m', '۵ تا ۱۰ میلیون تومان', 5000000, 10000000),
+    ('10m-20m', '۱۰ تا ۲۰ میلیون تومان', 10000000, 20000000),
+    ('20m-', 'بیش از ۲۰ میلیون تومان', 20000000, None),
+]
+
+ATTRIBUTE_PARAM_PREFIX = 'attr_'
+
+_local_index = {'version': None, 'built_at': 0, 'index': None}
+
+
+def _bitmap(ids):
+    """ساخت bitmap از مجموعه شناسه‌ها"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        data[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(data, 'little')
+
+
+def _in_bucket(price, minimum, maximum):
+    return (minimum is None or price >= minimum) and (maximum is None or price < maximum)
+
+
+def build_facet_index():
+    """ساخت ایندکس فیلترها از محصولات فعال"""
+    from .models import Category, Product, ProductAttributeValue
+    
+    category_products, brands, prices = {}, {}, []
+    buckets = {key: set() for key, _label, _min, _max in PRICE_BUCKETS}
+    in_stock = set()
+    
+    rows = Product.objects.filter(status='active').values_list(
+        'id', 'category_id', 'brand__slug', 'brand__name',
+        'sale_price', 'stock_quantity', 'track_inventory'
+    )
+    for pk, category_id, brand_slug, brand_name, price, stock, tracked in rows:
+        category_products.setdefault(category_id, set()).add(pk)
+        brands.setdefault(brand_slug, (brand_name, set()))[1].add(pk)
+        prices.append((int(price), pk))
+        for key, _label, minimum, maximum in PRICE_BUCKETS:
+            if _in_bucket(price, minimum, maximum):
+                buckets[key].add(pk)
+        if not tracked or stock > 0:
+            in_stock.add(pk)
+    
+    # هر دسته‌بندی شامل محصولات همه زیرشاخه‌هایش است
+    categories = {}
+    for category in Category.objects.filter(is_active=True):
+        ids = set()
+        for descendant_id in category.get_descendant_ids():
+            ids |= category_products.get(descendant_id, set())
+        categories[category.slug] = (category.name, ids)
+    
+    attributes = {}
+    attribute_rows = ProductAttributeValue.objects.filter(
+        product__status='active',
+        attribute__is_filterable=True
+    ).order_by('attribute__order', 'attribute__name', 'value').values_list(
+        'product_id', 'attribute__slug', 'attribute__name', 'value'
+    )
+    for pk, attribute_slug, attribute_name, value in attribute_rows:
+        attribute = attributes.setdefault(attribute_slug, (attribute_name, {}))
+        attribute[1].setdefault(value, set()).add(pk)
+    
+    def options(values):
+        return [
+            {'value': value, 'label': label, 'bitmap': _bitmap(ids)}
+            for value, (label, ids) in values.items()
+        ]
+    
+    groups = [
+        {'param': 'category', 'title': 'دسته‌بندی', 'options': options(categories)},
+        {'param': 'brand', 'title': 'برند', 'options': options(brands)},
+        {'param': 'price_range', 'title': 'محدوده قیمت', 'options': [
+            {'value': key, 'label': label, 'bitmap': _bitmap(buckets[key])}
+            for key, label, _min, _max in PRICE_BUCKETS
+        ]},
+        {'param': 'in_stock', 'title': 'موجودی', 'options': [
+            {'value': '1', 'label': 'فقط کالاهای موجود', 'bitmap': _bitmap(in_stock)},
+        ]},
+    ]
+    for attribute_slug, (attribute_name, values) in attributes.items():
+        groups.append({
+            'param': f'{ATTRIBUTE_PARAM_PREFIX}{attribute_slug}',
+            'title': attribute_name,
+            'options': [
+                {'value': value, 'label': value, 'bitmap': _bitmap(ids)}
+                for value, ids in values.items()
+            ],
+        })
+    
+    prices.sort()
+    return {
+        'all': _bitmap(pk for _price, pk in prices),
+        'groups': groups,
+        'prices': prices,
+    }
+
+
+def get_facet_index():
+    """دریافت ایندکس فیلترها (حافظه worker، سپس کش، سپس ساخت مجدد)"""
+    version = cache.get(FACET_VERSION_KEY)
+    if version is None:
+        cache.add(FACET_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(FACET_VERSION_KEY)
+    
+    if (
+        _local_index['version'] == version
+        and time.monotonic() - _local_index['built_at'] < FACET_TIMEOUT
+    ):
+        return _local_index['index']
+    
+    index = cache.get(FACET_INDEX_KEY.format(version))
+    if index is None:
+        index = build_facet_index()
+        cache.set(FACET_INDEX_KEY.format(version), index, FACET_TIMEOUT)
+    
+    _local_index.update(version=version, built_at=time.monotonic(), index=index)
+    return index
+
+
+def invalidate_facet_index():
+    """باطل کردن ایندکس فیلترها در همه workerها"""
+    cache.set(FACET_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def parse_facet_selection(params):
+    """استخراج مقادیر انتخاب شده فیلترها از پارامترهای GET"""
+    selection = {}
+    for param in params:
+        if param in ('category', 'brand', 'price_range', 'in_stock') or param.startswith(ATTRIBUTE_PARAM_PREFIX):
+            values = {value for value in params.getlist(param) if value}
+            if values:
+                selection[param] = values
+    return selection
+
+
+def apply_facet_filters(queryset, selection):
+    """
+    اعمال فیلترهای انتخاب شده روی کوئری‌ست محصولات
+    
+    مانند facet_counts مقادیر یک گروه با OR ترکیب می‌شوند؛ هر دسته‌بندی
+    شامل محصولات همه زیرشاخه‌هایش است.
+    """
+    from .models import Category
+    
+    if 'category' in selection:
+        category_filter = Q()
+        for category in Category.objects.filter(slug__in=selection['category'], is_active=True):
+            category_filter |= Q(
+                category__tree_id=category.tree_id,
+                category__lft__gte=category.lft,
+                category__rght__lte=category.rght
+            )
+        queryset = queryset.filter(category_filter) if category_filter else queryset.none()
+    
+    if 'brand' in selection:
+        queryset = queryset.filter(brand__slug__in=selection['brand'])
+    
+    if 'price_range' in selection:
+        price_filter = Q()
+        for key, _label, minimum, maximum in PRICE_BUCKETS:
+            if key in selection['price_range']:
+                bucket = Q()
+                if minimum is not None:
+                    bucket &= Q(sale_price__gte=minimum)
+                if maximum is not None:
+                    bucket &= Q(sale_price__lt=maximum)
+                price_filter |= bucket
+        queryset = queryset.filter(price_filter)
+    
+    if 'in_stock' in selection:
+        queryset = queryset.filter(Q(track_inventory=False) | Q(stock_quantity__gt=0))
+    
+    for param, values in selection.items():
+        if param.startswith(ATTRIBUTE_PARAM_PREFIX):
+            queryset = queryset.filter(
+                attribute_values__attribute__slug=param[len(ATTRIBUTE_PARAM_PREFIX):],
+                attribute_values__value__in=values
+            )
+    
+    return queryset
+
+
+def price_range_mask(index, min_price=None, max_price=None):
+    """bitmap محصولات در بازه قیمت آزاد (min_price/max_price)"""
+    if min_price is None and max_price is None:
+        return None
+    prices = index['prices']
+    start = bisect_left(prices, (min_price,)) if min_price is not None else 0
+    end = bisect_right(prices, (max_price, float('inf'))) if max_price is not None else len(prices)
+    return _bitmap(pk for _price, pk in prices[start:end])
+
+
+def facet_counts(index, selection, extra_mask=None):
+    """
+    تعداد محصولات هر مقدار فیلتر با در نظر گرفتن سایر فیلترهای انتخاب شده
+    
+    مقادیر یک گروه با OR و گروه‌های مختلف با AND ترکیب می‌شوند. تعداد هر
+    گروه بدون اعمال انتخاب‌های خود آن گروه محاسبه می‌شود.
+    """
+    masks = {}
+    for group in index['groups']:
+        selected = selection.get(group['param'])
+        if selected:
+            mask = 0
+            for option in group['options']:
+                if option['value'] in selected:
+                    mask |= option['bitmap']
+            masks[group['param']] = mask
+    
+    base = index['all'] if extra_mask is None else index['all'] & extra_mask
+    facets = []
+    for group in index['groups']:
+        mask = base
+        for param, other in masks.items():
+            if param != group['param']:
+                mask &= other
+        selected = selection.get(group['param'], set())
+        facets.append({
+            'param': group['param'],
+            'title': group['title'],
+            'options': [
+                {
+                    'value': option['value'],
+                    'label': option['label'],
+                    'count': (option['bitmap'] & mask).bit_count(),
+                    'selected': option['value'] in selected,
+                }
+                for option in group['options']
+            ],
+        })
+    return facets
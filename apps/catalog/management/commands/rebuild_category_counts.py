@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from apps.catalog.models import Category
+
+
+class Command(BaseCommand):
+    help = 'محاسبه مجدد تعداد محصولات فعال هر دسته‌بندی (با زیرشاخه‌ها)'
+
+    def handle(self, *args, **options):
+        self.stdout.write('شروع محاسبه تعداد محصولات دسته‌بندی‌ها...')
+        
+        updated = Category.rebuild_product_counts()
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'تعداد محصولات {updated} دسته‌بندی به‌روزرسانی شد!')
+        )
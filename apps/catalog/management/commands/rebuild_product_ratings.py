@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from apps.catalog.models import Product, ProductReview, rating_average_expression
+
+
+class Command(BaseCommand):
+    help = 'بازسازی آمار امتیاز محصولات از روی نظرات تأیید شده'
+
+    def handle(self, *args, **options):
+        self.stdout.write('شروع بازسازی آمار امتیاز محصولات...')
+        
+        approved = ProductReview.objects.filter(
+            product=OuterRef('pk'),
+            is_approved=True
+        ).order_by().values('product')
+        
+        rating_sum = approved.annotate(total=Sum('rating')).values('total')[:1]
+        rating_count = approved.annotate(total=Count('id')).values('total')[:1]
+        
+        with transaction.atomic():
+            updated = Product.objects.update(
+                rating_sum=Coalesce(Subquery(rating_sum, output_field=IntegerField()), Value(0)),
+                rating_count=Coalesce(Subquery(rating_count, output_field=IntegerField()), Value(0)),
+            )
+            Product.objects.update(
+                rating_average=rating_average_expression(F('rating_sum'), F('rating_count'))
+            )
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'آمار امتیاز {updated} محصول بازسازی شد!')
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apps.catalog.models import Product
+from apps.catalog.search import reindex_products
+
+
+class Command(BaseCommand):
+    help = 'بازسازی بردار جستجوی محصولات'
+
+    def handle(self, *args, **options):
+        self.stdout.write('شروع بازسازی ایندکس جستجو...')
+        
+        count = reindex_products(Product.objects.all())
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'ایندکس جستجوی {count} محصول بازسازی شد!')
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from apps.catalog.models import Product
+from apps.marketing.pricing import invalidate_pricing
+
+
+class Command(BaseCommand):
+    help = 'محاسبه مجدد قیمت نهایی، درصد تخفیف و بازه قیمت تنوع‌های محصولات'
+    
+    def handle(self, *args, **options):
+        self.stdout.write('شروع محاسبه مجدد قیمت محصولات...')
+        
+        invalidate_pricing()
+        updated = Product.refresh_sale_prices()
+        Product.refresh_variant_prices()
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'قیمت نهایی {updated} محصول به‌روزرسانی شد!')
+        )
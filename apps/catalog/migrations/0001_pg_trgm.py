@@ -0,0 +1,17 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    فعال‌سازی pg_trgm پیش از ساخت جداول کاتالوگ
+
+    ایندکس GIN با gin_trgm_ops روی نام محصول به این افزونه نیاز دارد و
+    مایگریشن‌های بعدی کاتالوگ به این مایگریشن وابسته می‌شوند.
+    """
+
+    dependencies = []
+
+    operations = [
+        TrigramExtension(),
+    ]
@@ -1,10 +1,33 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models import F, Max, Min, OuterRef, Subquery, Value, DecimalField
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
+from django.utils.functional import cached_property
 from mptt.models import MPTTModel, TreeForeignKey
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.core.cache import cache
 import uuid
 
+CATEGORY_TREE_VERSION_KEY = 'catalog:category_tree:version'
+CATEGORY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def category_tree_version():
+    """نسخه فعلی درخت دسته‌بندی‌ها (با هر تغییر دسته‌بندی عوض می‌شود)"""
+    version = cache.get(CATEGORY_TREE_VERSION_KEY)
+    if version is None:
+        cache.add(CATEGORY_TREE_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(CATEGORY_TREE_VERSION_KEY)
+    return version
+
+
+def invalidate_category_tree():
+    """باطل کردن داده‌های کش شده درخت دسته‌بندی‌ها"""
+    cache.set(CATEGORY_TREE_VERSION_KEY, uuid.uuid4().hex, None)
+
 
 class Category(MPTTModel):
     """دسته‌بندی محصولات"""
@@ -26,6 +49,11 @@ class Category(MPTTModel):
     is_active = models.BooleanField(default=True, verbose_name='فعال')
     is_featured = models.BooleanField(default=False, verbose_name='ویژه')
     order = models.PositiveIntegerField(default=0, verbose_name='ترتیب')
+    product_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='تعداد محصولات فعال (با زیرشاخه‌ها)'
+    )
     
     # SEO Fields
     meta_title = models.CharField(
@@ -62,6 +90,9 @@ class Category(MPTTModel):
         verbose_name = 'دسته‌بندی'
         verbose_name_plural = 'دسته‌بندی‌ها'
         ordering = ['order', 'name']
+        indexes = [
+            models.Index(fields=['tree_id', 'lft', 'rght']),
+        ]
     
     def __str__(self):
         return self.name
@@ -69,10 +100,57 @@ class Category(MPTTModel):
     def get_absolute_url(self):
         return reverse('catalog:category_detail', kwargs={'slug': self.slug})
     
+    def get_descendant_ids(self):
+        """شناسه این دسته‌بندی و همه زیرشاخه‌هایش (کش شده)"""
+        key = f'catalog:category:{self.pk}:descendants:{category_tree_version()}'
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(self.get_descendants(include_self=True).values_list('id', flat=True))
+            cache.set(key, ids, CATEGORY_CACHE_TIMEOUT)
+        return ids
+    
+    @classmethod
+    def apply_product_count_delta(cls, category_id, delta):
+        """به‌روزرسانی اتمیک تعداد محصولات دسته‌بندی و همه اجدادش"""
+        if not delta or category_id is None:
+            return
+        
+        node = cls.objects.filter(pk=category_id).values('tree_id', 'lft', 'rght').first()
+        if node is None:
+            return
+        
+        cls.objects.filter(
+            tree_id=node['tree_id'],
+            lft__lte=node['lft'],
+            rght__gte=node['rght']
+        ).update(product_count=F('product_count') + delta)
+    
+    @classmethod
+    def rebuild_product_counts(cls):
+        """محاسبه مجدد تعداد محصولات همه دسته‌بندی‌ها با یک کوئری"""
+        subtree_products = Product.objects.filter(
+            status='active',
+            category__tree_id=models.OuterRef('tree_id'),
+            category__lft__gte=models.OuterRef('lft'),
+            category__rght__lte=models.OuterRef('rght')
+        ).order_by().values('status').annotate(total=models.Count('id')).values('total')[:1]
+        
+        return cls.objects.update(
+            product_count=Coalesce(
+                models.Subquery(subtree_products, output_field=models.IntegerField()),
+                Value(0)
+            )
+        )
+    
     @property
     def full_path(self):
         """مسیر کامل دسته‌بندی"""
-        return ' > '.join([cat.name for cat in self.get_ancestors(include_self=True)])
+        from .navigation import get_category_path
+        
+        path = get_category_path(self.pk)
+        if path is None:
+            path = ' > '.join([cat.name for cat in self.get_ancestors(include_self=True)])
+        return path
 
 
 class Brand(models.Model):
@@ -106,6 +184,26 @@ class Brand(models.Model):
         return reverse('catalog:brand_detail', kwargs={'slug': self.slug})
 
 
+# فیلدهایی که قیمت نهایی محصول به آن‌ها وابسته است
+SALE_PRICE_DEPENDENCIES = {'price', 'compare_price', 'category', 'category_id'}
+
+
+class ProductQuerySet(models.QuerySet):
+    """کوئری‌ست محصولات"""
+    
+    def with_primary_image(self):
+        """بارگذاری تصویر اصلی همه محصولات با یک کوئری"""
+        return self.prefetch_related(primary_image_prefetch())
+    
+    def in_category(self, category):
+        """محصولات دسته‌بندی و همه زیرشاخه‌هایش (بازه lft/rght درخت MPTT)"""
+        return self.filter(
+            category__tree_id=category.tree_id,
+            category__lft__gte=category.lft,
+            category__rght__lte=category.rght
+        )
+
+
 class Product(models.Model):
     """محصولات"""
     
@@ -166,6 +264,36 @@ class Product(models.Model):
         verbose_name='قیمت تمام شده'
     )
     
+    # قیمت‌های محاسبه شده برای فهرست‌ها (موتور قیمت‌گذاری و تنوع‌ها)
+    sale_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        default=0,
+        editable=False,
+        verbose_name='قیمت نهایی'
+    )
+    sale_discount = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='درصد تخفیف'
+    )
+    min_variant_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='کمترین قیمت تنوع'
+    )
+    max_variant_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='بیشترین قیمت تنوع'
+    )
+    
     # Inventory
     stock_quantity = models.PositiveIntegerField(
         default=0,
@@ -245,9 +373,30 @@ class Product(models.Model):
     view_count = models.PositiveIntegerField(default=0, verbose_name='تعداد بازدید')
     sale_count = models.PositiveIntegerField(default=0, verbose_name='تعداد فروش')
     
+    # Rating Aggregates (denormalized from approved reviews)
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name='مجموع امتیازها')
+    rating_count = models.PositiveIntegerField(default=0, verbose_name='تعداد نظرات تأیید شده')
+    rating_average = models.DecimalField(
+        max_digits=3,
+        decimal_places=2,
+        default=0,
+        verbose_name='میانگین امتیاز'
+    )
+    
+    # Search (maintained by apps.catalog.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    search_name = models.CharField(
+        max_length=300,
+        blank=True,
+        editable=False,
+        verbose_name='نام نرمال‌شده'
+    )
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'محصول'
         verbose_name_plural = 'محصولات'
@@ -256,6 +405,17 @@ class Product(models.Model):
             models.Index(fields=['status', 'is_featured']),
             models.Index(fields=['category', 'brand']),
             models.Index(fields=['price']),
+            # کلیدهای صفحه‌بندی keyset برای هر گزینه مرتب‌سازی
+            models.Index(fields=['status', 'sale_price', 'id']),
+            models.Index(fields=['status', 'name', 'id']),
+            models.Index(fields=['status', 'created_at', 'id']),
+            models.Index(fields=['status', 'sale_count', 'id']),
+            GinIndex(fields=['search_vector'], name='catalog_product_search_gin'),
+            GinIndex(
+                fields=['search_name'],
+                name='catalog_product_name_trgm',
+                opclasses=['gin_trgm_ops']
+            ),
         ]
     
     def __str__(self):
@@ -278,25 +438,183 @@ class Product(models.Model):
             return False
         return self.stock_quantity <= self.low_stock_threshold
     
+    @property
+    def original_price(self):
+        """قیمت قبل از تخفیف برای نمایش (قیمت مقایسه یا قیمت اصلی)"""
+        if self.compare_price and self.compare_price > self.sale_price:
+            return self.compare_price
+        if self.sale_price < self.price:
+            return self.price
+        return None
+    
     @property
     def discount_percentage(self):
-        """درصد تخفیف"""
-        if self.compare_price and self.compare_price > self.price:
-            return int(((self.compare_price - self.price) / self.compare_price) * 100)
-        return 0
+        """درصد تخفیف (محاسبه شده هنگام ذخیره)"""
+        return self.sale_discount
+    
+    @property
+    def has_price_range(self):
+        """تنوع‌ها قیمت‌های متفاوت دارند"""
+        return self.min_variant_price is not None and self.min_variant_price != self.max_variant_price
+    
+    def compute_sale_fields(self, rule_set=None):
+        """محاسبه قیمت نهایی و درصد تخفیف با موتور قیمت‌گذاری (بدون ذخیره)"""
+        from apps.marketing.pricing import get_rule_set
+        
+        self.sale_price = (rule_set or get_rule_set()).unit_price(self)
+        original_price = self.original_price
+        if original_price:
+            self.sale_discount = int(((original_price - self.sale_price) / original_price) * 100)
+        else:
+            self.sale_discount = 0
+    
+    def save(self, *args, **kwargs):
+        self.compute_sale_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and SALE_PRICE_DEPENDENCIES.intersection(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'sale_price', 'sale_discount'}
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def refresh_sale_prices(cls, queryset=None, batch_size=1000):
+        """محاسبه مجدد قیمت نهایی محصولات و ذخیره فقط موارد تغییر کرده"""
+        from apps.marketing.pricing import get_rule_set
+        
+        rule_set = get_rule_set()
+        queryset = cls.objects.all() if queryset is None else queryset
+        products = queryset.only(
+            'id', 'price', 'compare_price', 'category_id', 'sale_price', 'sale_discount'
+        ).order_by('pk')
+        
+        changed, updated = [], 0
+        for product in products.iterator(chunk_size=batch_size):
+            previous = (product.sale_price, product.sale_discount)
+            product.compute_sale_fields(rule_set)
+            if (product.sale_price, product.sale_discount) != previous:
+                changed.append(product)
+            if len(changed) >= batch_size:
+                cls.objects.bulk_update(changed, ['sale_price', 'sale_discount'])
+                updated += len(changed)
+                changed = []
+        if changed:
+            cls.objects.bulk_update(changed, ['sale_price', 'sale_discount'])
+            updated += len(changed)
+        if updated:
+            from .facets import invalidate_facet_index
+            invalidate_facet_index()
+        return updated
+    
+    @classmethod
+    def refresh_variant_prices(cls, queryset=None):
+        """به‌روزرسانی کمترین و بیشترین قیمت تنوع‌های فعال با یک UPDATE"""
+        variants = ProductVariant.objects.filter(
+            product=OuterRef('pk'), is_active=True, price__isnull=False
+        ).order_by().values('product')
+        queryset = cls.objects.all() if queryset is None else queryset
+        return queryset.update(
+            min_variant_price=Subquery(variants.annotate(low=Min('price')).values('low')),
+            max_variant_price=Subquery(variants.annotate(high=Max('price')).values('high')),
+        )
+    
+    @cached_property
+    def primary_image(self):
+        """تصویر اصلی محصول (تصویر is_primary یا اولین تصویر به ترتیب)"""
+        if hasattr(self, PRIMARY_IMAGE_ATTR):
+            images = getattr(self, PRIMARY_IMAGE_ATTR)
+            return images[0] if images else None
+        
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        if 'images' in prefetched:
+            images = sorted(
+                prefetched['images'],
+                key=lambda image: (not image.is_primary, image.order, image.created_at)
+            )
+            return images[0] if images else None
+        
+        return self.images.order_by(*PRIMARY_IMAGE_ORDERING).first()
+    
+    @property
+    def primary_image_url(self):
+        """آدرس تصویر اصلی برای کارت محصول"""
+        image = self.primary_image
+        if image and image.image:
+            return image.image.url
+        return ''
+    
+    def get_related_products(self, limit=4):
+        """محصولات مرتبط از جدول پیش‌محاسبه شده (پرفروش‌های هم‌دسته)"""
+        entries = RelatedProduct.objects.filter(
+            product=self,
+            related__status='active'
+        ).select_related('related__brand').prefetch_related(
+            primary_image_prefetch('related__images')
+        )[:limit]
+        related = [entry.related for entry in entries]
+        if related:
+            return related
+        
+        # محصول جدید که هنوز در جدول محصولات مرتبط نیست
+        return list(Product.objects.filter(
+            status='active',
+            category_id=self.category_id
+        ).exclude(pk=self.pk).select_related('brand').with_primary_image().order_by('-sale_count')[:limit])
     
     @property
     def average_rating(self):
         """میانگین امتیاز"""
-        reviews = self.reviews.filter(is_approved=True)
-        if reviews.exists():
-            return reviews.aggregate(models.Avg('rating'))['rating__avg']
-        return 0
+        return self.rating_average
     
     @property
     def review_count(self):
         """تعداد نظرات"""
-        return self.reviews.filter(is_approved=True).count()
+        return self.rating_count
+    
+    @classmethod
+    def apply_rating_delta(cls, product_id, rating_delta, count_delta):
+        """
+        به‌روزرسانی اتمیک آمار امتیاز محصول
+        
+        مقادیر جدید در همان دستور UPDATE از مقادیر فعلی ستون‌ها محاسبه
+        می‌شوند، بنابراین نظرات هم‌زمان یکدیگر را بازنویسی نمی‌کنند.
+        """
+        if not rating_delta and not count_delta:
+            return
+        
+        new_sum = F('rating_sum') + rating_delta
+        new_count = F('rating_count') + count_delta
+        cls.objects.filter(pk=product_id).update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating_average=rating_average_expression(new_sum, new_count),
+        )
+
+
+def rating_average_expression(rating_sum, rating_count):
+    """عبارت SQL میانگین امتیاز (صفر در صورت نبود نظر)"""
+    return Coalesce(
+        Cast(rating_sum, DecimalField(max_digits=12, decimal_places=2)) / NullIf(rating_count, 0),
+        Value(0),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+PRIMARY_IMAGE_ORDERING = ['-is_primary', 'order', 'created_at']
+PRIMARY_IMAGE_ATTR = 'prefetched_primary_images'
+
+
+def primary_image_prefetch(lookup='images'):
+    """
+    Prefetch تصویر اصلی محصولات
+    
+    فقط یک تصویر برای هر محصول بارگذاری می‌شود و در Product.primary_image
+    قرار می‌گیرد. lookup را می‌توان برای مدل‌های مرتبط تغییر داد
+    (مثلاً 'product__images' برای آیتم‌های سبد خرید).
+    """
+    return models.Prefetch(
+        lookup,
+        queryset=ProductImage.objects.order_by(*PRIMARY_IMAGE_ORDERING)[:1],
+        to_attr=PRIMARY_IMAGE_ATTR,
+    )
 
 
 class ProductImage(models.Model):
@@ -489,4 +807,31 @@ class Wishlist(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
-        return f'{self.user.full_name} - {self.product.name}'
\ No newline at end of file
+        return f'{self.user.full_name} - {self.product.name}'
+
+
+class RelatedProduct(models.Model):
+    """محصولات مرتبط پیش‌محاسبه شده (به‌روزرسانی توسط تسک refresh_related_products)"""
+    
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='related_entries',
+        verbose_name='محصول'
+    )
+    related = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='محصول مرتبط'
+    )
+    rank = models.PositiveSmallIntegerField(default=0, verbose_name='رتبه')
+    
+    class Meta:
+        verbose_name = 'محصول مرتبط'
+        verbose_name_plural = 'محصولات مرتبط'
+        unique_together = ['product', 'related']
+        ordering = ['product', 'rank']
+    
+    def __str__(self):
+        return f'{self.product_id} -> {self.related_id}'
@@ -0,0 +1,96 @@
+"""
+کش منوی ناوبری
+
+درخت دسته‌بندی‌های فعال، مسیر کامل همه دسته‌بندی‌ها و فهرست برندهای فعال
+یک بار ساخته و به صورت سریال‌شده در کش (Redis) ذخیره می‌شود. هر worker
+نسخه فعلی را در یک LRU محلی نگه می‌دارد و با ذخیره یا حذف دسته‌بندی یا
+برند، نسخه عوض شده و همه workerها داده جدید را دریافت می‌کنند.
+"""
+import uuid
+from functools import lru_cache
+
+from django.core.cache import cache
+
+NAVIGATION_VERSION_KEY = 'catalog:navigation:version'
+NAVIGATION_KEY = 'catalog:navigation:{}'
+NAVIGATION_TIMEOUT = 60 * 60 * 24
+
+
+def navigation_version():
+    version = cache.get(NAVIGATION_VERSION_KEY)
+    if version is None:
+        cache.add(NAVIGATION_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(NAVIGATION_VERSION_KEY)
+    return version
+
+
+def invalidate_navigation():
+    """باطل کردن کش منو در همه workerها"""
+    cache.set(NAVIGATION_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def build_navigation():
+    """ساخت داده‌های منو با دو کوئری (دسته‌بندی‌ها و برندها)"""
+    from .models import Brand, Category
+    
+    nodes, paths, roots = {}, {}, []
+    for category in Category.objects.order_by('tree_id', 'lft'):
+        parent_path = paths.get(category.parent_id)
+        paths[category.pk] = f'{parent_path} > {category.name}' if parent_path else category.name
+        
+        parent = nodes.get(category.parent_id)
+        if not category.is_active or (category.parent_id and parent is None):
+            # دسته‌بندی غیرفعال و زیرشاخه‌هایش در منو نمایش داده نمی‌شوند
+            continue
+        
+        node = {
+            'id': category.pk,
+            'name': category.name,
+            'slug': category.slug,
+            'url': category.get_absolute_url(),
+            'icon': category.icon,
+            'image_url': category.image.url if category.image else '',
+            'description': category.description,
+            'is_featured': category.is_featured,
+            'level': category.level,
+            'full_path': paths[category.pk],
+            'children': [],
+        }
+        nodes[category.pk] = node
+        if parent is None:
+            roots.append(node)
+        else:
+            parent['children'].append(node)
+    
+    brands = [
+        {
+            'id': brand.pk,
+            'name': brand.name,
+            'slug': brand.slug,
+            'url': brand.get_absolute_url(),
+            'logo_url': brand.logo.url if brand.logo else '',
+        }
+        for brand in Brand.objects.filter(is_active=True)
+    ]
+    
+    return {'categories': roots, 'brands': brands, 'paths': paths}
+
+
+@lru_cache(maxsize=4)
+def _navigation_for_version(version):
+    key = NAVIGATION_KEY.format(version)
+    navigation = cache.get(key)
+    if navigation is None:
+        navigation = build_navigation()
+        cache.set(key, navigation, NAVIGATION_TIMEOUT)
+    return navigation
+
+
+def get_navigation():
+    """داده‌های منو برای نسخه فعلی (فقط خواندنی)"""
+    return _navigation_for_version(navigation_version())
+
+
+def get_category_path(category_id):
+    """مسیر کامل دسته‌بندی از کش منو"""
+    return get_navigation()['paths'].get(category_id)
@@ -0,0 +1,117 @@
+"""
+جستجوی متن کامل محصولات
+
+بردار جستجو (search_vector) هنگام ذخیره محصول، برند یا دسته‌بندی از روی
+متن نرمال‌شده فارسی ساخته می‌شود و با ایندکس GIN جستجو می‌شود. در صورت
+نبود نتیجه، جستجوی شباهت trigram روی نام نرمال‌شده برای غلط‌های تایپی
+استفاده می‌شود.
+"""
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+)
+from django.db.models import F, Value
+
+SEARCH_CONFIG = 'simple'
+TRIGRAM_THRESHOLD = 0.3
+
+# فیلدهایی که تغییرشان نیاز به بازسازی بردار جستجو دارد
+SEARCH_FIELDS = {'name', 'sku', 'description', 'short_description', 'category', 'brand'}
+
+PERSIAN_TRANSLATION = str.maketrans({
+    'ي': 'ی',
+    'ى': 'ی',
+    'ك': 'ک',
+    'ۀ': 'ه',
+    'ة': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'ٱ': 'ا',
+    '\u200c': '',  # نیم‌فاصله
+    '\u200f': '',
+    '\u200e': '',
+    '\u0640': '',  # کشیده
+    **{persian: str(digit) for digit, persian in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{arabic: str(digit) for digit, arabic in enumerate('٠١٢٣٤٥٦٧٨٩')},
+})
+
+DIACRITICS_RE = re.compile('[\u064b-\u065f\u0670]')
+TERM_RE = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    """نرمال‌سازی متن فارسی برای جستجو"""
+    if not text:
+        return ''
+    text = DIACRITICS_RE.sub('', str(text).translate(PERSIAN_TRANSLATION))
+    return ' '.join(text.lower().split())
+
+
+def build_search_vector(product):
+    """ساخت بردار جستجوی وزن‌دار برای یک محصول"""
+    def vector(text, weight):
+        return SearchVector(Value(normalize_text(text)), weight=weight, config=SEARCH_CONFIG)
+    
+    return (
+        vector(f'{product.name} {product.sku}', 'A')
+        + vector(f'{product.brand.name} {product.category.name}', 'B')
+        + vector(product.short_description, 'C')
+        + vector(product.description, 'D')
+    )
+
+
+def update_search_vector(product):
+    """به‌روزرسانی بردار جستجوی یک محصول"""
+    from .models import Product
+    
+    Product.objects.filter(pk=product.pk).update(
+        search_vector=build_search_vector(product),
+        search_name=normalize_text(product.name)[:300],
+    )
+
+
+def reindex_products(queryset):
+    """بازسازی بردار جستجوی مجموعه‌ای از محصولات"""
+    count = 0
+    for product in queryset.select_related('brand', 'category').iterator():
+        update_search_vector(product)
+        count += 1
+    return count
+
+
+def build_search_query(text):
+    """ساخت tsquery پیشوندی از عبارت جستجو"""
+    terms = TERM_RE.findall(normalize_text(text))
+    if not terms:
+        return None
+    return SearchQuery(
+        ' & '.join(f'{term}:*' for term in terms),
+        search_type='raw',
+        config=SEARCH_CONFIG
+    )
+
+
+def search_products(queryset, text):
+    """
+    جستجوی محصولات به ترتیب ارتباط
+    
+    ابتدا جستجوی متن کامل انجام می‌شود و اگر نتیجه‌ای نداشت، محصولاتی که
+    نامشان شباهت trigram کافی با عبارت دارند برگردانده می‌شوند.
+    """
+    search_query = build_search_query(text)
+    if search_query is None:
+        return queryset.none()
+    
+    results = queryset.filter(search_vector=search_query).annotate(
+        rank=SearchRank(F('search_vector'), search_query)
+    ).order_by('-rank', '-sale_count')
+    
+    if results.exists():
+        return results
+    
+    return queryset.annotate(
+        similarity=TrigramWordSimilarity(normalize_text(text), 'search_name')
+    ).filter(
+        similarity__gte=TRIGRAM_THRESHOLD
+    ).order_by('-similarity', '-sale_count')
@@ -0,0 +1,227 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .autocomplete import AUTOCOMPLETE_FIELDS, publish_change
+from .facets import FACET_FIELDS, invalidate_facet_index
+from .navigation import invalidate_navigation
+from .models import (
+    Brand, Category, Product, ProductAttribute, ProductAttributeValue, ProductReview,
+    ProductVariant, invalidate_category_tree
+)
+from .search import SEARCH_FIELDS, update_search_vector
+from .tasks import reindex_taxonomy_products
+
+
+def _rating_contribution(product_id, rating, is_approved):
+    """سهم یک نظر در آمار امتیاز محصول"""
+    if not is_approved:
+        return product_id, 0, 0
+    return product_id, rating, 1
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_review_rating(sender, instance, **kwargs):
+    """ذخیره وضعیت قبلی نظر برای محاسبه تغییرات امتیاز"""
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = sender.objects.filter(pk=instance.pk).values_list(
+            'product_id', 'rating', 'is_approved'
+        ).first()
+
+
+@receiver(post_save, sender=ProductReview)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    """به‌روزرسانی آمار امتیاز پس از ثبت، تأیید یا رد نظر"""
+    new_product_id, new_rating, new_count = _rating_contribution(
+        instance.product_id, instance.rating, instance.is_approved
+    )
+    
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is None:
+        Product.apply_rating_delta(new_product_id, new_rating, new_count)
+        return
+    
+    old_product_id, old_rating, old_count = _rating_contribution(*previous)
+    if old_product_id == new_product_id:
+        Product.apply_rating_delta(new_product_id, new_rating - old_rating, new_count - old_count)
+    else:
+        Product.apply_rating_delta(old_product_id, -old_rating, -old_count)
+        Product.apply_rating_delta(new_product_id, new_rating, new_count)
+
+
+@receiver(post_delete, sender=ProductReview)
+def update_rating_on_delete(sender, instance, **kwargs):
+    """کسر امتیاز نظر حذف شده از آمار محصول"""
+    product_id, rating, count = _rating_contribution(
+        instance.product_id, instance.rating, instance.is_approved
+    )
+    Product.apply_rating_delta(product_id, -rating, -count)
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_vector(sender, instance, update_fields=None, **kwargs):
+    """به‌روزرسانی بردار جستجو پس از تغییر متن محصول"""
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    update_search_vector(instance)
+
+
+@receiver(pre_save, sender=Brand)
+@receiver(pre_save, sender=Category)
+def remember_taxonomy_name(sender, instance, **kwargs):
+    """ذخیره نام قبلی برند یا دسته‌بندی برای تشخیص تغییر نام"""
+    instance._previous_name = None
+    if instance.pk:
+        instance._previous_name = sender.objects.filter(pk=instance.pk).values_list(
+            'name', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def reindex_related_products(sender, instance, created, update_fields=None, **kwargs):
+    """بازسازی بردار جستجوی محصولات (در Celery) پس از تغییر نام برند یا دسته‌بندی"""
+    if created or (update_fields is not None and 'name' not in update_fields):
+        return
+    if getattr(instance, '_previous_name', None) == instance.name:
+        return
+    
+    field, pk = sender._meta.model_name, instance.pk
+    transaction.on_commit(lambda: reindex_taxonomy_products.delay(field, pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def publish_product_autocomplete_change(sender, instance, update_fields=None, **kwargs):
+    """ثبت تغییر محصول برای ایندکس پیشنهاد خودکار"""
+    if update_fields is not None and not AUTOCOMPLETE_FIELDS.intersection(update_fields):
+        return
+    # pk پیش از commit خوانده می‌شود چون حذف آن را None می‌کند
+    pk = instance.pk
+    transaction.on_commit(lambda: publish_change('product', pk))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def publish_taxonomy_autocomplete_change(sender, instance, **kwargs):
+    """ثبت تغییر برند یا دسته‌بندی برای ایندکس پیشنهاد خودکار"""
+    kind, pk = sender._meta.model_name, instance.pk
+    transaction.on_commit(lambda: publish_change(kind, pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_facets(sender, instance, update_fields=None, **kwargs):
+    """باطل کردن ایندکس فیلترها پس از تغییر محصول"""
+    if update_fields is not None and not FACET_FIELDS.intersection(update_fields):
+        return
+    transaction.on_commit(invalidate_facet_index)
+
+
+@receiver(post_save, sender=ProductAttributeValue)
+@receiver(post_delete, sender=ProductAttributeValue)
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttribute)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_facets(sender, **kwargs):
+    """باطل کردن ایندکس فیلترها پس از تغییر ویژگی‌ها، برند یا دسته‌بندی"""
+    transaction.on_commit(invalidate_facet_index)
+
+
+def _category_contribution(category_id, status):
+    """سهم یک محصول در تعداد محصولات فعال دسته‌بندی"""
+    return category_id, 1 if status == 'active' else 0
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, **kwargs):
+    """ذخیره دسته‌بندی و وضعیت قبلی محصول برای به‌روزرسانی تعداد محصولات"""
+    instance._previous_category = None
+    if instance.pk:
+        instance._previous_category = sender.objects.filter(pk=instance.pk).values_list(
+            'category_id', 'status'
+        ).first()
+
+
+@receiver(post_save, sender=Product)
+def update_category_count_on_save(sender, instance, **kwargs):
+    """به‌روزرسانی تعداد محصولات دسته‌بندی‌ها پس از ذخیره محصول"""
+    new_category_id, new_count = _category_contribution(instance.category_id, instance.status)
+    previous = getattr(instance, '_previous_category', None)
+    old_category_id, old_count = _category_contribution(*previous) if previous else (None, 0)
+    
+    if old_category_id == new_category_id:
+        Category.apply_product_count_delta(new_category_id, new_count - old_count)
+    else:
+        Category.apply_product_count_delta(old_category_id, -old_count)
+        Category.apply_product_count_delta(new_category_id, new_count)
+
+
+@receiver(post_delete, sender=Product)
+def update_category_count_on_delete(sender, instance, **kwargs):
+    """کسر محصول حذف شده از تعداد محصولات دسته‌بندی‌ها"""
+    category_id, count = _category_contribution(instance.category_id, instance.status)
+    Category.apply_product_count_delta(category_id, -count)
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_parent(sender, instance, **kwargs):
+    """ذخیره والد قبلی برای تشخیص جابجایی در درخت"""
+    instance._previous_parent = None
+    if instance.pk:
+        instance._previous_parent = sender.objects.filter(pk=instance.pk).values_list(
+            'parent_id', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Category)
+def handle_category_tree_change(sender, instance, created, **kwargs):
+    """به‌روزرسانی داده‌های وابسته به درخت پس از تغییر دسته‌بندی"""
+    if not created and instance._previous_parent != instance.parent_id:
+        Category.rebuild_product_counts()
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_delete, sender=Category)
+def handle_category_delete(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_navigation_cache(sender, **kwargs):
+    """باطل کردن کش منو پس از تغییر برند یا دسته‌بندی"""
+    transaction.on_commit(invalidate_navigation)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def update_variant_price_range(sender, instance, **kwargs):
+    """به‌روزرسانی بازه قیمت تنوع‌های محصول"""
+    Product.refresh_variant_prices(Product.objects.filter(pk=instance.product_id))
+
+
+@receiver(post_migrate)
+def backfill_sale_prices(sender, using='default', **kwargs):
+    """
+    مقداردهی قیمت نهایی و بازه قیمت تنوع‌ها پس از migrate
+    
+    فقط محصولاتی که هنوز مقدار پیش‌فرض ستون‌های جدید را دارند محاسبه
+    می‌شوند، بنابراین فهرست‌ها منتظر اجرای تسک دوره‌ای نمی‌مانند.
+    """
+    if sender.name != 'apps.catalog':
+        return
+    products = Product.objects.using(using)
+    Product.refresh_sale_prices(products.filter(sale_price=0, price__gt=0))
+    priced_variants = ProductVariant.objects.using(using).filter(is_active=True, price__isnull=False)
+    Product.refresh_variant_prices(products.filter(
+        min_variant_price__isnull=True,
+        pk__in=priced_variants.values('product_id'),
+    ))
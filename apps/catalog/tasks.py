@@ -0,0 +1,95 @@
+from celery import shared_task
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Product, RelatedProduct
+import logging
+
+logger = logging.getLogger(__name__)
+
+RELATED_PRODUCTS_LIMIT = 4
+SALE_PRICES_REFRESHED_KEY = 'catalog:sale_prices:refreshed_at'
+
+
+@shared_task
+def refresh_related_products():
+    """بازسازی جدول محصولات مرتبط (پرفروش‌ترین محصولات هم‌دسته)"""
+    try:
+        top_sellers = {}
+        products = Product.objects.filter(status='active').order_by(
+            'category_id', '-sale_count', '-id'
+        ).values_list('id', 'category_id')
+        for pk, category_id in products:
+            top_sellers.setdefault(category_id, []).append(pk)
+        
+        entries = []
+        for product_ids in top_sellers.values():
+            candidates = product_ids[:RELATED_PRODUCTS_LIMIT + 1]
+            for pk in product_ids:
+                related = [candidate for candidate in candidates if candidate != pk]
+                entries.extend(
+                    RelatedProduct(product_id=pk, related_id=related_id, rank=rank)
+                    for rank, related_id in enumerate(related[:RELATED_PRODUCTS_LIMIT])
+                )
+        
+        with transaction.atomic():
+            RelatedProduct.objects.all().delete()
+            RelatedProduct.objects.bulk_create(entries, batch_size=1000)
+        
+        logger.info(f"Refreshed {len(entries)} related product entries")
+        return {'success': True, 'entries': len(entries)}
+    
+    except Exception as e:
+        logger.error(f"Related products refresh error: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def refresh_sale_prices(force=False):
+    """
+    محاسبه مجدد قیمت نهایی و درصد تخفیف محصولات
+    
+    بدون force فقط وقتی اجرا می‌شود که از اجرای قبلی، زمان شروع یا پایان
+    یکی از تخفیف‌های ویژه فرا رسیده باشد.
+    """
+    from apps.marketing.models import Discount
+    from apps.marketing.pricing import invalidate_pricing
+    
+    try:
+        now = timezone.now()
+        last_run = cache.get(SALE_PRICES_REFRESHED_KEY)
+        if not force and last_run is not None:
+            boundary_crossed = Discount.objects.filter(is_active=True).filter(
+                Q(valid_from__gt=last_run, valid_from__lte=now)
+                | Q(valid_until__gt=last_run, valid_until__lte=now)
+            ).exists()
+            if not boundary_crossed:
+                return {'success': True, 'updated': 0}
+            invalidate_pricing()
+        
+        updated = Product.refresh_sale_prices()
+        cache.set(SALE_PRICES_REFRESHED_KEY, now, None)
+        
+        logger.info(f"Refreshed sale prices of {updated} products")
+        return {'success': True, 'updated': updated}
+    
+    except Exception as e:
+        logger.error(f"Sale prices refresh error: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def reindex_taxonomy_products(field, pk):
+    """بازسازی بردار جستجوی محصولات یک برند یا دسته‌بندی پس از تغییر نام آن"""
+    from .search import reindex_products
+    
+    try:
+        reindexed = reindex_products(Product.objects.filter(**{f'{field}_id': pk}))
+        
+        logger.info(f"Reindexed {reindexed} products of {field} {pk}")
+        return {'success': True, 'reindexed': reindexed}
+    
+    except Exception as e:
+        logger.error(f"Search reindex error for {field} {pk}: {e}")
+        return {'success': False, 'error': str(e)}
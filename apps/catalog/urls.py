@@ -6,6 +6,7 @@ app_name = 'catalog'
 urlpatterns = [
     path('', views.ProductListView.as_view(), name='product_list'),
     path('search/', views.ProductSearchView.as_view(), name='search'),
+    path('search/autocomplete/', views.autocomplete, name='autocomplete'),
     path('featured/', views.FeaturedProductsView.as_view(), name='featured_products'),
     path('category/<slug:slug>/', views.CategoryDetailView.as_view(), name='category_detail'),
     path('brand/<slug:slug>/', views.BrandDetailView.as_view(), name='brand_detail'),
@@ -1,16 +1,31 @@
 from django.shortcuts import render, get_object_or_404
 from django.views.generic import ListView, DetailView
 from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, F
+from django.db.models import Q, F, Prefetch
 from django.core.paginator import Paginator
-from .models import Product, Category, Brand, Wishlist
+from apps.core.counters import record_view
+from apps.core.pagination import KeysetPaginationMixin
+from .models import Product, Category, Brand, ProductReview, Wishlist
 from .forms import ProductFilterForm
+from .search import search_products
+from .autocomplete import autocomplete_index
+from .facets import (
+    apply_facet_filters, facet_counts, get_facet_index, parse_facet_selection, price_range_mask
+)
 
 
-class ProductListView(ListView):
+def parse_price(value):
+    """تبدیل پارامتر قیمت به عدد (None در صورت نامعتبر بودن)"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProductListView(KeysetPaginationMixin, ListView):
     """لیست محصولات"""
     model = Product
     template_name = 'catalog/product_list.html'
@@ -18,34 +33,26 @@ class ProductListView(ListView):
     paginate_by = 12
     
     def get_queryset(self):
-        queryset = Product.objects.filter(status='active').select_related('category', 'brand').prefetch_related('images')
+        queryset = Product.objects.filter(status='active').select_related('category', 'brand').with_primary_image()
         
-        # فیلتر دسته‌بندی
-        category_slug = self.request.GET.get('category')
-        if category_slug:
-            category = get_object_or_404(Category, slug=category_slug)
-            queryset = queryset.filter(category=category)
-        
-        # فیلتر برند
-        brand_slug = self.request.GET.get('brand')
-        if brand_slug:
-            brand = get_object_or_404(Brand, slug=brand_slug)
-            queryset = queryset.filter(brand=brand)
+        # فیلترهای دسته‌بندی، برند، بازه قیمت، موجودی و ویژگی‌ها
+        self.facet_selection = parse_facet_selection(self.request.GET)
+        queryset = apply_facet_filters(queryset, self.facet_selection)
         
         # فیلتر قیمت
-        min_price = self.request.GET.get('min_price')
-        max_price = self.request.GET.get('max_price')
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
+        self.min_price = parse_price(self.request.GET.get('min_price'))
+        self.max_price = parse_price(self.request.GET.get('max_price'))
+        if self.min_price is not None:
+            queryset = queryset.filter(sale_price__gte=self.min_price)
+        if self.max_price is not None:
+            queryset = queryset.filter(sale_price__lte=self.max_price)
         
         # مرتب‌سازی
         sort = self.request.GET.get('sort')
         if sort == 'price_asc':
-            queryset = queryset.order_by('price')
+            queryset = queryset.order_by('sale_price')
         elif sort == 'price_desc':
-            queryset = queryset.order_by('-price')
+            queryset = queryset.order_by('-sale_price')
         elif sort == 'name_asc':
             queryset = queryset.order_by('name')
         elif sort == 'name_desc':
@@ -61,8 +68,16 @@ class ProductListView(ListView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.filter(is_active=True)
-        context['brands'] = Brand.objects.filter(is_active=True)
+        
+        # تعداد محصولات هر فیلتر از ایندکس فیلترها
+        index = get_facet_index()
+        facets = facet_counts(
+            index,
+            self.facet_selection,
+            price_range_mask(index, self.min_price, self.max_price)
+        )
+        context['category_facet'] = facets[0]
+        context['facets'] = facets[1:]
         return context
 
 
@@ -73,36 +88,39 @@ class ProductDetailView(DetailView):
     context_object_name = 'product'
     
     def get_queryset(self):
-        return Product.objects.filter(status='active').select_related('category', 'brand').prefetch_related('images', 'reviews')
+        return Product.objects.filter(status='active').select_related('category', 'brand').prefetch_related(
+            'images',
+            Prefetch('reviews', queryset=ProductReview.objects.select_related('user'))
+        )
     
-    def get_object(self):
-        obj = super().get_object()
-        # افزایش تعداد بازدید
-        obj.view_count += 1
-        obj.save(update_fields=['view_count'])
+    def get_object(self, queryset=None):
+        obj = super().get_object(queryset)
+        # ثبت بازدید در شمارنده بافرشده
+        record_view(self.request, obj)
         return obj
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product = self.get_object()
+        product = self.object
         
-        # محصولات مرتبط
-        context['related_products'] = Product.objects.filter(
-            status='active',
-            category=product.category
-        ).exclude(id=product.id)[:4]
+        # محصولات مرتبط (از جدول پیش‌محاسبه شده)
+        related_products = product.get_related_products()
+        context['related_products'] = related_products
         
-        # بررسی وجود در لیست علاقه‌مندی‌ها
+        # بررسی وجود در لیست علاقه‌مندی‌ها (محصول و محصولات مرتبط با یک کوئری)
+        wishlist_ids = set()
         if self.request.user.is_authenticated:
-            context['in_wishlist'] = Wishlist.objects.filter(
+            wishlist_ids = set(Wishlist.objects.filter(
                 user=self.request.user,
-                product=product
-            ).exists()
+                product_id__in=[product.pk] + [related.pk for related in related_products]
+            ).values_list('product_id', flat=True))
+        context['wishlist_ids'] = wishlist_ids
+        context['in_wishlist'] = product.pk in wishlist_ids
         
         return context
 
 
-class CategoryDetailView(ListView):
+class CategoryDetailView(KeysetPaginationMixin, ListView):
     """محصولات یک دسته‌بندی"""
     model = Product
     template_name = 'catalog/category_detail.html'
@@ -112,9 +130,8 @@ class CategoryDetailView(ListView):
     def get_queryset(self):
         self.category = get_object_or_404(Category, slug=self.kwargs['slug'])
         return Product.objects.filter(
-            status='active',
-            category=self.category
-        ).select_related('brand').prefetch_related('images')
+            status='active'
+        ).in_category(self.category).select_related('brand').with_primary_image()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -122,7 +139,7 @@ class CategoryDetailView(ListView):
         return context
 
 
-class BrandDetailView(ListView):
+class BrandDetailView(KeysetPaginationMixin, ListView):
     """محصولات یک برند"""
     model = Product
     template_name = 'catalog/brand_detail.html'
@@ -134,7 +151,7 @@ class BrandDetailView(ListView):
         return Product.objects.filter(
             status='active',
             brand=self.brand
-        ).select_related('category').prefetch_related('images')
+        ).select_related('category').with_primary_image()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -142,7 +159,7 @@ class BrandDetailView(ListView):
         return context
 
 
-class ProductSearchView(ListView):
+class ProductSearchView(KeysetPaginationMixin, ListView):
     """جستجوی محصولات"""
     model = Product
     template_name = 'catalog/search_results.html'
@@ -154,14 +171,10 @@ class ProductSearchView(ListView):
         if not query:
             return Product.objects.none()
         
-        return Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(short_description__icontains=query) |
-            Q(brand__name__icontains=query) |
-            Q(category__name__icontains=query),
+        queryset = Product.objects.filter(
             status='active'
-        ).select_related('category', 'brand').prefetch_related('images')
+        ).select_related('category', 'brand').with_primary_image()
+        return search_products(queryset, query)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -169,6 +182,14 @@ class ProductSearchView(ListView):
         return context
 
 
+@require_GET
+def autocomplete(request):
+    """پیشنهاد خودکار جستجو"""
+    query = request.GET.get('q', '').strip()
+    suggestions = autocomplete_index.search(query)
+    return JsonResponse({'query': query, **suggestions})
+
+
 class FeaturedProductsView(ListView):
     """محصولات ویژه"""
     model = Product
@@ -179,7 +200,7 @@ class FeaturedProductsView(ListView):
         return Product.objects.filter(
             status='active',
             is_featured=True
-        ).select_related('category', 'brand').prefetch_related('images')[:8]
+        ).select_related('category', 'brand').with_primary_image()[:8]
 
 
 @login_required
@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils.translation import gettext_lazy as _
-from django.utils import timezone
 import uuid
 
+ORDER_NUMBER_ATTEMPTS = 3
+
 
 class Order(models.Model):
     """سفارشات"""
@@ -128,14 +129,30 @@ class Order(models.Model):
         return f'سفارش {self.order_number}'
     
     def save(self, *args, **kwargs):
-        if not self.order_number:
+        if self.order_number:
+            super().save(*args, **kwargs)
+            return
+        
+        # شماره فقط در حالت جایگزین (بدون Redis) یا پس از آن ممکن است تکراری
+        # باشد؛ در این صورت شمارنده پیش از تلاش بعدی با پایگاه داده هم‌تراز می‌شود
+        for attempt in range(ORDER_NUMBER_ATTEMPTS):
             self.order_number = self.generate_order_number()
-        super().save(*args, **kwargs)
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                duplicate = Order.objects.filter(order_number=self.order_number).exists()
+                if not duplicate or attempt == ORDER_NUMBER_ATTEMPTS - 1:
+                    self.order_number = ''
+                    raise
+                from .numbering import resync_order_numbers
+                resync_order_numbers()
     
     def generate_order_number(self):
-        """تولید شماره سفارش"""
-        timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
-        return f'ORD{timestamp}'
+        """تولید شماره سفارش یکتا (تخصیص بلوکی از Redis)"""
+        from .numbering import next_order_number
+        return next_order_number()
     
     @property
     def is_paid(self):
@@ -0,0 +1,127 @@
+"""
+تخصیص شماره سفارش
+
+شماره‌ها از یک شمارنده Redis به صورت بلوکی گرفته می‌شوند: هر worker با یک
+INCRBY بازه‌ای از ORDER_NUMBER_BLOCK_SIZE شماره را رزرو می‌کند و تا تمام
+شدن آن بدون مراجعه به Redis شماره می‌دهد. بنابراین شماره‌ها در همه
+workerها یکتا هستند ولی لزوماً به ترتیب زمان ثبت نیستند و با راه‌اندازی
+مجدد worker ممکن است چند شماره استفاده نشده باقی بماند.
+
+اگر شمارنده در Redis وجود نداشته باشد (اولین اجرا یا پاک شدن Redis) از
+بزرگ‌ترین شماره ثبت شده در پایگاه داده مقداردهی می‌شود. پس از تخصیص
+جایگزین (در زمان قطعی Redis) یا برخورد با شماره تکراری، شمارنده پیش از
+رزرو بلوک بعدی به صورت اتمیک حداقل تا بزرگ‌ترین شماره پایگاه داده بالا
+برده می‌شود تا شماره‌های استفاده شده دوباره داده نشوند.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db.models.functions import Length
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+ORDER_NUMBER_KEY = 'checkout:order_number'
+ORDER_NUMBER_PREFIX = 'ORD'
+DEFAULT_ORDER_NUMBER_START = 1000000
+DEFAULT_ORDER_NUMBER_BLOCK_SIZE = 20
+
+# بالا بردن شمارنده تا حداقل ARGV[1] و سپس رزرو بلوک ARGV[2] تایی
+RESERVE_AFTER_RESYNC_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local floor = tonumber(ARGV[1])
+if current < floor then
+    redis.call('SET', KEYS[1], floor)
+end
+return redis.call('INCRBY', KEYS[1], ARGV[2])
+"""
+
+
+def format_order_number(value):
+    return f'{ORDER_NUMBER_PREFIX}{value}'
+
+
+def last_order_number():
+    """بزرگ‌ترین شماره عددی ثبت شده در پایگاه داده"""
+    from .models import Order
+    
+    start = getattr(settings, 'ORDER_NUMBER_START', DEFAULT_ORDER_NUMBER_START)
+    # شماره‌های قدیمی مبتنی بر زمان (۱۴ رقم) در نظر گرفته نمی‌شوند
+    number = (
+        Order.objects.filter(order_number__regex=rf'^{ORDER_NUMBER_PREFIX}[0-9]{{7,12}}$')
+        .order_by(Length('order_number').desc(), '-order_number')
+        .values_list('order_number', flat=True)
+        .first()
+    )
+    if number is None:
+        return start
+    return max(start, int(number[len(ORDER_NUMBER_PREFIX):]))
+
+
+class OrderNumberAllocator:
+    """تخصیص‌دهنده بلوکی شماره سفارش (یک نمونه در هر worker)"""
+    
+    def __init__(self, key=ORDER_NUMBER_KEY):
+        self.key = key
+        self._lock = threading.Lock()
+        self._next = 0
+        self._high = -1
+        self._resync = False
+    
+    @property
+    def block_size(self):
+        return getattr(settings, 'ORDER_NUMBER_BLOCK_SIZE', DEFAULT_ORDER_NUMBER_BLOCK_SIZE)
+    
+    def _reserve_block(self):
+        redis = get_redis_connection('default')
+        if self._resync:
+            high = redis.eval(
+                RESERVE_AFTER_RESYNC_SCRIPT, 1, self.key, last_order_number(), self.block_size
+            )
+            self._resync = False
+        else:
+            if not redis.exists(self.key):
+                redis.set(self.key, last_order_number(), nx=True)
+            high = redis.incrby(self.key, self.block_size)
+        self._next = high - self.block_size + 1
+        self._high = high
+    
+    def resync(self):
+        """کنار گذاشتن بلوک فعلی و هم‌تراز کردن شمارنده با پایگاه داده در رزرو بعدی"""
+        with self._lock:
+            self._next = 0
+            self._high = -1
+            self._resync = True
+    
+    def allocate(self):
+        with self._lock:
+            if self._next > self._high:
+                self._reserve_block()
+            value = self._next
+            self._next += 1
+        return value
+
+
+allocator = OrderNumberAllocator()
+
+
+def next_order_number():
+    """
+    شماره سفارش بعدی
+    
+    در صورت در دسترس نبودن Redis از بزرگ‌ترین شماره پایگاه داده استفاده
+    می‌شود؛ در این حالت تکرار شماره ممکن است و Order.save دوباره تلاش می‌کند.
+    """
+    try:
+        return format_order_number(allocator.allocate())
+    except RedisError as e:
+        logger.warning(f"Order number allocator error: {e}")
+        allocator.resync()
+        return format_order_number(last_order_number() + 1)
+
+
+def resync_order_numbers():
+    """اعلام شماره تکراری تا شمارنده پیش از تخصیص بعدی هم‌تراز شود"""
+    allocator.resync()
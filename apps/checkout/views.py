@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.views.generic import TemplateView
@@ -8,8 +10,12 @@ from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction
 from .models import Order, OrderItem, ShippingMethod
 from apps.cart.models import Cart, CartItem
+from apps.cart.coupons import NO_DISCOUNT_MESSAGE, CouponError, get_coupon, redeem_coupon
+from apps.cart.inventory import commit_checkout
+from apps.marketing.pricing import get_rule_set, redeem_discounts
 from apps.payments.models import Payment, PaymentProvider
-from apps.payments.backends import PaymentGateway
+
+ORDER_ITEMS_BATCH_SIZE = 500
 
 
 class CheckoutView(TemplateView):
@@ -38,8 +44,10 @@ class CheckoutView(TemplateView):
         if not request.user.is_authenticated:
             return redirect('accounts:login')
         
+        # آیتم‌های سبد یک بار با محصول و تنوع بارگذاری می‌شوند
         cart = Cart.objects.filter(user=request.user).first()
-        if not cart or cart.is_empty:
+        items = list(cart.items.select_related('product', 'variant')) if cart else []
+        if not items:
             messages.error(request, 'سبد خرید شما خالی است.')
             return redirect('cart:cart')
         
@@ -51,29 +59,33 @@ class CheckoutView(TemplateView):
         try:
             with transaction.atomic():
                 # ایجاد سفارش
-                order = self.create_order(request, cart, shipping_address_id, shipping_method_id)
+                order = self.create_order(request, items, shipping_address_id, shipping_method_id)
                 
                 # ایجاد آیتم‌های سفارش
-                self.create_order_items(order, cart)
+                self.create_order_items(order, items)
                 
                 # ایجاد پرداخت
                 payment = self.create_payment(order, payment_method)
                 
-                # پاک کردن سبد خرید
-                cart.delete()
+                # ثبت قطعی موجودی (قفل سطرهای محصولات تا پایان تراکنش)
+                commit_checkout(cart, items)
                 
-                # هدایت به درگاه پرداخت
-                if payment_method == 'online':
-                    return self.redirect_to_payment_gateway(payment)
-                else:
-                    messages.success(request, 'سفارش شما با موفقیت ثبت شد.')
-                    return redirect('checkout:checkout_success', order_number=order.order_number)
+                # پاک کردن سبد خرید و کوپن اعمال شده
+                cart.delete()
+                request.session.pop('applied_coupon', None)
         
         except Exception as e:
             messages.error(request, f'خطا در ثبت سفارش: {str(e)}')
             return redirect('checkout:checkout')
+        
+        # اتصال به درگاه پس از commit و بیرون از تراکنش انجام می‌شود
+        if payment_method == 'online':
+            return redirect('payments:start_payment', payment_id=payment.payment_id)
+        
+        messages.success(request, 'سفارش شما با موفقیت ثبت شد.')
+        return redirect('checkout:checkout_success', order_number=order.order_number)
     
-    def create_order(self, request, cart, shipping_address_id, shipping_method_id):
+    def create_order(self, request, items, shipping_address_id, shipping_method_id):
         """ایجاد سفارش"""
         shipping_address = get_object_or_404(
             request.user.addresses,
@@ -86,20 +98,33 @@ class CheckoutView(TemplateView):
             is_active=True
         )
         
-        # محاسبه هزینه ارسال
-        shipping_cost = shipping_method.calculate_cost(cart.total_price)
-        
-        # محاسبه تخفیف
-        discount_amount = 0
+        # کوپن ذخیره شده در session دوباره بررسی می‌شود
+        coupon = None
         if 'applied_coupon' in request.session:
-            discount_amount = request.session['applied_coupon']['discount']
+            coupon = get_coupon(request.session['applied_coupon']['code'])
+            if coupon is None:
+                raise CouponError('کوپن یافت نشد')
+            subtotal = sum((item.total_price for item in items), Decimal('0'))
+            can_use, message = coupon.can_use(request.user, subtotal)
+            if not can_use:
+                raise CouponError(message)
+        
+        # قیمت‌گذاری نهایی سبد (تخفیف‌های ویژه و کوپن) در یک گذر
+        pricing = get_rule_set().evaluate(items, coupon)
+        if coupon and not pricing.coupon_discount:
+            # کوپنی که تخفیفی ایجاد نمی‌کند مصرف نمی‌شود
+            raise CouponError(NO_DISCOUNT_MESSAGE)
+        
+        # محاسبه هزینه ارسال
+        shipping_cost = shipping_method.calculate_cost(pricing.subtotal)
         
         # محاسبه مجموع کل
-        total_amount = cart.total_price + shipping_cost - discount_amount
+        discount_amount = pricing.discount_total
+        total_amount = pricing.subtotal + shipping_cost - discount_amount
         
         order = Order.objects.create(
             user=request.user,
-            subtotal=cart.total_price,
+            subtotal=pricing.subtotal,
             shipping_cost=shipping_cost,
             discount_amount=discount_amount,
             total_amount=total_amount,
@@ -111,19 +136,26 @@ class CheckoutView(TemplateView):
             shipping_postal_code=shipping_address.postal_code
         )
         
+        # مصرف اتمیک تخفیف‌ها و کوپن (در صورت اتمام ظرفیت کل سفارش برگردانده می‌شود)
+        redeem_discounts(pricing.rule_ids)
+        if coupon:
+            redeem_coupon(coupon, request.user, order, pricing.coupon_discount)
+        
         return order
     
-    def create_order_items(self, order, cart):
-        """ایجاد آیتم‌های سفارش"""
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
+    def create_order_items(self, order, items):
+        """ایجاد آیتم‌های سفارش با یک INSERT (save و total_price خودکار اجرا نمی‌شوند)"""
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
-                product=cart_item.product,
-                variant=cart_item.variant,
+                product_id=cart_item.product_id,
+                variant_id=cart_item.variant_id,
                 quantity=cart_item.quantity,
                 price=cart_item.price,
-                total_price=cart_item.total_price
+                total_price=cart_item.price * cart_item.quantity
             )
+            for cart_item in items
+        ], batch_size=ORDER_ITEMS_BATCH_SIZE)
     
     def create_payment(self, order, payment_method):
         """ایجاد پرداخت"""
@@ -143,27 +175,6 @@ class CheckoutView(TemplateView):
         )
         
         return payment
-    
-    def redirect_to_payment_gateway(self, payment):
-        """هدایت به درگاه پرداخت"""
-        gateway = PaymentGateway()
-        
-        result = gateway.create_payment(
-            provider_name=payment.provider.slug,
-            amount=payment.amount,
-            order_number=payment.order.order_number,
-            callback_url=f'/payments/verify/{payment.payment_id}/',
-            description=f'پرداخت سفارش {payment.order.order_number}'
-        )
-        
-        if result['success']:
-            payment.provider_transaction_id = result.get('authority') or result.get('track_id')
-            payment.status = 'processing'
-            payment.save()
-            
-            return redirect(result['payment_url'])
-        else:
-            raise Exception(result['error'])
 
 
 class CheckoutSuccessView(TemplateView):
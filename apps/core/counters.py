@@ -0,0 +1,124 @@
+"""
+شمارنده‌های بافرشده بازدید
+
+بازدیدها به جای UPDATE هم‌زمان روی ردیف محصول یا مقاله، با HINCRBY در یک
+hash در Redis جمع می‌شوند و تسک دوره‌ای flush_view_counters آن‌ها را با
+یک UPDATE ... CASE برای هر دسته از ردیف‌ها به پایگاه داده منتقل می‌کند.
+ربات‌ها و بازدیدهای تکراری یک بازدیدکننده در VIEW_DEDUP_WINDOW شمرده
+نمی‌شوند.
+"""
+import hashlib
+import logging
+import re
+import uuid
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError, ResponseError
+
+logger = logging.getLogger(__name__)
+
+COUNTED_MODELS = ('catalog.product', 'blog.blogpost')
+VIEW_COUNTER_KEY = 'counters:views:{}'
+VIEW_SEEN_KEY = 'counters:seen:{}:{}:{}'
+VIEW_DEDUP_WINDOW = 60 * 30
+FLUSH_BATCH_SIZE = 500
+VIEW_FLUSH_LOCK_KEY = 'counters:flush:lock:{}'
+VIEW_FLUSH_LOCK_TIMEOUT = 60 * 10
+
+BOT_USER_AGENT_RE = re.compile(
+    r'bot|crawl|spider|slurp|mediapartners|facebookexternalhit|preview|'
+    r'curl|wget|python-requests|httpclient|headless|lighthouse',
+    re.IGNORECASE
+)
+
+
+def is_bot(request):
+    """تشخیص ساده ربات‌ها از روی User-Agent"""
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    return not user_agent or bool(BOT_USER_AGENT_RE.search(user_agent))
+
+
+def visitor_fingerprint(request):
+    """شناسه بازدیدکننده برای حذف بازدیدهای تکراری"""
+    if request.session.session_key:
+        return request.session.session_key
+    raw = f"{request.META.get('REMOTE_ADDR', '')}|{request.META.get('HTTP_USER_AGENT', '')}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def record_view(request, obj):
+    """ثبت یک بازدید در بافر Redis (بدون نوشتن در پایگاه داده)"""
+    if is_bot(request):
+        return False
+    
+    label = obj._meta.label_lower
+    try:
+        redis = get_redis_connection('default')
+        seen_key = VIEW_SEEN_KEY.format(label, obj.pk, visitor_fingerprint(request))
+        if not redis.set(seen_key, 1, nx=True, ex=VIEW_DEDUP_WINDOW):
+            return False
+        redis.hincrby(VIEW_COUNTER_KEY.format(label), obj.pk, 1)
+    except RedisError as e:
+        logger.warning(f"View counter error for {label}:{obj.pk}: {e}")
+        return False
+    return True
+
+
+def flush_model_views(label):
+    """انتقال بازدیدهای بافرشده یک مدل به ستون view_count"""
+    lock_key = VIEW_FLUSH_LOCK_KEY.format(label)
+    # اجرای هم‌زمان دو flush (مثلاً تسک دوره‌ای و اجرای دستی) ممکن نیست
+    if not cache.add(lock_key, True, VIEW_FLUSH_LOCK_TIMEOUT):
+        return 0
+    try:
+        return _flush_model_views(label)
+    finally:
+        cache.delete(lock_key)
+
+
+def _flush_model_views(label):
+    model = apps.get_model(label)
+    redis = get_redis_connection('default')
+    key = VIEW_COUNTER_KEY.format(label)
+    run_key = f'{key}:flushing:{uuid.uuid4().hex}'
+    
+    # بافر فعلی با RENAME اتمیک به کلید مخصوص این اجرا منتقل و با یک
+    # MULTI خوانده و حذف می‌شود؛ بازدیدهای جدید در hash تازه جمع می‌شوند
+    try:
+        redis.rename(key, run_key)
+    except ResponseError:
+        # بافر خالی است
+        return 0
+    pipe = redis.pipeline()
+    pipe.hgetall(run_key)
+    pipe.delete(run_key)
+    raw_counts, _deleted = pipe.execute()
+    
+    counts = [(int(pk), int(count)) for pk, count in raw_counts.items()]
+    
+    try:
+        # همه دسته‌ها در یک تراکنش اعمال می‌شوند تا خطا در میانه کار
+        # بخشی از بازدیدها را دو بار ثبت نکند
+        with transaction.atomic():
+            for start in range(0, len(counts), FLUSH_BATCH_SIZE):
+                batch = counts[start:start + FLUSH_BATCH_SIZE]
+                model.objects.filter(pk__in=[pk for pk, _count in batch]).update(
+                    view_count=F('view_count') + Case(
+                        *[When(pk=pk, then=Value(count)) for pk, count in batch],
+                        default=Value(0),
+                        output_field=IntegerField()
+                    )
+                )
+    except Exception:
+        # بازگرداندن بازدیدهای اعمال نشده به بافر برای اجرای بعدی
+        pipe = redis.pipeline()
+        for pk, count in counts:
+            pipe.hincrby(key, pk, count)
+        pipe.execute()
+        raise
+    
+    return sum(count for _pk, count in counts)
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.core.management import call_command
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.db import connection
 import os
 
 User = get_user_model()
@@ -9,7 +10,7 @@ User = get_user_model()
 
 class Command(BaseCommand):
     help = 'راه‌اندازی اولیه برای محیط تولید'
-
+    
     def handle(self, *args, **options):
         self.stdout.write('شروع راه‌اندازی محیط تولید...')
         
@@ -19,6 +20,11 @@ class Command(BaseCommand):
                 self.style.WARNING('هشدار: DEBUG=True در محیط تولید!')
             )
         
+        # فعال‌سازی افزونه trigram برای جستجوی محصولات
+        self.stdout.write('فعال‌سازی افزونه pg_trgm...')
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        
         # اجرای مایگریشن‌ها
         self.stdout.write('اجرای مایگریشن‌ها...')
         call_command('migrate', verbosity=0)
@@ -36,6 +42,14 @@ class Command(BaseCommand):
         self.stdout.write('ایجاد داده نمونه...')
         call_command('create_sample_data')
         
+        # محاسبه قیمت نهایی محصولات
+        self.stdout.write('محاسبه قیمت نهایی محصولات...')
+        call_command('refresh_product_prices')
+        
+        # ساخت ایندکس جستجو
+        self.stdout.write('ساخت ایندکس جستجوی محصولات...')
+        call_command('rebuild_search_index')
+        
         # بهینه‌سازی پایگاه داده
         self.stdout.write('بهینه‌سازی پایگاه داده...')
         call_command('optimize_db')
@@ -0,0 +1,272 @@
+"""
+صفحه‌بندی keyset (seek)
+
+به جای OFFSET، صفحه بعد با شرط «بعد از آخرین ردیف» روی ستون مرتب‌سازی
+فعال و شناسه پیدا می‌شود، بنابراین صفحات عمیق هم مثل صفحه اول سریع
+هستند. تعداد کل ردیف‌ها فقط در صورت نیاز و به صورت تخمینی (از آمار
+PostgreSQL) محاسبه می‌شود.
+
+پارامتر page سازگار باقی می‌ماند: مقدار عددی همان صفحه‌بندی قبلی (با
+تعداد تخمینی) است و مقدار توکن (شروع با CURSOR_PREFIX) صفحه keyset است.
+"""
+import base64
+import datetime
+import json
+import math
+from collections.abc import Sequence
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, InvalidPage, PageNotAnInteger, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+CURSOR_PREFIX = 'k'
+
+
+def estimate_count(queryset):
+    """تخمین تعداد ردیف‌ها از pg_class.reltuples یا برنامه اجرای کوئری"""
+    try:
+        if not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return int(row[0])
+        
+        plan = json.loads(queryset.explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    except (DatabaseError, ValueError, KeyError, IndexError, TypeError):
+        return queryset.count()
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder با دقت کامل زمان (میکروثانیه) برای مقایسه دقیق مرز صفحه"""
+    
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, values], cls=CursorEncoder, separators=(',', ':'))
+    return CURSOR_PREFIX + base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        data = token[len(CURSOR_PREFIX):]
+        payload = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+        direction, values = json.loads(payload)
+    except (ValueError, TypeError):
+        raise InvalidPage('توکن صفحه نامعتبر است')
+    if direction not in ('next', 'previous') or not isinstance(values, list):
+        raise InvalidPage('توکن صفحه نامعتبر است')
+    if any(isinstance(value, (list, dict)) for value in values):
+        raise InvalidPage('توکن صفحه نامعتبر است')
+    return direction, values
+
+
+def _model_field(model, path):
+    """فیلد مدل متناظر با یک ستون مرتب‌سازی (با پشتیبانی از __)"""
+    field = None
+    for name in path.lstrip('-').split('__'):
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        if field.is_relation:
+            model = field.related_model
+    return field
+
+
+def clean_cursor_values(queryset, ordering, values):
+    """تبدیل مقادیر توکن به نوع ستون‌ها؛ مقدار نامعتبر InvalidPage صادر می‌کند"""
+    cleaned = []
+    for field_name, value in zip(ordering, values):
+        try:
+            field = _model_field(queryset.model, field_name)
+            cleaned.append(None if value is None else field.to_python(value))
+        except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+            raise InvalidPage('توکن صفحه نامعتبر است')
+    return cleaned
+
+
+def _field_value(obj, field):
+    value = obj
+    for attribute in field.lstrip('-').split('__'):
+        value = getattr(value, attribute)
+    return value
+
+
+def _reverse(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def _keyset_filter(ordering, values):
+    """شرط «بعد از» برای ترتیب چندستونی (هر ستون با جهت خودش)"""
+    condition = Q()
+    for position, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f'{field.lstrip("-")}__{lookup}': values[position]})
+        for previous_field, previous_value in zip(ordering[:position], values[:position]):
+            clause &= Q(**{previous_field.lstrip('-'): previous_value})
+        condition |= clause
+    return condition
+
+
+class EstimatedCountPaginator(Paginator):
+    """صفحه‌بندی عددی با تعداد تخمینی به جای COUNT(*)"""
+    
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+    
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('شماره صفحه نامعتبر است')
+        if number < 1:
+            raise EmptyPage('شماره صفحه کمتر از ۱ است')
+        return number
+    
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class KeysetPage(Sequence):
+    """صفحه keyset با رابط سازگار با Page جنگو"""
+    
+    number = None
+    
+    def __init__(self, object_list, paginator, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._ordering = ordering
+        self._has_next = has_next
+        self._has_previous = has_previous
+    
+    def __repr__(self):
+        return f'<Keyset page of {len(self.object_list)} items>'
+    
+    def __len__(self):
+        return len(self.object_list)
+    
+    def __getitem__(self, index):
+        return self.object_list[index]
+    
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+    
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+    
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+    
+    def next_page_number(self):
+        if not self._has_next or not self.object_list:
+            raise EmptyPage('صفحه بعدی وجود ندارد')
+        last = self.object_list[-1]
+        return encode_cursor('next', [_field_value(last, field) for field in self._ordering])
+    
+    def previous_page_number(self):
+        if not self._has_previous or not self.object_list:
+            raise EmptyPage('صفحه قبلی وجود ندارد')
+        first = self.object_list[0]
+        return encode_cursor('previous', [_field_value(first, field) for field in self._ordering])
+
+
+class KeysetPaginator:
+    """صفحه‌بندی keyset روی ترتیب داده شده (آخرین ستون باید یکتا باشد)"""
+    
+    page_range = []
+    
+    def __init__(self, object_list, per_page, ordering):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = ordering
+    
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+    
+    @cached_property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+    
+    def page(self, token=None):
+        direction, values = decode_cursor(token) if token else ('next', None)
+        if values is not None and len(values) != len(self.ordering):
+            raise InvalidPage('توکن صفحه با ترتیب فعلی سازگار نیست')
+        if values is not None:
+            values = clean_cursor_values(self.object_list, self.ordering, values)
+        
+        ordering = self.ordering if direction == 'next' else [_reverse(field) for field in self.ordering]
+        queryset = self.object_list.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(_keyset_filter(ordering, values))
+        
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not rows and values is not None:
+            # توکن قدیمی یا ساختگی بعد از انتهای فهرست
+            raise EmptyPage('صفحه‌ای با این توکن وجود ندارد')
+        
+        if direction == 'next':
+            return KeysetPage(rows, self, self.ordering, has_more, values is not None)
+        rows.reverse()
+        return KeysetPage(rows, self, self.ordering, True, has_more)
+
+
+class KeysetPaginationMixin:
+    """
+    افزودن صفحه‌بندی keyset به ListView
+    
+    ترتیب فعلی کوئری‌ست (یا ordering مدل) به همراه pk به عنوان کلید صفحه‌بندی
+    استفاده می‌شود؛ فقط ستون‌های مدل، نه مقادیر annotate شده. شماره صفحه عددی (لینک‌های قدیمی) همچنان با OFFSET و
+    تعداد تخمینی پشتیبانی می‌شود.
+    """
+    paginator_class = EstimatedCountPaginator
+    
+    def get_keyset_ordering(self, queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not all(isinstance(field, str) and field != '?' for field in ordering):
+            return None
+        # مقادیر محاسبه شده (مثل rank و similarity جستجو) اعشاری هستند و پس از
+        # بازگشت از توکن دقیقاً با مقدار محاسبه شده دوباره در WHERE برابر
+        # نمی‌شوند؛ این کوئری‌ها با OFFSET صفحه‌بندی می‌شوند
+        annotations = queryset.query.annotations
+        if any(field.lstrip('-').split('__')[0] in annotations for field in ordering):
+            return None
+        ordering = [field for field in ordering if field.lstrip('-') not in ('pk', 'id')]
+        descending = bool(ordering) and ordering[-1].startswith('-')
+        return ordering + ['-pk' if descending else 'pk']
+    
+    def paginate_queryset(self, queryset, page_size):
+        page = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or ''
+        ordering = self.get_keyset_ordering(queryset)
+        
+        if ordering is None or (page.isdigit() and page != '1') or page == 'last':
+            return super().paginate_queryset(queryset, page_size)
+        
+        paginator = KeysetPaginator(queryset, page_size, ordering)
+        try:
+            page = paginator.page(page if page.startswith(CURSOR_PREFIX) else None)
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return (paginator, page, page.object_list, page.has_other_pages())
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        params = self.request.GET.copy()
+        params.pop(self.page_kwarg, None)
+        context['pagination_query'] = params.urlencode()
+        return context
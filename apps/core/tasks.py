@@ -0,0 +1,19 @@
+from celery import shared_task
+from .counters import COUNTED_MODELS, flush_model_views
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def flush_view_counters():
+    """انتقال بازدیدهای بافرشده به پایگاه داده"""
+    flushed = {}
+    for label in COUNTED_MODELS:
+        try:
+            flushed[label] = flush_model_views(label)
+        except Exception as e:
+            logger.error(f"View counter flush error for {label}: {e}")
+            flushed[label] = 0
+    
+    return {'success': True, 'flushed': flushed}
@@ -17,4 +17,5 @@ class DiscountAdmin(admin.ModelAdmin):
     list_filter = ['discount_type', 'is_active', 'valid_from', 'valid_until', 'created_at']
     list_editable = ['is_active']
     search_fields = ['name', 'description']
+    filter_horizontal = ['products', 'categories']
     readonly_fields = ['used_count', 'created_at', 'updated_at']
\ No newline at end of file
@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class MarketingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.marketing'
-    verbose_name = 'بازاریابی'
\ No newline at end of file
+    verbose_name = 'بازاریابی'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
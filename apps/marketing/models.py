@@ -81,6 +81,24 @@ class Discount(models.Model):
         blank=True,
         verbose_name='حداکثر تخفیف'
     )
+    get_quantity = models.PositiveIntegerField(
+        default=1,
+        verbose_name='تعداد رایگان (Y)',
+        help_text='برای تخفیف خرید X دریافت Y؛ مقدار تخفیف تعداد خرید (X) است'
+    )
+    products = models.ManyToManyField(
+        'catalog.Product',
+        blank=True,
+        related_name='discounts',
+        verbose_name='محصولات'
+    )
+    categories = models.ManyToManyField(
+        'catalog.Category',
+        blank=True,
+        related_name='discounts',
+        verbose_name='دسته‌بندی‌ها',
+        help_text='در صورت خالی بودن محصولات و دسته‌بندی‌ها، تخفیف روی کل سفارش اعمال می‌شود'
+    )
     usage_limit = models.PositiveIntegerField(
         null=True,
         blank=True,
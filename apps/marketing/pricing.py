@@ -0,0 +1,310 @@
+"""
+موتور قیمت‌گذاری
+
+تخفیف‌های ویژه فعال (Discount) یک بار به مجموعه‌ای از قواعد در حافظه
+تبدیل می‌شوند و هر worker آن را بر اساس نسخه کش نگه می‌دارد؛ ذخیره یا حذف
+یک تخفیف نسخه را عوض می‌کند. کل سبد در یک گذر ارزیابی می‌شود:
+
+1. برای هر آیتم بهترین قاعده سطح آیتم (تخفیف‌های دارای محصول/دسته‌بندی
+   هدف و همه تخفیف‌های خرید X دریافت Y) اعمال می‌شود.
+2. بهترین قاعده سطح سفارش (تخفیف‌های درصدی یا ثابت بدون هدف) روی مجموع
+   باقی‌مانده اعمال می‌شود.
+3. کوپن روی مبلغ باقی‌مانده محاسبه می‌شود.
+
+قواعد با هم جمع نمی‌شوند و در هر مرحله فقط بیشترین تخفیف انتخاب می‌شود.
+نتیجه ارزیابی هر سبد بر اساس نسخه محتوای سبد در کش ذخیره می‌شود.
+"""
+import uuid
+from decimal import ROUND_DOWN, Decimal
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+PRICING_VERSION_KEY = 'marketing:pricing:version'
+CART_PRICING_KEY = 'marketing:pricing:cart:{}:{}:{}:{}'
+CART_PRICING_TIMEOUT = 60 * 5
+ZERO = Decimal('0')
+
+
+class PricingChanged(Exception):
+    """قواعد قیمت‌گذاری هنگام ثبت سفارش تغییر کرده‌اند"""
+    pass
+
+
+def pricing_version():
+    version = cache.get(PRICING_VERSION_KEY)
+    if version is None:
+        cache.add(PRICING_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(PRICING_VERSION_KEY)
+    return version
+
+
+def invalidate_pricing():
+    """باطل کردن قواعد کامپایل شده در همه workerها"""
+    cache.set(PRICING_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _floor(amount):
+    return Decimal(amount).quantize(Decimal('1'), rounding=ROUND_DOWN)
+
+
+class PricingRule:
+    """یک تخفیف ویژه کامپایل شده"""
+    
+    def __init__(self, discount, product_ids, category_ids):
+        self.id = discount.pk
+        self.name = discount.name
+        self.kind = discount.discount_type
+        self.value = discount.value
+        self.get_quantity = discount.get_quantity
+        self.minimum_amount = discount.minimum_amount
+        self.maximum_discount = discount.maximum_discount
+        self.valid_from = discount.valid_from
+        self.valid_until = discount.valid_until
+        self.product_ids = frozenset(product_ids)
+        self.category_ids = frozenset(category_ids)
+        self.targeted = bool(self.product_ids or self.category_ids)
+        self.is_line_rule = self.targeted or self.kind == 'buy_x_get_y'
+    
+    def is_live(self, now):
+        return self.valid_from <= now <= self.valid_until
+    
+    def qualifies(self, amount):
+        return not self.minimum_amount or amount >= self.minimum_amount
+    
+    def matches(self, product):
+        if not self.targeted:
+            return True
+        return product.pk in self.product_ids or product.category_id in self.category_ids
+    
+    def _cap(self, amount):
+        if self.maximum_discount:
+            amount = min(amount, self.maximum_discount)
+        return _floor(amount)
+    
+    def unit_discount(self, unit_price):
+        """تخفیف یک واحد (برای قواعد درصدی و ثابت)"""
+        if self.kind == 'percentage':
+            return self._cap(unit_price * self.value / 100)
+        if self.kind == 'fixed':
+            return self._cap(min(self.value, unit_price))
+        return ZERO
+    
+    def line_discount(self, unit_price, quantity):
+        if self.kind == 'buy_x_get_y':
+            group = int(self.value) + self.get_quantity
+            if group <= self.get_quantity:
+                return ZERO
+            free_units = (quantity // group) * self.get_quantity
+            return self._cap(unit_price * free_units)
+        if self.kind == 'percentage':
+            return self._cap(unit_price * quantity * self.value / 100)
+        return self._cap(min(self.value, unit_price) * quantity)
+    
+    def order_discount(self, amount):
+        if self.kind == 'percentage':
+            return self._cap(amount * self.value / 100)
+        return self._cap(min(self.value, amount))
+
+
+class PricedLine:
+    """نتیجه قیمت‌گذاری یک آیتم"""
+    
+    def __init__(self, item, discount=ZERO, rule=None):
+        self.item = item
+        self.quantity = item.quantity
+        self.unit_price = item.price
+        self.subtotal = item.price * item.quantity
+        self.discount = discount
+        self.rule = rule
+    
+    @property
+    def total(self):
+        return self.subtotal - self.discount
+
+
+class PricingResult:
+    """نتیجه ارزیابی کامل یک سبد"""
+    
+    def __init__(self, lines, order_discount=ZERO, order_rule=None, coupon=None, coupon_discount=ZERO):
+        self.lines = lines
+        self.subtotal = sum((line.subtotal for line in lines), ZERO)
+        self.line_discount = sum((line.discount for line in lines), ZERO)
+        self.order_discount = order_discount
+        self.order_rule = order_rule
+        self.coupon = coupon
+        self.coupon_discount = coupon_discount
+    
+    @property
+    def discount_total(self):
+        return self.line_discount + self.order_discount + self.coupon_discount
+    
+    @property
+    def total(self):
+        return self.subtotal - self.discount_total
+    
+    @property
+    def rule_ids(self):
+        ids = {line.rule.id for line in self.lines if line.rule}
+        if self.order_rule:
+            ids.add(self.order_rule.id)
+        return sorted(ids)
+    
+    def as_dict(self):
+        """خلاصه قابل ذخیره در کش"""
+        return {
+            'subtotal': self.subtotal,
+            'line_discount': self.line_discount,
+            'order_discount': self.order_discount,
+            'coupon_discount': self.coupon_discount,
+            'discount_total': self.discount_total,
+            'total': self.total,
+            'rule_ids': self.rule_ids,
+            'lines': {str(line.item.id): line.discount for line in self.lines},
+        }
+
+
+class PricingRuleSet:
+    """مجموعه قواعد کامپایل شده"""
+    
+    def __init__(self, rules):
+        self.line_rules = [rule for rule in rules if rule.is_line_rule]
+        self.order_rules = [rule for rule in rules if not rule.is_line_rule]
+    
+    def unit_price(self, product, price=None, now=None):
+        """
+        قیمت نهایی یک واحد محصول برای نمایش در فهرست‌ها
+        
+        فقط قواعد درصدی و ثابت بدون حداقل مبلغ خرید در نظر گرفته می‌شوند،
+        چون بقیه به محتوای سبد بستگی دارند.
+        """
+        now = now or timezone.now()
+        price = product.price if price is None else price
+        best = ZERO
+        for rule in self.line_rules:
+            if rule.kind == 'buy_x_get_y' or rule.minimum_amount:
+                continue
+            if rule.is_live(now) and rule.matches(product):
+                best = max(best, rule.unit_discount(price))
+        return price - best
+    
+    def evaluate(self, items, coupon=None, now=None):
+        """
+        ارزیابی یک سبد در یک گذر
+        
+        items آیتم‌هایی با ویژگی‌های product، price و quantity هستند
+        (CartItem یا GuestCartItem). اعتبار کوپن برای کاربر باید پیش از این
+        بررسی شده باشد.
+        """
+        now = now or timezone.now()
+        subtotal = sum((item.price * item.quantity for item in items), ZERO)
+        live_line_rules = [
+            rule for rule in self.line_rules if rule.is_live(now) and rule.qualifies(subtotal)
+        ]
+        
+        lines = []
+        for item in items:
+            best, best_rule = ZERO, None
+            for rule in live_line_rules:
+                if rule.matches(item.product):
+                    discount = rule.line_discount(item.price, item.quantity)
+                    if discount > best:
+                        best, best_rule = discount, rule
+            lines.append(PricedLine(item, best, best_rule))
+        
+        remaining = subtotal - sum((line.discount for line in lines), ZERO)
+        order_discount, order_rule = ZERO, None
+        for rule in self.order_rules:
+            if rule.is_live(now) and rule.qualifies(remaining):
+                discount = rule.order_discount(remaining)
+                if discount > order_discount:
+                    order_discount, order_rule = discount, rule
+        remaining -= order_discount
+        
+        coupon_discount = ZERO
+        if coupon and coupon.is_valid and (not coupon.minimum_amount or remaining >= coupon.minimum_amount):
+            coupon_discount = min(_floor(coupon.calculate_discount(remaining)), remaining)
+        
+        return PricingResult(lines, order_discount, order_rule, coupon, coupon_discount)
+
+
+def build_rule_set():
+    """کامپایل تخفیف‌های ویژه فعال (با سه کوئری)"""
+    from .models import Discount
+    
+    discounts = list(
+        Discount.objects.filter(is_active=True, valid_until__gte=timezone.now())
+        .filter(Q(usage_limit__isnull=True) | Q(used_count__lt=F('usage_limit')))
+        .prefetch_related('products', 'categories')
+    )
+    
+    rules = []
+    for discount in discounts:
+        category_ids = set()
+        for category in discount.categories.all():
+            category_ids.update(category.get_descendant_ids())
+        product_ids = [product.pk for product in discount.products.all()]
+        rules.append(PricingRule(discount, product_ids, category_ids))
+    return PricingRuleSet(rules)
+
+
+@lru_cache(maxsize=4)
+def _rule_set(version, category_version):
+    return build_rule_set()
+
+
+def get_rule_set():
+    """مجموعه قواعد فعلی (کامپایل شده یک بار برای هر نسخه در هر worker)"""
+    from apps.catalog.models import category_tree_version
+    
+    return _rule_set(pricing_version(), category_tree_version())
+
+
+def price_cart(cart, coupon=None):
+    """
+    خلاصه قیمت نهایی یک سبد (CartStorage) با کش بر اساس نسخه محتوای سبد
+    
+    تا وقتی سبد، قواعد یا کوپن تغییر نکرده باشند آیتم‌ها دوباره بارگذاری
+    و ارزیابی نمی‌شوند.
+    """
+    summary = cart.summary
+    if not summary['total_items']:
+        return PricingResult([]).as_dict()
+    
+    key = CART_PRICING_KEY.format(
+        cart.summary_cache_key, summary.get('version', ''), pricing_version(), coupon.code if coupon else ''
+    )
+    result = cache.get(key)
+    if result is None:
+        result = get_rule_set().evaluate(cart.get_items(), coupon).as_dict()
+        cache.set(key, result, CART_PRICING_TIMEOUT)
+    return result
+
+
+def redeem_discounts(discount_ids):
+    """
+    ثبت اتمیک استفاده از تخفیف‌های ویژه یک سفارش
+    
+    باید داخل تراکنش ثبت سفارش فراخوانی شود. اگر ظرفیت یکی از تخفیف‌ها در
+    این فاصله تمام شده باشد قواعد باطل و PricingChanged صادر می‌شود.
+    """
+    from .models import Discount
+    
+    for discount_id in sorted(discount_ids):
+        redeemed = Discount.objects.filter(
+            Q(usage_limit__isnull=True) | Q(used_count__lt=F('usage_limit')),
+            pk=discount_id,
+        ).update(used_count=F('used_count') + 1)
+        if not redeemed:
+            invalidate_pricing()
+            raise PricingChanged('تخفیف‌های سبد خرید تغییر کرده‌اند. لطفاً دوباره تلاش کنید.')
+    
+    # تخفیف‌هایی که ظرفیتشان تمام شد از قواعد کامپایل شده حذف می‌شوند
+    exhausted = Discount.objects.filter(
+        pk__in=discount_ids, usage_limit__isnull=False, used_count__gte=F('usage_limit')
+    ).exists()
+    if exhausted:
+        transaction.on_commit(invalidate_pricing)
@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .models import Discount
+from .pricing import invalidate_pricing
+
+
+def _refresh_prices():
+    """باطل کردن قواعد و صف کردن محاسبه مجدد قیمت نهایی محصولات"""
+    from apps.catalog.tasks import refresh_sale_prices
+    
+    invalidate_pricing()
+    refresh_sale_prices.delay(force=True)
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def invalidate_discount_rules(sender, instance, **kwargs):
+    """باطل کردن قواعد قیمت‌گذاری کامپایل شده پس از تغییر تخفیف"""
+    transaction.on_commit(_refresh_prices)
+
+
+@receiver(m2m_changed, sender=Discount.products.through)
+@receiver(m2m_changed, sender=Discount.categories.through)
+def invalidate_discount_targets(sender, action, **kwargs):
+    """باطل کردن قواعد پس از تغییر محصولات یا دسته‌بندی‌های هدف"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(_refresh_prices)
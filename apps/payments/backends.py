@@ -1,16 +1,159 @@
+"""
+ارائه‌دهندگان پرداخت
+
+هر ارائه‌دهنده یک بار در هر worker ساخته می‌شود (load_providers) و یک
+requests.Session با اتصال‌های keep-alive دارد تا هر درخواست هزینه اتصال
+TCP و TLS جدید نپردازد. فقط عملیات idempotent (تأیید پرداخت) پس از خطای
+شبکه یا پاسخ 5xx دوباره تلاش می‌شوند؛ ایجاد پرداخت و مرجوعی هرگز تکرار
+نمی‌شوند. خطاهای پیاپی هر ارائه‌دهنده مدار آن را برای مدتی قطع می‌کند
+(مشترک بین workerها از طریق کش) تا درخواست‌ها بدون انتظار برای timeout رد شوند؛
+سپس یک درخواست آزمایشی تعیین می‌کند که مدار بسته یا دوباره قطع شود.
+"""
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
 import requests
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CIRCUIT_THRESHOLD = 5
+DEFAULT_CIRCUIT_COOLDOWN = 30
+
+
+class GatewayError(Exception):
+    """خطای ارتباط با درگاه پرداخت"""
+    pass
+
+
+class GatewayUnavailable(GatewayError):
+    """مدار ارائه‌دهنده قطع است"""
+    pass
+
+
+# خطاهایی که نتیجه تراکنش را نامشخص می‌گذارند و تکرار درخواست مجاز است
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, GatewayError)
+
+
+class CircuitBreaker:
+    """
+    قطع‌کننده مدار یک ارائه‌دهنده (وضعیت در کش و مشترک بین workerها)
+    
+    پس از threshold خطای پیاپی مدار به مدت cooldown باز (قطع) می‌شود. پس از
+    آن مدار نیمه‌باز است: فقط یک درخواست آزمایشی عبور می‌کند؛ موفقیت آن مدار
+    را می‌بندد و خطای آن مدار را بلافاصله دوباره باز می‌کند.
+    """
+    
+    def __init__(self, name, threshold, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures_key = f'payments:circuit:{name}:failures'
+        self.open_key = f'payments:circuit:{name}:open'
+        self.tripped_key = f'payments:circuit:{name}:tripped'
+        self.probe_key = f'payments:circuit:{name}:probe'
+    
+    def allow(self):
+        if cache.get(self.open_key):
+            return False
+        if not cache.get(self.tripped_key):
+            return True
+        # نیمه‌باز: فقط یک درخواست آزمایشی (در صورت بی‌پاسخ ماندن، یکی در هر cooldown)
+        return cache.add(self.probe_key, True, self.cooldown)
+    
+    def record_success(self):
+        cache.delete_many([self.failures_key, self.tripped_key, self.probe_key])
+    
+    def record_failure(self):
+        if cache.get(self.tripped_key):
+            # خطای درخواست آزمایشی
+            self._open()
+            return
+        
+        # شمارش خطاها در یک پنجره زمانی به اندازه cooldown
+        cache.add(self.failures_key, 0, self.cooldown)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            failures = 1
+            cache.set(self.failures_key, failures, self.cooldown)
+        if failures >= self.threshold:
+            cache.set(self.tripped_key, True, None)
+            self._open()
+            logger.warning(f"Payment provider {self.name} circuit opened after {failures} failures")
+    
+    def _open(self):
+        cache.set(self.open_key, True, self.cooldown)
+        cache.delete_many([self.failures_key, self.probe_key])
+
 
 class PaymentProvider(ABC):
     """کلاس پایه برای ارائه‌دهندگان پرداخت"""
     
+    name = None
+    sandbox_url = None
+    production_url = None
+    
     def __init__(self, config):
         self.config = config
+        self.sandbox = config.get('sandbox', True)
+        self.base_url = config.get('base_url') or (self.sandbox_url if self.sandbox else self.production_url)
+        self.timeout = (
+            getattr(settings, 'PAYMENT_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            getattr(settings, 'PAYMENT_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+        )
+        self.max_retries = getattr(settings, 'PAYMENT_MAX_RETRIES', DEFAULT_MAX_RETRIES)
+        self.retry_backoff = getattr(settings, 'PAYMENT_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF)
+        self.breaker = CircuitBreaker(
+            self.name,
+            getattr(settings, 'PAYMENT_CIRCUIT_THRESHOLD', DEFAULT_CIRCUIT_THRESHOLD),
+            getattr(settings, 'PAYMENT_CIRCUIT_COOLDOWN', DEFAULT_CIRCUIT_COOLDOWN),
+        )
+        self.session = self._build_session()
+    
+    def _build_session(self):
+        session = requests.Session()
+        # تکرار درخواست در لایه اتصال غیرفعال است و فقط در _post کنترل می‌شود
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=getattr(settings, 'PAYMENT_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE),
+            max_retries=0
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    def _post(self, path, data, idempotent=False):
+        """ارسال درخواست JSON به ارائه‌دهنده و برگرداندن پاسخ"""
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        error = None
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                if error is not None:
+                    break
+                raise GatewayUnavailable(f'درگاه {self.name} موقتاً در دسترس نیست')
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            
+            try:
+                response = self.session.post(f'{self.base_url}{path}', json=data, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response.json()
+                error = GatewayError(f'HTTP {response.status_code}')
+            self.breaker.record_failure()
+        raise error
     
     @abstractmethod
     def create_payment(self, amount, order_number, callback_url, description=""):
@@ -31,15 +174,16 @@ class PaymentProvider(ABC):
 class ZarinpalProvider(PaymentProvider):
     """ارائه‌دهنده زرین‌پال"""
     
+    name = 'zarinpal'
+    sandbox_url = 'https://sandbox.zarinpal.com'
+    production_url = 'https://api.zarinpal.com'
+    
     def __init__(self, config):
         super().__init__(config)
         self.merchant_id = config.get('merchant_id', '')
-        self.sandbox = config.get('sandbox', True)
-        self.base_url = 'https://sandbox.zarinpal.com' if self.sandbox else 'https://api.zarinpal.com'
     
     def create_payment(self, amount, order_number, callback_url, description=""):
         try:
-            url = f"{self.base_url}/pg/v4/payment/request.json"
             data = {
                 'merchant_id': self.merchant_id,
                 'amount': int(amount),
@@ -50,10 +194,9 @@ class ZarinpalProvider(PaymentProvider):
                 }
             }
             
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+            result = self._post('/pg/v4/payment/request.json', data)
             
-            if result.get('data', {}).get('code') == 100:
+            if (result.get('data') or {}).get('code') == 100:
                 authority = result['data']['authority']
                 payment_url = f"{self.base_url}/pg/StartPay/{authority}"
                 return {
@@ -64,26 +207,25 @@ class ZarinpalProvider(PaymentProvider):
             else:
                 return {
                     'success': False,
-                    'error': result.get('errors', {}).get('message', 'خطای نامشخص')
+                    'error': (result.get('errors') or {}).get('message', 'خطای نامشخص')
                 }
-                
+        
         except Exception as e:
             logger.error(f"Zarinpal payment creation error: {e}")
             return {'success': False, 'error': str(e)}
     
     def verify_payment(self, authority, amount):
         try:
-            url = f"{self.base_url}/pg/v4/payment/verify.json"
             data = {
                 'merchant_id': self.merchant_id,
                 'amount': int(amount),
                 'authority': authority
             }
             
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+            result = self._post('/pg/v4/payment/verify.json', data, idempotent=True)
             
-            if result.get('data', {}).get('code') == 100:
+            # کد 101 یعنی تراکنش قبلاً تأیید شده است (مثلاً در تلاش قبلی)
+            if (result.get('data') or {}).get('code') in (100, 101):
                 return {
                     'success': True,
                     'transaction_id': result['data']['ref_id'],
@@ -93,9 +235,13 @@ class ZarinpalProvider(PaymentProvider):
             else:
                 return {
                     'success': False,
-                    'error': result.get('errors', {}).get('message', 'خطای نامشخص')
+                    'error': (result.get('errors') or {}).get('message', 'خطای نامشخص')
                 }
-                
+        
+        except RETRYABLE_ERRORS as e:
+            logger.error(f"Zarinpal payment verification error: {e}")
+            # خطای ارتباط است و نتیجه تراکنش هنوز مشخص نیست
+            return {'success': False, 'error': str(e), 'retryable': True}
         except Exception as e:
             logger.error(f"Zarinpal payment verification error: {e}")
             return {'success': False, 'error': str(e)}
@@ -108,15 +254,16 @@ class ZarinpalProvider(PaymentProvider):
 class ZibalProvider(PaymentProvider):
     """ارائه‌دهنده زیبال"""
     
+    name = 'zibal'
+    sandbox_url = 'https://sandbox.zibal.ir'
+    production_url = 'https://gateway.zibal.ir'
+    
     def __init__(self, config):
         super().__init__(config)
         self.merchant_id = config.get('merchant_id', '')
-        self.sandbox = config.get('sandbox', True)
-        self.base_url = 'https://sandbox.zibal.ir' if self.sandbox else 'https://gateway.zibal.ir'
     
     def create_payment(self, amount, order_number, callback_url, description=""):
         try:
-            url = f"{self.base_url}/v1/request"
             data = {
                 'merchant': self.merchant_id,
                 'amount': int(amount),
@@ -125,8 +272,7 @@ class ZibalProvider(PaymentProvider):
                 'orderId': order_number
             }
             
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+            result = self._post('/v1/request', data)
             
             if result.get('result') == 100:
                 track_id = result['trackId']
@@ -141,24 +287,23 @@ class ZibalProvider(PaymentProvider):
                     'success': False,
                     'error': result.get('message', 'خطای نامشخص')
                 }
-                
+        
         except Exception as e:
             logger.error(f"Zibal payment creation error: {e}")
             return {'success': False, 'error': str(e)}
     
     def verify_payment(self, track_id, amount):
         try:
-            url = f"{self.base_url}/v1/verify"
             data = {
                 'merchant': self.merchant_id,
                 'trackId': track_id,
                 'amount': int(amount)
             }
             
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+            result = self._post('/v1/verify', data, idempotent=True)
             
-            if result.get('result') == 100:
+            # کد 201 یعنی تراکنش قبلاً تأیید شده است
+            if result.get('result') in (100, 201):
                 return {
                     'success': True,
                     'transaction_id': result.get('refNumber', track_id),
@@ -170,7 +315,11 @@ class ZibalProvider(PaymentProvider):
                     'success': False,
                     'error': result.get('message', 'خطای نامشخص')
                 }
-                
+        
+        except RETRYABLE_ERRORS as e:
+            logger.error(f"Zibal payment verification error: {e}")
+            # خطای ارتباط است و نتیجه تراکنش هنوز مشخص نیست
+            return {'success': False, 'error': str(e), 'retryable': True}
         except Exception as e:
             logger.error(f"Zibal payment verification error: {e}")
             return {'success': False, 'error': str(e)}
@@ -183,15 +332,16 @@ class ZibalProvider(PaymentProvider):
 class TerbPayProvider(PaymentProvider):
     """ارائه‌دهنده ترب‌پی (پرداخت اقساطی)"""
     
+    name = 'terbpay'
+    sandbox_url = 'https://sandbox.terbpay.com'
+    production_url = 'https://api.terbpay.com'
+    
     def __init__(self, config):
         super().__init__(config)
         self.api_key = config.get('api_key', '')
-        self.sandbox = config.get('sandbox', True)
-        self.base_url = 'https://sandbox.terbpay.com' if self.sandbox else 'https://api.terbpay.com'
     
     def create_payment(self, amount, order_number, callback_url, description="", installment_count=12):
         try:
-            url = f"{self.base_url}/v1/installment/request"
             data = {
                 'api_key': self.api_key,
                 'amount': int(amount),
@@ -204,8 +354,7 @@ class TerbPayProvider(PaymentProvider):
                 }
             }
             
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+            result = self._post('/v1/installment/request', data)
             
             if result.get('status') == 'success':
                 return {
@@ -219,22 +368,20 @@ class TerbPayProvider(PaymentProvider):
                     'success': False,
                     'error': result.get('message', 'خطای نامشخص')
                 }
-                
+        
         except Exception as e:
             logger.error(f"TerbPay payment creation error: {e}")
             return {'success': False, 'error': str(e)}
     
     def verify_payment(self, transaction_id, amount):
         try:
-            url = f"{self.base_url}/v1/installment/verify"
             data = {
                 'api_key': self.api_key,
                 'transaction_id': transaction_id,
                 'amount': int(amount)
             }
             
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+            result = self._post('/v1/installment/verify', data, idempotent=True)
             
             if result.get('status') == 'success':
                 return {
@@ -247,22 +394,24 @@ class TerbPayProvider(PaymentProvider):
                     'success': False,
                     'error': result.get('message', 'خطای نامشخص')
                 }
-                
+        
+        except RETRYABLE_ERRORS as e:
+            logger.error(f"TerbPay payment verification error: {e}")
+            # خطای ارتباط است و نتیجه تراکنش هنوز مشخص نیست
+            return {'success': False, 'error': str(e), 'retryable': True}
         except Exception as e:
             logger.error(f"TerbPay payment verification error: {e}")
             return {'success': False, 'error': str(e)}
     
     def refund_payment(self, transaction_id, amount):
         try:
-            url = f"{self.base_url}/v1/installment/refund"
             data = {
                 'api_key': self.api_key,
                 'transaction_id': transaction_id,
                 'amount': int(amount)
             }
             
-            response = requests.post(url, json=data, timeout=10)
-            result = response.json()
+            result = self._post('/v1/installment/refund', data)
             
             if result.get('status') == 'success':
                 return {
@@ -274,35 +423,35 @@ class TerbPayProvider(PaymentProvider):
                     'success': False,
                     'error': result.get('message', 'خطای نامشخص')
                 }
-                
+        
         except Exception as e:
             logger.error(f"TerbPay refund error: {e}")
             return {'success': False, 'error': str(e)}
 
 
+PROVIDER_CLASSES = {
+    'zarinpal': ZarinpalProvider,
+    'zibal': ZibalProvider,
+    'terbpay': TerbPayProvider,
+}
+
+
+@lru_cache(maxsize=None)
+def load_providers():
+    """ارائه‌دهندگان پیکربندی شده (یک بار در هر worker با sessionهای مشترک)"""
+    configs = getattr(settings, 'PAYMENT_PROVIDERS', {})
+    return {
+        slug: provider_class(configs[slug])
+        for slug, provider_class in PROVIDER_CLASSES.items()
+        if slug in configs
+    }
+
+
 class PaymentGateway:
     """درگاه پرداخت"""
     
     def __init__(self):
-        self.providers = self._load_providers()
-    
-    def _load_providers(self):
-        """بارگذاری ارائه‌دهندگان"""
-        providers = {}
-        
-        # زرین‌پال
-        if hasattr(settings, 'PAYMENT_PROVIDERS') and 'zarinpal' in settings.PAYMENT_PROVIDERS:
-            providers['zarinpal'] = ZarinpalProvider(settings.PAYMENT_PROVIDERS['zarinpal'])
-        
-        # زیبال
-        if hasattr(settings, 'PAYMENT_PROVIDERS') and 'zibal' in settings.PAYMENT_PROVIDERS:
-            providers['zibal'] = ZibalProvider(settings.PAYMENT_PROVIDERS['zibal'])
-        
-        # ترب‌پی
-        if hasattr(settings, 'PAYMENT_PROVIDERS') and 'terbpay' in settings.PAYMENT_PROVIDERS:
-            providers['terbpay'] = TerbPayProvider(settings.PAYMENT_PROVIDERS['terbpay'])
-        
-        return providers
+        self.providers = load_providers()
     
     def create_payment(self, provider_name, amount, order_number, callback_url, description="", **kwargs):
         """ایجاد پرداخت"""
@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    """پاسخ‌های شبیه‌سازی شده زرین‌پال، زیبال و ترب‌پی"""
+    
+    mode = 'ok'
+    delay = 0
+    callbacks = {}
+    lock = threading.Lock()
+    
+    def log_message(self, format, *args):
+        self.server.stdout.write(f'{self.command} {self.path} - {format % args}')
+    
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _redirect(self, url):
+        self.send_response(302)
+        self.send_header('Location', url)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def _remember(self, token, callback_url):
+        with self.lock:
+            self.callbacks[token] = callback_url
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = json.loads(self.rfile.read(length) or b'{}')
+        
+        if self.delay:
+            time.sleep(self.delay)
+        if self.mode == 'error':
+            return self._send_json({'message': 'stub error'}, status=503)
+        
+        token = uuid.uuid4().hex[:12]
+        host = f'http://{self.headers.get("Host")}'
+        
+        if self.path == '/pg/v4/payment/request.json':
+            self._remember(token, data.get('callback_url'))
+            return self._send_json({'data': {'code': 100, 'authority': token}, 'errors': []})
+        if self.path == '/pg/v4/payment/verify.json':
+            return self._send_json({'data': {'code': 100, 'ref_id': token, 'card_pan': '6037****1234', 'fee': 0}})
+        
+        if self.path == '/v1/request':
+            self._remember(token, data.get('callbackUrl'))
+            return self._send_json({'result': 100, 'trackId': token})
+        if self.path == '/v1/verify':
+            return self._send_json({'result': 100, 'refNumber': token, 'cardNumber': '6037****1234'})
+        
+        if self.path == '/v1/installment/request':
+            self._remember(token, data.get('callback_url'))
+            return self._send_json({
+                'status': 'success',
+                'transaction_id': token,
+                'payment_url': f'{host}/v1/installment/pay/{token}',
+            })
+        if self.path in ('/v1/installment/verify', '/v1/installment/refund'):
+            return self._send_json({'status': 'success', 'refund_id': token})
+        
+        self._send_json({'message': 'not found'}, status=404)
+    
+    def do_GET(self):
+        # صفحه پرداخت درگاه: بازگشت فوری به callback با نتیجه موفق
+        token = self.path.rstrip('/').rsplit('/', 1)[-1]
+        with self.lock:
+            callback_url = self.callbacks.get(token)
+        if not callback_url:
+            return self._send_json({'message': 'not found'}, status=404)
+        
+        if self.path.startswith('/pg/StartPay/'):
+            params = {'Authority': token, 'Status': 'OK'}
+        elif self.path.startswith('/v1/request/'):
+            params = {'trackId': token, 'success': 1, 'status': 2}
+        else:
+            params = {'transaction_id': token, 'status': 'success'}
+        separator = '&' if '?' in callback_url else '?'
+        self._redirect(f'{callback_url}{separator}{urlencode(params)}')
+
+
+class Command(BaseCommand):
+    help = 'اجرای درگاه پرداخت شبیه‌سازی شده برای توسعه و آزمایش محلی'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--mode',
+            choices=['ok', 'error'],
+            default='ok',
+            help='error: پاسخ 503 به همه درخواست‌ها (برای آزمایش تکرار و قطع مدار)'
+        )
+        parser.add_argument(
+            '--delay',
+            type=float,
+            default=0,
+            help='تأخیر پاسخ به ثانیه (برای آزمایش timeout)'
+        )
+    
+    def handle(self, *args, **options):
+        StubGatewayHandler.mode = options['mode']
+        StubGatewayHandler.delay = options['delay']
+        
+        server = ThreadingHTTPServer((options['host'], options['port']), StubGatewayHandler)
+        server.stdout = self.stdout
+        address = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(self.style.SUCCESS(f'درگاه آزمایشی روی {address} اجرا شد'))
+        self.stdout.write(
+            f'برای استفاده ZARINPAL_BASE_URL، ZIBAL_BASE_URL و TERBPAY_BASE_URL را روی {address} تنظیم کنید.'
+        )
+        
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
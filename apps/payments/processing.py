@@ -0,0 +1,258 @@
+"""
+شروع پرداخت آنلاین
+
+ثبت سفارش و پرداخت (در وضعیت pending) در تراکنش تسویه حساب انجام می‌شود و
+درخواست HTTP به درگاه پس از commit و بیرون از هر تراکنشی ارسال می‌شود تا
+قفل سطرهای سفارش و موجودی در مدت انتظار برای درگاه نگه داشته نشود.
+
+شناسه پرداخت (payment_id) کلید یکتایی درخواست درگاه است: پیش از ارسال،
+پرداخت با یک UPDATE شرطی به وضعیت processing برده می‌شود و فقط یک درخواست
+می‌تواند آن را تصاحب کند. آدرس درگاه دریافت شده ذخیره می‌شود تا تلاش‌های
+بعدی (بارگذاری مجدد صفحه یا کلیک دوباره) به همان درخواست هدایت شوند و
+درخواست تکراری به درگاه ارسال نشود.
+
+بازگشت کاربر از درگاه و webhook درگاه فقط یک تسک تأیید در صف Celery قرار
+می‌دهند و کاربر به صفحه وضعیت هدایت می‌شود که نتیجه را دنبال می‌کند؛
+بنابراین تأخیر API تأیید درگاه worker وب را معطل نمی‌کند. به‌روزرسانی
+پرداخت و سفارش با UPDATE شرطی روی وضعیت انجام می‌شود تا تأییدهای تکراری
+یا هم‌زمان (بازگشت کاربر، webhook، تلاش مجدد) فقط یک بار اثر کنند.
+"""
+import logging
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .backends import PaymentGateway
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+# تصاحب پرداختی که درخواست درگاه آن نیمه‌کاره مانده پس از این مدت آزاد می‌شود
+GATEWAY_CLAIM_TIMEOUT = 60
+ACTIVE_STATUSES = ('pending', 'processing')
+VERIFY_QUEUED_KEY = 'payments:verify:queued:{}'
+VERIFY_QUEUED_TIMEOUT = 30
+
+# (پارامتر شناسه تراکنش، پارامتر وضعیت، مقادیر موفق) در بازگشت هر درگاه
+CALLBACK_PARAMS = {
+    'zarinpal': ('Authority', 'Status', ('OK',)),
+    'zibal': ('trackId', 'success', ('1',)),
+    'terbpay': ('transaction_id', 'status', ('success',)),
+}
+
+
+class PaymentInProgress(Exception):
+    """درخواست دیگری در حال اتصال همین پرداخت به درگاه است"""
+    pass
+
+
+class PaymentInitiationError(Exception):
+    """درگاه درخواست پرداخت را نپذیرفت"""
+    pass
+
+
+class VerificationPending(Exception):
+    """نتیجه تأیید به دلیل خطای ارتباط با درگاه هنوز مشخص نیست"""
+    pass
+
+
+def _claim(payment):
+    """تصاحب اتمیک پرداخت برای ارسال درخواست به درگاه"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=GATEWAY_CLAIM_TIMEOUT)
+    return Payment.objects.filter(
+        Q(status__in=['pending', 'failed']) | Q(status='processing', updated_at__lt=stale),
+        pk=payment.pk,
+        provider_transaction_id='',
+    ).update(status='processing', updated_at=now)
+
+
+def _active_payment_url(payment):
+    """آدرس درگاه ذخیره شده فقط برای پرداختی که هنوز در انتظار کاربر است"""
+    if payment.status == 'processing' and payment.provider_transaction_id:
+        return payment.provider_response.get('payment_url')
+    return None
+
+
+def can_retry(payment):
+    """پرداخت پس از ارسال به درگاه لغو یا رد شده و سفارش هنوز پرداخت نشده است"""
+    return (
+        payment.status in ('failed', 'cancelled')
+        and bool(payment.provider_transaction_id)
+        and payment.order.status == 'pending'
+        and payment.order.payment_status != 'paid'
+    )
+
+
+def retry_payment(payment):
+    """پرداخت جدید برای سفارش (درخواست قبلی درگاه دوباره استفاده نمی‌شود)"""
+    return Payment.objects.create(
+        order=payment.order,
+        provider=payment.provider,
+        payment_type=payment.payment_type,
+        amount=payment.amount,
+        currency=payment.currency
+    )
+
+
+def initiate_payment(payment, callback_url):
+    """
+    ارسال درخواست پرداخت به درگاه (فقط یک بار برای هر پرداخت)
+    
+    خروجی آدرس صفحه پرداخت درگاه است. نباید داخل transaction.atomic
+    فراخوانی شود.
+    """
+    payment_url = _active_payment_url(payment)
+    if payment_url:
+        return payment_url
+    if payment.provider_transaction_id:
+        # درخواست درگاه این پرداخت لغو یا رد شده و قابل استفاده دوباره نیست
+        raise PaymentInitiationError('این پرداخت بسته شده است. لطفاً دوباره تلاش کنید.')
+    
+    if not _claim(payment):
+        payment.refresh_from_db(fields=['status', 'provider_transaction_id', 'provider_response'])
+        payment_url = _active_payment_url(payment)
+        if payment_url:
+            return payment_url
+        raise PaymentInProgress('پرداخت در حال اتصال به درگاه است. لطفاً چند لحظه دیگر تلاش کنید.')
+    
+    order_number = payment.order.order_number
+    result = PaymentGateway().create_payment(
+        provider_name=payment.provider.slug,
+        amount=payment.amount,
+        order_number=order_number,
+        callback_url=callback_url,
+        description=f'پرداخت سفارش {order_number}'
+    )
+    
+    if not result['success']:
+        logger.error(f"Payment {payment.payment_id} initiation error: {result['error']}")
+        Payment.objects.filter(pk=payment.pk, status='processing').update(
+            status='failed', failure_reason=result['error'], updated_at=timezone.now()
+        )
+        raise PaymentInitiationError(result['error'])
+    
+    payment.provider_transaction_id = result.get('authority') or result.get('track_id') or result.get('transaction_id')
+    payment.provider_response = result
+    payment.status = 'processing'
+    payment.failure_reason = ''
+    payment.save(update_fields=[
+        'provider_transaction_id', 'provider_response', 'status', 'failure_reason', 'updated_at'
+    ])
+    return result['payment_url']
+
+
+def parse_callback(payment, params):
+    """شناسه تراکنش و موفق بودن پرداخت از پارامترهای بازگشت درگاه"""
+    id_param, status_param, success_values = CALLBACK_PARAMS.get(
+        payment.provider.slug, CALLBACK_PARAMS['zarinpal']
+    )
+    return str(params.get(id_param, '')), str(params.get(status_param, '')) in success_values
+
+
+def queue_verification(payment, countdown=0):
+    """قرار دادن تسک تأیید پرداخت در صف (حداکثر یک بار در VERIFY_QUEUED_TIMEOUT)"""
+    from .tasks import verify_payment_task
+    
+    if cache.add(VERIFY_QUEUED_KEY.format(payment.payment_id), True, VERIFY_QUEUED_TIMEOUT):
+        verify_payment_task.apply_async(args=[str(payment.payment_id)], countdown=countdown)
+
+
+def handle_callback(payment, params):
+    """
+    ثبت بازگشت کاربر یا webhook درگاه
+    
+    پارامترهای بازگشت قابل جعل هستند، بنابراین وضعیت پرداخت فقط با تأیید
+    از درگاه (با شناسه تراکنش ذخیره شده) تغییر می‌کند؛ بازگشت ناموفق هم
+    فقط تأیید را در صف قرار می‌دهد. خروجی موفق بودن گزارش شده توسط درگاه است.
+    """
+    transaction_id, succeeded = parse_callback(payment, params)
+    if transaction_id and payment.provider_transaction_id and transaction_id != payment.provider_transaction_id:
+        logger.warning(f"Payment {payment.payment_id} callback with unknown transaction {transaction_id}")
+        return False
+    
+    if payment.status in ACTIVE_STATUSES and payment.provider_transaction_id:
+        queue_verification(payment)
+    return succeeded
+
+
+def verify_payment(payment_id):
+    """
+    تأیید پرداخت با درگاه و به‌روزرسانی idempotent پرداخت و سفارش
+    
+    خروجی وضعیت پرداخت پس از تأیید است. در خطای ارتباط با درگاه
+    VerificationPending صادر می‌شود تا تسک دوباره تلاش کند.
+    """
+    payment = Payment.objects.select_related('provider').get(payment_id=payment_id)
+    if payment.status not in ACTIVE_STATUSES or not payment.provider_transaction_id:
+        return payment.status
+    
+    result = PaymentGateway().verify_payment(
+        provider_name=payment.provider.slug,
+        transaction_id=payment.provider_transaction_id,
+        amount=payment.amount
+    )
+    now = timezone.now()
+    
+    if not result['success']:
+        if result.get('retryable'):
+            raise VerificationPending(result['error'])
+        failed = Payment.objects.filter(pk=payment.pk, status__in=ACTIVE_STATUSES).update(
+            status='failed', failure_reason=result['error'], updated_at=now
+        )
+        if not failed:
+            return Payment.objects.filter(pk=payment.pk).values_list('status', flat=True).first()
+        return 'failed'
+    
+    from apps.checkout.models import Order
+    
+    with transaction.atomic():
+        completed = Payment.objects.filter(pk=payment.pk, status__in=ACTIVE_STATUSES).update(
+            status='completed',
+            provider_transaction_id=result['transaction_id'],
+            provider_response=result,
+            failure_reason='',
+            completed_at=now,
+            updated_at=now
+        )
+        if not completed:
+            # وضعیت پرداخت هم‌زمان تغییر کرده است
+            return Payment.objects.filter(pk=payment.pk).values_list('status', flat=True).first()
+        Order.objects.filter(pk=payment.order_id).exclude(payment_status='paid').update(
+            payment_status='paid', updated_at=now
+        )
+        Order.objects.filter(pk=payment.order_id, status='pending').update(
+            status='confirmed', confirmed_at=now, updated_at=now
+        )
+    return 'completed'
+
+
+def abandon_verification(payment_id, error):
+    """
+    پایان تلاش‌های تأیید پس از خطاهای پیاپی ارتباط با درگاه
+    
+    پرداخت از وضعیت processing خارج و برای بررسی دستی ناموفق علامت‌گذاری
+    می‌شود تا صفحه وضعیت و تسک دوره‌ای آن را بی‌پایان در صف قرار ندهند.
+    """
+    return Payment.objects.filter(payment_id=payment_id, status__in=ACTIVE_STATUSES).update(
+        status='failed',
+        failure_reason=f'تأیید پرداخت از درگاه ممکن نشد و نیاز به بررسی دستی دارد: {error}',
+        updated_at=timezone.now()
+    )
+
+
+def queue_stale_verifications(age_minutes=20, limit=500):
+    """صف کردن تأیید پرداخت‌هایی که بازگشت یا webhook آن‌ها دریافت نشده است"""
+    cutoff = timezone.now() - timedelta(minutes=age_minutes)
+    payments = Payment.objects.filter(
+        status='processing', updated_at__lt=cutoff
+    ).exclude(provider_transaction_id='').only('pk', 'payment_id').order_by('updated_at')[:limit]
+    
+    count = 0
+    for payment in payments:
+        queue_verification(payment)
+        count += 1
+    return count
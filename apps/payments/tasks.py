@@ -0,0 +1,44 @@
+from celery import shared_task
+from .processing import (
+    VerificationPending, abandon_verification, queue_stale_verifications, verify_payment
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+VERIFY_MAX_RETRIES = 6
+VERIFY_RETRY_DELAY = 10
+
+
+@shared_task(bind=True, max_retries=VERIFY_MAX_RETRIES)
+def verify_payment_task(self, payment_id):
+    """تأیید پرداخت با درگاه و به‌روزرسانی پرداخت و سفارش"""
+    try:
+        status = verify_payment(payment_id)
+        logger.info(f"Payment {payment_id} verified: {status}")
+        return {'success': True, 'status': status}
+    
+    except VerificationPending as e:
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Payment {payment_id} verification gave up: {e}")
+            abandon_verification(payment_id, str(e))
+            return {'success': False, 'error': str(e)}
+        raise self.retry(exc=e, countdown=VERIFY_RETRY_DELAY * 2 ** self.request.retries)
+    
+    except Exception as e:
+        logger.error(f"Payment {payment_id} verification error: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def verify_stale_payments():
+    """صف کردن دوباره تأیید پرداخت‌هایی که نتیجه آن‌ها از درگاه دریافت نشده است"""
+    try:
+        queued = queue_stale_verifications()
+        if queued:
+            logger.info(f"Queued verification of {queued} stale payments")
+        return {'success': True, 'queued': queued}
+    
+    except Exception as e:
+        logger.error(f"Stale payments verification error: {e}")
+        return {'success': False, 'error': str(e)}
@@ -4,7 +4,9 @@ from . import views
 app_name = 'payments'
 
 urlpatterns = [
+    path('start/<uuid:payment_id>/', views.start_payment, name='start_payment'),
     path('verify/<uuid:payment_id>/', views.verify_payment, name='verify_payment'),
+    path('status/<uuid:payment_id>/', views.payment_status, name='payment_status'),
     path('callback/<uuid:payment_id>/', views.payment_callback, name='payment_callback'),
     path('refund/<uuid:payment_id>/', views.refund_payment, name='refund_payment'),
 ]
\ No newline at end of file
@@ -1,3 +1,5 @@
+import json
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
@@ -5,81 +7,94 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction
+from django.urls import reverse
 from .models import Payment, PaymentProvider
 from .backends import PaymentGateway
+from .processing import (
+    PaymentInitiationError, PaymentInProgress, can_retry, handle_callback, initiate_payment,
+    queue_verification, retry_payment
+)
+
+
+@login_required
+def start_payment(request, payment_id):
+    """هدایت به درگاه پرداخت (درخواست درگاه برای هر پرداخت فقط یک بار ارسال می‌شود)"""
+    payment = get_object_or_404(
+        Payment.objects.select_related('order', 'provider'),
+        payment_id=payment_id,
+        order__user=request.user
+    )
+    
+    if can_retry(payment):
+        payment = retry_payment(payment)
+        return redirect('payments:start_payment', payment_id=payment.payment_id)
+    if payment.status not in ('pending', 'processing', 'failed'):
+        return redirect('checkout:checkout_success', order_number=payment.order.order_number)
+    
+    callback_url = request.build_absolute_uri(
+        reverse('payments:verify_payment', kwargs={'payment_id': payment.payment_id})
+    )
+    try:
+        return redirect(initiate_payment(payment, callback_url))
+    except PaymentInProgress as e:
+        messages.info(request, str(e))
+    except PaymentInitiationError as e:
+        messages.error(request, f'خطا در اتصال به درگاه پرداخت: {e}')
+    return redirect('checkout:checkout_success', order_number=payment.order.order_number)
 
 
 @csrf_exempt
 def verify_payment(request, payment_id):
-    """تأیید پرداخت"""
-    payment = get_object_or_404(Payment, payment_id=payment_id)
+    """بازگشت کاربر از درگاه: صف کردن تأیید و هدایت به صفحه وضعیت"""
+    payment = get_object_or_404(Payment.objects.select_related('provider'), payment_id=payment_id)
     
-    if request.method == 'GET':
-        # دریافت پارامترهای بازگشت از درگاه
-        authority = request.GET.get('Authority')
-        status = request.GET.get('Status')
-        
-        if status == 'OK' and authority:
-            try:
-                with transaction.atomic():
-                    # تأیید پرداخت
-                    gateway = PaymentGateway()
-                    result = gateway.verify_payment(
-                        provider_name=payment.provider.slug,
-                        transaction_id=authority,
-                        amount=payment.amount
-                    )
-                    
-                    if result['success']:
-                        # به‌روزرسانی وضعیت پرداخت
-                        payment.status = 'completed'
-                        payment.provider_transaction_id = result['transaction_id']
-                        payment.provider_response = result
-                        payment.save()
-                        
-                        # به‌روزرسانی وضعیت سفارش
-                        payment.order.payment_status = 'paid'
-                        payment.order.status = 'confirmed'
-                        payment.order.save()
-                        
-                        messages.success(request, 'پرداخت با موفقیت انجام شد.')
-                        return redirect('checkout:checkout_success', order_number=payment.order.order_number)
-                    else:
-                        payment.status = 'failed'
-                        payment.failure_reason = result['error']
-                        payment.save()
-                        
-                        messages.error(request, f'پرداخت ناموفق: {result["error"]}')
-                        return redirect('checkout:checkout_cancel')
-            
-            except Exception as e:
-                payment.status = 'failed'
-                payment.failure_reason = str(e)
-                payment.save()
-                
-                messages.error(request, f'خطا در تأیید پرداخت: {str(e)}')
-                return redirect('checkout:checkout_cancel')
-        else:
-            payment.status = 'cancelled'
-            payment.save()
-            
-            messages.warning(request, 'پرداخت لغو شد.')
-            return redirect('checkout:checkout_cancel')
-    
-    return redirect('core:home')
+    # نتیجه نهایی پس از تأیید از درگاه در صفحه وضعیت نمایش داده می‌شود
+    handle_callback(payment, request.GET)
+    return redirect('payments:payment_status', payment_id=payment.payment_id)
 
 
 @csrf_exempt
 def payment_callback(request, payment_id):
-    """کالبک پرداخت"""
-    payment = get_object_or_404(Payment, payment_id=payment_id)
+    """webhook درگاه پرداخت (فقط تأیید در صف قرار می‌گیرد)"""
+    payment = get_object_or_404(Payment.objects.select_related('provider'), payment_id=payment_id)
     
-    # این endpoint برای دریافت کالبک از درگاه‌های پرداخت استفاده می‌شود
-    # بسته به درگاه پرداخت، پارامترهای مختلفی دریافت می‌شود
+    params = request.POST or request.GET
+    if not params and request.content_type == 'application/json':
+        try:
+            params = json.loads(request.body or b'{}')
+        except ValueError:
+            params = {}
     
+    handle_callback(payment, params)
     return JsonResponse({'status': 'received'})
 
 
+@login_required
+def payment_status(request, payment_id):
+    """صفحه وضعیت پرداخت (با htmx هر چند ثانیه به‌روز می‌شود)"""
+    payment = get_object_or_404(
+        Payment.objects.select_related('order', 'provider'),
+        payment_id=payment_id,
+        order__user=request.user
+    )
+    
+    # اگر تسک قبلی به نتیجه نرسیده باشد تأیید دوباره در صف قرار می‌گیرد
+    if payment.status == 'processing' and payment.provider_transaction_id:
+        queue_verification(payment)
+    
+    if request.headers.get('HX-Request'):
+        response = render(request, 'payments/_payment_status.html', {'payment': payment})
+        if payment.is_successful:
+            response['HX-Redirect'] = reverse(
+                'checkout:checkout_success', kwargs={'order_number': payment.order.order_number}
+            )
+        return response
+    
+    if payment.is_successful:
+        return redirect('checkout:checkout_success', order_number=payment.order.order_number)
+    return render(request, 'payments/payment_status.html', {'payment': payment})
+
+
 @login_required
 @require_POST
 @csrf_exempt
@@ -142,6 +142,11 @@ class SMSGateway:
         message = f"سفارش شما با شماره {order_number} ثبت شد.\nبه زودی با شما تماس خواهیم گرفت.\nسیستمکده"
         return self.send_sms(phone, message)
     
+    def send_abandoned_cart_reminder(self, phone, name):
+        """ارسال یادآوری سبد خرید رها شده"""
+        message = f"{name} عزیز، محصولات سبد خرید شما هنوز منتظر شما هستند!\nبرای تکمیل خرید به سیستمکده سر بزنید."
+        return self.send_sms(phone, message)
+    
     def send_marketing(self, phone, message):
         """ارسال پیام بازاریابی"""
         return self.send_sms(phone, message)
\ No newline at end of file
@@ -76,6 +76,29 @@ def send_order_confirmation_sms(phone, order_number):
         return {'success': False, 'error': str(e)}
 
 
+@shared_task
+def send_abandoned_cart_sms(phone, name):
+    """ارسال یادآوری سبد خرید رها شده"""
+    try:
+        gateway = SMSGateway()
+        result = gateway.send_abandoned_cart_reminder(phone, name)
+        
+        # ذخیره لاگ
+        SMSLog.objects.create(
+            phone=phone,
+            message=f"یادآوری سبد خرید برای {name}",
+            status='sent' if result['success'] else 'failed',
+            response=str(result),
+            cost=result.get('cost', 0)
+        )
+        
+        return result
+        
+    except Exception as e:
+        logger.error(f"Abandoned cart SMS task error: {e}")
+        return {'success': False, 'error': str(e)}
+
+
 @shared_task
 def send_marketing_campaign(campaign_id):
     """ارسال کمپین بازاریابی"""
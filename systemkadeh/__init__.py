@@ -1 +1,4 @@
-# SystemKadeh E-commerce Platform
\ No newline at end of file
+# SystemKadeh E-commerce Platform
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -0,0 +1,12 @@
+"""
+Celery configuration for SystemKadeh project.
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'systemkadeh.settings')
+
+app = Celery('systemkadeh')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -28,6 +28,7 @@ DJANGO_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.sitemaps',
     'django.contrib.sites',
+    'django.contrib.postgres',
 ]
 
 THIRD_PARTY_APPS = [
@@ -87,6 +88,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'apps.core.context_processors.site_settings',
                 'apps.cart.context_processors.cart',
+                'apps.catalog.context_processors.navigation',
             ],
         },
     },
@@ -175,6 +177,47 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'flush-view-counters': {
+        'task': 'apps.core.tasks.flush_view_counters',
+        'schedule': 60.0,
+    },
+    'refresh-sale-prices': {
+        'task': 'apps.catalog.tasks.refresh_sale_prices',
+        'schedule': 60.0 * 5,
+    },
+    'refresh-related-products': {
+        'task': 'apps.catalog.tasks.refresh_related_products',
+        'schedule': 60.0 * 60,
+    },
+    'release-expired-stock-reservations': {
+        'task': 'apps.cart.tasks.release_expired_stock_reservations',
+        'schedule': 60.0,
+    },
+    'cleanup-stale-carts': {
+        'task': 'apps.cart.tasks.cleanup_stale_carts',
+        'schedule': 60.0 * 60,
+    },
+    'queue-abandoned-cart-reminders': {
+        'task': 'apps.cart.tasks.queue_abandoned_cart_reminders',
+        'schedule': 60.0 * 30,
+    },
+    'verify-stale-payments': {
+        'task': 'apps.payments.tasks.verify_stale_payments',
+        'schedule': 60.0 * 10,
+    },
+}
+
+# Cart Configuration
+CART_RESERVATION_MINUTES = config('CART_RESERVATION_MINUTES', default=30, cast=int)
+CART_GUEST_STORAGE = config('CART_GUEST_STORAGE', default='apps.cart.storage.RedisCartStorage')
+CART_STALE_DAYS = config('CART_STALE_DAYS', default=30, cast=int)
+CART_ABANDONED_HOURS = config('CART_ABANDONED_HOURS', default=24, cast=int)
+
+# Order Configuration
+ORDER_NUMBER_START = config('ORDER_NUMBER_START', default=1000000, cast=int)
+ORDER_NUMBER_BLOCK_SIZE = config('ORDER_NUMBER_BLOCK_SIZE', default=20, cast=int)
 
 # Email Configuration
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
@@ -193,14 +236,17 @@ PAYMENT_PROVIDERS = {
     'zarinpal': {
         'merchant_id': config('ZARINPAL_MERCHANT_ID', default=''),
         'sandbox': config('ZARINPAL_SANDBOX', default=True, cast=bool),
+        'base_url': config('ZARINPAL_BASE_URL', default=''),
     },
     'zibal': {
         'merchant_id': config('ZIBAL_MERCHANT_ID', default=''),
         'sandbox': config('ZIBAL_SANDBOX', default=True, cast=bool),
+        'base_url': config('ZIBAL_BASE_URL', default=''),
     },
     'terbpay': {
         'api_key': config('TERBPAY_API_KEY', default=''),
         'sandbox': config('TERBPAY_SANDBOX', default=True, cast=bool),
+        'base_url': config('TERBPAY_BASE_URL', default=''),
     },
     'snappay': {
         'api_key': config('SNAPPAY_API_KEY', default=''),
@@ -212,6 +258,12 @@ PAYMENT_PROVIDERS = {
     },
 }
 
+PAYMENT_CONNECT_TIMEOUT = config('PAYMENT_CONNECT_TIMEOUT', default=3.05, cast=float)
+PAYMENT_READ_TIMEOUT = config('PAYMENT_READ_TIMEOUT', default=10, cast=float)
+PAYMENT_MAX_RETRIES = config('PAYMENT_MAX_RETRIES', default=2, cast=int)
+PAYMENT_CIRCUIT_THRESHOLD = config('PAYMENT_CIRCUIT_THRESHOLD', default=5, cast=int)
+PAYMENT_CIRCUIT_COOLDOWN = config('PAYMENT_CIRCUIT_COOLDOWN', default=30, cast=int)
+
 # Logging Configuration
 LOGGING = {
     'version': 1,